@@ -1,5 +1,6 @@
-from django.contrib import admin
-from .models import Campaign
+from django.contrib import admin, messages
+from .models import Campaign, ValidationJob, IdempotencyRecord
+from .tasks import revalidate_campaigns_task
 
 @admin.register(Campaign)
 class CampaignAdmin(admin.ModelAdmin):
@@ -7,5 +8,26 @@ class CampaignAdmin(admin.ModelAdmin):
     list_filter = ('category', 'status', 'starting_date', 'ending_date')
     search_fields = ('title', 'description', 'location', 'created_by__email')
     ordering = ('-created_at',)
+    actions = ['revalidate_documents']
+
+    @admin.action(description='Re-validate medical documents of selected campaigns')
+    def revalidate_documents(self, request, queryset):
+        campaign_ids = list(queryset.filter(category='MEDICAL').values_list('id', flat=True))
+        if not campaign_ids:
+            self.message_user(request, 'No Medical campaigns selected.', messages.WARNING)
+            return
+        revalidate_campaigns_task.delay(campaign_ids)
+        self.message_user(request, f'Queued re-validation of {len(campaign_ids)} Medical campaigns.')
+
+@admin.register(ValidationJob)
+class ValidationJobAdmin(admin.ModelAdmin):
+    list_display = ('campaign', 'state', 'progress', 'result', 'created_at', 'finished_at')
+    list_filter = ('state', 'result')
+    readonly_fields = ('task_id', 'started_at', 'finished_at')
+
+@admin.register(IdempotencyRecord)
+class IdempotencyRecordAdmin(admin.ModelAdmin):
+    list_display = ('key', 'user', 'status_code', 'created_at', 'expires_at')
+    search_fields = ('key', 'user__email')
 
 # Register your models here.
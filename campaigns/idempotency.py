@@ -0,0 +1,123 @@
+# Idempotency-Key support for API views that create things.
+#
+# The first request with a key claims it and stores its response; a retry with
+# the same key and payload gets that response back without running the view.
+import time
+import hashlib
+import logging
+import datetime
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyRecord
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.1
+
+
+def request_fingerprint(request):
+    """SHA-256 of the method, path, form values and uploaded file contents."""
+    digest = hashlib.sha256(f'{request.method} {request.path}'.encode())
+    data = request.data
+    items = data.lists() if hasattr(data, 'lists') else ((name, [value]) for name, value in data.items())
+    for name, values in sorted(items, key=lambda item: item[0]):
+        for value in values:
+            digest.update(b'\0' + name.encode() + b'=')
+            if hasattr(value, 'chunks'):
+                for chunk in value.chunks():
+                    digest.update(chunk)
+                value.seek(0)
+            else:
+                digest.update(str(value).encode())
+    return digest.hexdigest()
+
+
+def claim(user, key, fingerprint):
+    """Return (record, created): a new in-flight record, or the live one already holding the key."""
+    now = timezone.now()
+    IdempotencyRecord.objects.filter(user=user, expires_at__lt=now).delete()
+    stale = now - datetime.timedelta(seconds=getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 300))
+    # An in-flight record this old belongs to a request that died; let the retry take it over.
+    IdempotencyRecord.objects.filter(user=user, key=key, status_code=None, created_at__lt=stale).delete()
+    try:
+        with transaction.atomic():
+            return IdempotencyRecord.objects.create(
+                user=user, key=key, fingerprint=fingerprint,
+                expires_at=now + datetime.timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 3600)),
+            ), True
+    except IntegrityError:
+        return IdempotencyRecord.objects.filter(user=user, key=key).first(), False
+
+
+def wait_for_response(record):
+    """Poll an in-flight record until its response is stored or the wait times out.
+
+    Returns the refreshed record, or None when the first request gave up the key.
+    """
+    deadline = time.monotonic() + getattr(settings, 'IDEMPOTENCY_WAIT_TIMEOUT', 30)
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        record = IdempotencyRecord.objects.filter(pk=record.pk).first()
+        if record is None or record.status_code is not None:
+            return record
+    return record
+
+
+def replay(record):
+    return Response(record.response, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent(view_method):
+    """Make an APIView handler honour the Idempotency-Key header for authenticated users.
+
+    Responses other than 429 and 5xx are kept for IDEMPOTENCY_KEY_TTL seconds.
+    A concurrent duplicate waits for the first request's response, and reusing
+    a key for a different payload is refused with 422.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key or not request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({'error': 'Idempotency-Key must be at most 255 characters'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = request_fingerprint(request)
+        record, created = claim(request.user, key, fingerprint)
+        if not created:
+            if record is None:  # Expired and deleted between the insert and the lookup
+                return view_method(self, request, *args, **kwargs)
+            if record.fingerprint != fingerprint:
+                return Response({'error': 'Idempotency-Key was already used for a different request'},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if record.status_code is None:
+                logger.debug(f"Waiting for in-flight request with Idempotency-Key {key}")
+                record = wait_for_response(record)
+                if record is None:  # The first request failed and released the key
+                    return wrapper(self, request, *args, **kwargs)
+                if record.status_code is None:
+                    return Response({'error': 'A request with this Idempotency-Key is still in progress'},
+                                    status=status.HTTP_409_CONFLICT, headers={'Retry-After': '5'})
+            logger.info(f"Replaying response for Idempotency-Key {key}")
+            return replay(record)
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+        if response.status_code == status.HTTP_429_TOO_MANY_REQUESTS or response.status_code >= 500:
+            record.delete()
+        else:
+            IdempotencyRecord.objects.filter(pk=record.pk).update(
+                status_code=response.status_code, response=response.data,
+            )
+        return response
+    return wrapper
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from campaigns.tasks import requeue_stalled_validations
+
+
+class Command(BaseCommand):
+    help = ('Queue the document validation of VALIDATING Medical campaigns again when their task never '
+            'reached the broker or its worker died.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-after', type=int,
+                            help='Seconds a queued or running job may go without starting (VALIDATION_REQUEUE_AFTER).')
+        parser.add_argument('--failed', action='store_true', help='Also requeue jobs whose validation failed.')
+
+    def handle(self, *args, **options):
+        campaign_ids = requeue_stalled_validations(options['stale_after'], failed=options['failed'])
+        self.stdout.write(self.style.SUCCESS(f'Requeued {len(campaign_ids)} validations'))
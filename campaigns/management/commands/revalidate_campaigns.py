@@ -0,0 +1,48 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from campaigns.revalidation import revalidate_campaigns, revalidation_queryset
+
+
+class Command(BaseCommand):
+    help = 'Validate stored Medical campaign documents again against the current hospitals, diseases and stamps.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', action='append', dest='statuses',
+                            help='Campaign status to re-check; repeatable. Defaults to REJECTED.')
+        parser.add_argument('--ids', help='Comma-separated campaign ids, instead of every campaign in the statuses.')
+        parser.add_argument('--workers', type=int, help='Validation processes (REVALIDATION_WORKERS).')
+        parser.add_argument('--chunk-size', type=int, help='Verdicts per bulk write (REVALIDATION_CHUNK_SIZE).')
+        parser.add_argument('--checkpoint', default='revalidation_checkpoint.json',
+                            help='File recording the last campaign id written.')
+        parser.add_argument('--resume', action='store_true', help='Skip campaigns up to the checkpointed id.')
+
+    def handle(self, *args, **options):
+        campaigns = revalidation_queryset(options['statuses'] or ['REJECTED'])
+        if options['ids']:
+            campaigns = campaigns.filter(id__in=[int(value) for value in options['ids'].split(',')])
+
+        checkpoint_path = options['checkpoint']
+        if options['resume']:
+            if not os.path.exists(checkpoint_path):
+                raise CommandError(f'No checkpoint at {checkpoint_path}')
+            with open(checkpoint_path) as f:
+                last_id = json.load(f)['last_id']
+            campaigns = campaigns.filter(id__gt=last_id)
+            self.stdout.write(f'Resuming after campaign {last_id}')
+
+        def checkpoint(campaign_id):
+            with open(checkpoint_path + '.tmp', 'w') as f:
+                json.dump({'last_id': campaign_id}, f)
+            os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+        stats = revalidate_campaigns(
+            campaigns,
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            checkpoint=checkpoint,
+            report=lambda stats: self.stdout.write(str(stats)),
+        )
+        self.stdout.write(self.style.SUCCESS(f'Done: {stats}'))
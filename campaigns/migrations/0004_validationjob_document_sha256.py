@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0003_validation_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='validationjob',
+            name='document_sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
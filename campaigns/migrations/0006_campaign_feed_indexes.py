@@ -0,0 +1,21 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0005_idempotency_record'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='campaign',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='campaign_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='campaign',
+            index=models.Index(fields=['status', 'category', 'created_at', 'id'], name='campaign_status_cat_idx'),
+        ),
+    ]
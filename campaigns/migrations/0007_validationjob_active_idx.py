@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-18 14:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0006_campaign_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='validationjob',
+            index=models.Index(condition=models.Q(('state__in', ['QUEUED', 'RUNNING'])), fields=['state'], name='validationjob_active_idx'),
+        ),
+    ]
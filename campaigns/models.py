@@ -13,6 +13,7 @@ class Campaign(models.Model):
     )
     STATUS_CHOICES = (
         ('PENDING', 'Pending'),
+        ('VALIDATING', 'Validating'),
         ('APPROVED', 'Approved'),
         ('REJECTED', 'Rejected'),
     )
@@ -34,6 +35,13 @@ class Campaign(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pages of the public feed: newest first within a status, optionally a category.
+            models.Index(fields=['status', 'created_at', 'id'], name='campaign_status_idx'),
+            models.Index(fields=['status', 'category', 'created_at', 'id'], name='campaign_status_cat_idx'),
+        ]
+
     def __str__(self):
         return f"{self.title} - {self.status}"
 
@@ -44,4 +52,55 @@ class Campaign(models.Model):
         if self.ending_date <= self.starting_date:
             raise ValidationError("Ending date must be after starting date.")
 
+
+class ValidationJob(models.Model):
+    """Background validation of a Medical campaign document."""
+    STATE_CHOICES = (
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    )
+
+    campaign = models.OneToOneField(Campaign, on_delete=models.CASCADE, related_name='validation_job')
+    task_id = models.CharField(max_length=255, blank=True)
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default='QUEUED')
+    progress = models.PositiveSmallIntegerField(default=0)
+    result = models.CharField(max_length=20, blank=True)
+    reason = models.TextField(blank=True)
+    # Content hash of the validated document, linking the job to its DocumentEvidence.
+    document_sha256 = models.CharField(max_length=64, blank=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Counting the validation backlog on every Medical upload reads only unfinished jobs.
+            models.Index(fields=['state'], name='validationjob_active_idx',
+                         condition=models.Q(state__in=['QUEUED', 'RUNNING'])),
+        ]
+
+    def __str__(self):
+        return f"Validation of {self.campaign_id} - {self.state}"
+
+
+class IdempotencyRecord(models.Model):
+    """A client's Idempotency-Key with the fingerprint of its request and, once finished, the response."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)  # None while in flight
+    response = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} - {self.status_code or 'in flight'}"
+
 # Create your models here.
@@ -0,0 +1,63 @@
+# Keyset pagination for the public campaign feed.
+import base64
+import binascii
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CampaignCursorPagination:
+    """Newest first, paged on (created_at, id).
+
+    The cursor is the (created_at, id) of the last campaign on the page and the
+    next page is the rows strictly after it, so with an index ending in
+    (created_at, id) every page costs the same however deep it is.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def encode_cursor(self, campaign):
+        position = f'{campaign.created_at.isoformat()}|{campaign.id}'
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            created_at, campaign_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            created_at, campaign_id = parse_datetime(created_at), int(campaign_id)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            created_at = None
+        if created_at is None:
+            raise NotFound('Invalid cursor')
+        return created_at, campaign_id
+
+    def get_page_size(self, request):
+        default = getattr(settings, 'CAMPAIGN_FEED_PAGE_SIZE', 20)
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, default))
+        except ValueError:
+            size = default
+        return max(1, min(size, getattr(settings, 'CAMPAIGN_FEED_MAX_PAGE_SIZE', 100)))
+
+    def paginate_queryset(self, queryset, request):
+        self.request = request
+        queryset = queryset.order_by('-created_at', '-id')
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            created_at, campaign_id = self.decode_cursor(cursor)
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=campaign_id))
+        page_size = self.get_page_size(request)
+        page = list(queryset[:page_size + 1])
+        self.next_cursor = self.encode_cursor(page[page_size - 1]) if len(page) > page_size else None
+        return page[:page_size]
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
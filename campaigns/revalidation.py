@@ -0,0 +1,180 @@
+# Re-check stored Medical campaign documents against the current reference data.
+import os
+import time
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import Campaign, ValidationJob
+from system_validator.admission import AdmissionRejected, admission
+from system_validator.validator import validate_pdf
+
+logger = logging.getLogger(__name__)
+
+
+def revalidation_queryset(statuses=('REJECTED',)):
+    """Medical campaigns in the given statuses that have a document, in id order."""
+    return (Campaign.objects.filter(category='MEDICAL', status__in=statuses)
+            .exclude(document='').order_by('id'))
+
+
+def validate_document(campaign_id, document_name):
+    """Validate one stored campaign document. Returns (campaign_id, result, reason, failed, sha256).
+
+    Takes a validation slot on this host like uploads do, waiting as long as
+    it takes instead of failing the document when the queue is full.
+    """
+    while True:
+        try:
+            with admission.admit(f'revalidation of campaign {campaign_id}'), \
+                    default_storage.open(document_name, 'rb') as document:
+                verdict = validate_pdf(File(document, name=os.path.basename(document_name)))
+        except AdmissionRejected as e:
+            time.sleep(e.retry_after)
+            continue
+        except Exception as e:
+            logger.error(f"Revalidation of campaign {campaign_id} failed: {str(e)}")
+            return campaign_id, 'REJECTED', f'Validation error: {str(e)}', True, ''
+        return campaign_id, verdict['result'], verdict['reason'], 'error' in verdict, verdict.get('sha256', '')
+
+
+class RevalidationStats:
+    """Running totals and throughput of a revalidation run."""
+
+    def __init__(self, total):
+        self.total = total
+        self.started = time.monotonic()
+        self.processed = self.accepted = self.rejected = self.failed = 0
+
+    def add(self, result, failed):
+        self.processed += 1
+        if failed:
+            self.failed += 1
+        elif result == 'ACCEPTED':
+            self.accepted += 1
+        else:
+            self.rejected += 1
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.processed / elapsed if elapsed else 0.0
+
+    def __str__(self):
+        remaining = self.total - self.processed
+        eta = f', ETA {remaining / self.rate / 60:.0f} min' if self.rate and remaining else ''
+        return (f'{self.processed}/{self.total} processed: {self.accepted} accepted, {self.rejected} rejected, '
+                f'{self.failed} failed, {self.rate:.2f} documents/s{eta}')
+
+
+def write_results(results):
+    """Store a chunk of (campaign_id, result, reason, failed, sha256) with bulk updates.
+
+    Failed documents keep their campaign status; their job is marked FAILED.
+    """
+    now = timezone.now()
+    by_campaign = {result[0]: result[1:] for result in results}
+    campaigns = []
+    for campaign in Campaign.objects.filter(id__in=by_campaign).only('id', 'status'):
+        result, reason, failed, sha256 = by_campaign[campaign.id]
+        if not failed:
+            campaign.status = 'APPROVED' if result == 'ACCEPTED' else 'REJECTED'
+            campaign.updated_at = now
+            campaigns.append(campaign)
+
+    jobs = {job.campaign_id: job for job in ValidationJob.objects.filter(campaign_id__in=by_campaign)}
+    new_jobs = []
+    for campaign_id, (result, reason, failed, sha256) in by_campaign.items():
+        job = jobs.get(campaign_id)
+        if job is None:
+            job = ValidationJob(campaign_id=campaign_id, started_at=now)
+            new_jobs.append(job)
+        job.state = 'FAILED' if failed else 'DONE'
+        job.progress = 100
+        job.result = result
+        job.reason = reason
+        job.finished_at = now
+        job.document_sha256 = sha256 or job.document_sha256
+
+    with transaction.atomic():
+        Campaign.objects.bulk_update(campaigns, ['status', 'updated_at'])
+        ValidationJob.objects.bulk_update(
+            list(jobs.values()), ['state', 'progress', 'result', 'reason', 'finished_at', 'document_sha256']
+        )
+        ValidationJob.objects.bulk_create(new_jobs)
+
+
+def revalidate_campaigns(queryset, workers=None, chunk_size=None, checkpoint=None, report=None):
+    """Validate the documents of ``queryset`` again and write the verdicts back.
+
+    Documents are streamed in id order through a pool of ``workers`` forked
+    processes (``REVALIDATION_WORKERS``), with at most two per worker in flight.
+    Verdicts are written in bulk every ``chunk_size`` documents
+    (``REVALIDATION_CHUNK_SIZE``). After each write ``checkpoint`` is called with
+    the highest id up to which every campaign has been written, so an
+    interrupted run can resume with ``id__gt``. ``report`` receives the stats.
+    """
+    workers = workers or getattr(settings, 'REVALIDATION_WORKERS', os.cpu_count() or 1)
+    chunk_size = chunk_size or getattr(settings, 'REVALIDATION_CHUNK_SIZE', 100)
+    checkpoint = checkpoint or (lambda campaign_id: None)
+    report = report or (lambda stats: None)
+    stats = RevalidationStats(queryset.count())
+    documents = queryset.values_list('id', 'document').iterator(chunk_size=chunk_size)
+
+    submitted = deque()
+    written = set()
+    pending_results = []
+
+    def flush():
+        write_results(pending_results)
+        written.update(result[0] for result in pending_results)
+        pending_results.clear()
+        last_id = None
+        while submitted and submitted[0] in written:
+            last_id = submitted.popleft()
+            written.discard(last_id)
+        if last_id is not None:
+            checkpoint(last_id)
+        report(stats)
+
+    def collect(result):
+        stats.add(result[1], result[3])
+        pending_results.append(result)
+        if len(pending_results) >= chunk_size:
+            flush()
+
+    try:
+        if workers <= 1:
+            for campaign_id, document_name in documents:
+                submitted.append(campaign_id)
+                collect(validate_document(campaign_id, document_name))
+        else:
+            # Read the id list first: an open cursor would not survive closing connections for the fork.
+            documents = list(documents)
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+            try:
+                in_flight = set()
+                for campaign_id, document_name in documents:
+                    if len(in_flight) >= 2 * workers:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            collect(future.result())
+                    submitted.append(campaign_id)
+                    in_flight.add(pool.submit(validate_document, campaign_id, document_name))
+                for future in wait(in_flight).done:
+                    collect(future.result())
+            finally:
+                pool.shutdown(cancel_futures=True)
+    finally:
+        # Keep whatever finished before an interruption.
+        if pending_results:
+            flush()
+    return stats
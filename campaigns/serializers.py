@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Campaign
+from .models import Campaign, ValidationJob
 import decimal
 
 class CampaignSerializer(serializers.ModelSerializer):
@@ -25,4 +25,43 @@ class CampaignListSerializer(serializers.ModelSerializer):
             'id', 'title', 'category', 'description', 'goal_amount',
             'starting_date', 'ending_date', 'location', 'image',
             'document', 'status', 'created_at'
-        ]
\ No newline at end of file
+        ]
+
+class CampaignFeedFilterSerializer(serializers.Serializer):
+    """Query parameters of the public campaign feed; all optional."""
+    category = serializers.ChoiceField(choices=Campaign.CATEGORY_CHOICES, required=False)
+    location = serializers.CharField(max_length=200, required=False)
+    date_from = serializers.DateField(required=False, help_text='Campaigns still running on or after this date.')
+    date_to = serializers.DateField(required=False, help_text='Campaigns starting on or before this date.')
+    goal_min = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    goal_max = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+
+    def validate(self, data):
+        if 'date_from' in data and 'date_to' in data and data['date_from'] > data['date_to']:
+            raise serializers.ValidationError("date_from must not be after date_to.")
+        if 'goal_min' in data and 'goal_max' in data and data['goal_min'] > data['goal_max']:
+            raise serializers.ValidationError("goal_min must not be above goal_max.")
+        return data
+
+    def filter_queryset(self, queryset):
+        data = self.validated_data
+        if 'category' in data:
+            queryset = queryset.filter(category=data['category'])
+        if 'location' in data:
+            queryset = queryset.filter(location__icontains=data['location'])
+        if 'date_from' in data:
+            queryset = queryset.filter(ending_date__gte=data['date_from'])
+        if 'date_to' in data:
+            queryset = queryset.filter(starting_date__lte=data['date_to'])
+        if 'goal_min' in data:
+            queryset = queryset.filter(goal_amount__gte=data['goal_min'])
+        if 'goal_max' in data:
+            queryset = queryset.filter(goal_amount__lte=data['goal_max'])
+        return queryset
+
+class ValidationJobSerializer(serializers.ModelSerializer):
+    campaign_status = serializers.CharField(source='campaign.status', read_only=True)
+
+    class Meta:
+        model = ValidationJob
+        fields = ['campaign', 'campaign_status', 'state', 'progress', 'result', 'reason', 'created_at', 'started_at', 'finished_at']
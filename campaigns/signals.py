@@ -0,0 +1,26 @@
+# Apply verdicts that changed when added reference data was checked against stored evidence.
+import logging
+
+from django.dispatch import receiver
+
+from system_validator.signals import evidence_rechecked
+from .models import Campaign
+from .revalidation import write_results
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(evidence_rechecked)
+def update_rechecked_campaigns(sender, verdicts, **kwargs):
+    """Give REJECTED Medical campaigns whose document was re-checked the new verdict and reason."""
+    campaigns = Campaign.objects.filter(
+        category='MEDICAL', status='REJECTED', validation_job__document_sha256__in=list(verdicts),
+    ).values_list('id', 'validation_job__document_sha256')
+    results = [
+        (campaign_id, verdicts[sha256]['result'], verdicts[sha256]['reason'], False, sha256)
+        for campaign_id, sha256 in campaigns
+    ]
+    if results:
+        write_results(results)
+        approved = sum(result[1] == 'ACCEPTED' for result in results)
+        logger.info(f"Re-checked {len(results)} rejected campaigns, {approved} now approved")
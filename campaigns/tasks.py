@@ -1,7 +1,19 @@
 # campaign/tasks.py
+import logging
+from datetime import timedelta
+
 from celery import shared_task
+from django.conf import settings
 from django.core.mail import send_mail
-from .models import Campaign
+from django.db.models import Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Campaign, ValidationJob
+from .revalidation import revalidate_campaigns, revalidation_queryset
+from system_validator.admission import AdmissionRejected, admission
+from system_validator.validator import validate_pdf
+
+logger = logging.getLogger(__name__)
 
 @shared_task
 def send_campaign_status_email(campaign_id):
@@ -21,4 +33,109 @@ def send_campaign_status_email(campaign_id):
             'from@example.com',
             [email],
             fail_silently=False,
-        )
\ No newline at end of file
+        )
+
+
+@shared_task(bind=True, max_retries=None)
+def validate_campaign_document(self, campaign_id):
+    """Run the medical document validation for a VALIDATING campaign.
+
+    Waits for a validation slot on this host and retries later when none frees up.
+    A validation that fails says nothing about the document, so the job is marked
+    FAILED and the campaign stays VALIDATING until it is queued again.
+    """
+    campaign = Campaign.objects.select_related('validation_job').get(id=campaign_id)
+    job = campaign.validation_job
+    jobs = ValidationJob.objects.filter(pk=job.pk)
+    jobs.update(state='RUNNING', started_at=timezone.now())
+
+    def report(percent):
+        jobs.update(progress=percent)
+
+    try:
+        with admission.admit(f'campaign {campaign_id}'), campaign.document.open('rb') as document:
+            validation_result = validate_pdf(document, progress=report)
+    except AdmissionRejected as e:
+        jobs.update(state='QUEUED')
+        raise self.retry(countdown=e.retry_after)
+    except Exception as e:
+        validation_result = {'result': 'REJECTED', 'reason': f'Validation error: {str(e)}', 'error': str(e)}
+
+    if 'error' in validation_result:
+        logger.error(f"Validation task failed for campaign {campaign_id}: {validation_result['error']}")
+        jobs.update(state='FAILED', reason=validation_result['reason'], finished_at=timezone.now())
+        return
+
+    campaign.status = 'APPROVED' if validation_result['result'] == 'ACCEPTED' else 'REJECTED'
+    campaign.save(update_fields=['status', 'updated_at'])
+    jobs.update(
+        state='DONE',
+        progress=100,
+        result=validation_result['result'],
+        reason=validation_result['reason'],
+        document_sha256=validation_result.get('sha256', ''),
+        finished_at=timezone.now(),
+    )
+    logger.info(f"Medical campaign {campaign_id} {campaign.status.lower()}: {validation_result['reason']}")
+
+
+def queue_validation(campaign_id):
+    """Send a campaign document to the Celery validation task.
+
+    Runs after the campaign is committed. When the broker cannot be reached the
+    job stays QUEUED without a task id and ``requeue_stalled_validations``
+    sends it later.
+    """
+    try:
+        result = validate_campaign_document.delay(campaign_id)
+    except Exception as e:
+        logger.error(f"Could not queue validation of campaign {campaign_id}, it will be requeued: {str(e)}")
+        return
+    ValidationJob.objects.filter(campaign_id=campaign_id).update(task_id=result.id)
+
+
+def validation_backlog():
+    """Medical validations queued or running on any host, including tasks still waiting in the broker."""
+    return ValidationJob.objects.filter(state__in=['QUEUED', 'RUNNING']).count()
+
+
+def requeue_stalled_validations(stale_after=None, failed=False):
+    """Queue the validation of VALIDATING campaigns again when their job stalled.
+
+    A QUEUED or RUNNING job stalled when it has not started for ``stale_after``
+    seconds (``VALIDATION_REQUEUE_AFTER``): its task never reached the broker or
+    its worker died. ``failed`` also requeues FAILED jobs. Returns the campaign ids.
+    """
+    stale_after = stale_after or getattr(settings, 'VALIDATION_REQUEUE_AFTER', 3600)
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    stalled = Q(state__in=['QUEUED', 'RUNNING'], last_activity__lt=cutoff)
+    if failed:
+        stalled |= Q(state='FAILED')
+    campaign_ids = list(
+        ValidationJob.objects.filter(campaign__status='VALIDATING')
+        .annotate(last_activity=Coalesce('started_at', 'created_at'))
+        .filter(stalled).values_list('campaign_id', flat=True)
+    )
+    for campaign_id in campaign_ids:
+        # started_at restarts the stall clock, as it does for tasks waiting for admission.
+        ValidationJob.objects.filter(campaign_id=campaign_id).update(
+            state='QUEUED', task_id='', progress=0, reason='', started_at=timezone.now(), finished_at=None,
+        )
+        queue_validation(campaign_id)
+    if campaign_ids:
+        logger.warning(f"Requeued {len(campaign_ids)} stalled validations: {campaign_ids}")
+    return campaign_ids
+
+
+@shared_task
+def requeue_stalled_validations_task():
+    requeue_stalled_validations()
+
+
+@shared_task
+def revalidate_campaigns_task(campaign_ids):
+    """Re-check the documents of the given Medical campaigns, as chosen in the admin."""
+    statuses = [status for status, _ in Campaign.STATUS_CHOICES]
+    campaigns = revalidation_queryset(statuses).filter(id__in=campaign_ids)
+    stats = revalidate_campaigns(campaigns, report=lambda stats: logger.info(f"Revalidation: {stats}"))
+    logger.info(f"Revalidation finished: {stats}")
@@ -1,10 +1,27 @@
-from django.test import TestCase
+from django.db import connection
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
+from django.contrib.auth import get_user_model
 from django.contrib.auth.models import User
-from .models import Campaign
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+from unittest import mock
+from .models import Campaign, IdempotencyRecord, ValidationJob
+from .revalidation import revalidate_campaigns, revalidation_queryset, validate_document
+from .tasks import requeue_stalled_validations, validate_campaign_document
+from django.utils import timezone
+from system_validator.admission import AdmissionRejected
+from system_validator.signals import evidence_rechecked
+from system_validator.models import DocumentEvidence
 import datetime
+import io
+import re
+import shutil
+import tempfile
 
 class CampaignTests(TestCase):
     def setUp(self):
@@ -55,7 +72,330 @@ class CampaignTests(TestCase):
         self.client.login(username='testuser', password='testpass')
         response = self.client.get(reverse('api_campaigns'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['status'], 'APPROVED')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['status'], 'APPROVED')
 
 # Create your tests here.
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (4, 4), 'white').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class MedicalCampaignValidationTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='applicant@example.com', password='testpass', first_name='Test', last_name='User'
+        )
+        self.client.force_authenticate(self.user)
+
+    def medical_campaign_data(self):
+        return {
+            'title': 'Surgery',
+            'category': 'MEDICAL',
+            'description': 'Help with surgery costs',
+            'goal_amount': '1000.00',
+            'starting_date': datetime.date.today() + datetime.timedelta(days=1),
+            'ending_date': datetime.date.today() + datetime.timedelta(days=10),
+            'location': 'Addis Ababa',
+            'image': SimpleUploadedFile('photo.png', png_bytes(), content_type='image/png'),
+            'document': SimpleUploadedFile('letter.pdf', b'%PDF-1.4', content_type='application/pdf'),
+        }
+
+    @mock.patch('campaigns.tasks.validate_campaign_document.delay')
+    def test_medical_campaign_is_saved_as_validating(self, delay):
+        delay.return_value.id = 'task-1'
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('api_campaign_create'), self.medical_campaign_data(), format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['status'], 'VALIDATING')
+        campaign = Campaign.objects.get()
+        delay.assert_called_once_with(campaign.id)
+        self.assertEqual(campaign.validation_job.task_id, 'task-1')
+
+        response = self.client.get(response.data['validation_status_url'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['state'], 'QUEUED')
+
+    @mock.patch('campaigns.tasks.validate_pdf')
+    @mock.patch('campaigns.tasks.validate_campaign_document.delay')
+    def test_task_records_verdict_and_progress(self, delay, validate_pdf):
+        def fake_validate(document, progress):
+            progress(50)
+            return {'result': 'REJECTED', 'reason': 'This doctor is not an authorized approver'}
+        validate_pdf.side_effect = fake_validate
+        self.client.post(reverse('api_campaign_create'), self.medical_campaign_data(), format='multipart')
+        campaign = Campaign.objects.get()
+
+        validate_campaign_document(campaign.id)
+
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, 'REJECTED')
+        response = self.client.get(reverse('api_campaign_validation', kwargs={'campaign_id': campaign.id}))
+        self.assertEqual(response.data['state'], 'DONE')
+        self.assertEqual(response.data['progress'], 100)
+        self.assertEqual(response.data['reason'], 'This doctor is not an authorized approver')
+
+    @mock.patch('campaigns.tasks.validate_campaign_document.delay')
+    def test_campaign_is_saved_and_requeued_when_the_broker_is_down(self, delay):
+        delay.side_effect = ConnectionError('broker unreachable')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('api_campaign_create'), self.medical_campaign_data(), format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        campaign = Campaign.objects.get()
+        self.assertEqual((campaign.status, campaign.validation_job.task_id), ('VALIDATING', ''))
+
+        delay.side_effect = None
+        delay.return_value.id = 'task-2'
+        self.assertEqual(requeue_stalled_validations(), [])
+        with mock.patch('campaigns.tasks.timezone.now', return_value=timezone.now() + datetime.timedelta(hours=2)):
+            call_command('requeue_validations', stdout=io.StringIO())
+        delay.assert_called_with(campaign.id)
+        job = ValidationJob.objects.get(campaign=campaign)
+        self.assertEqual((job.state, job.task_id), ('QUEUED', 'task-2'))
+
+        ValidationJob.objects.update(state='FAILED')
+        self.assertEqual(requeue_stalled_validations(), [])
+        self.assertEqual(requeue_stalled_validations(failed=True), [campaign.id])
+
+    @mock.patch('campaigns.tasks.validate_pdf')
+    @mock.patch('campaigns.tasks.validate_campaign_document.delay')
+    def test_failed_validation_leaves_the_campaign_validating(self, delay, validate_pdf):
+        self.client.post(reverse('api_campaign_create'), self.medical_campaign_data(), format='multipart')
+        campaign = Campaign.objects.get()
+        for failure in ({'result': 'REJECTED', 'reason': 'Validation error: no poppler', 'error': 'no poppler'},
+                        OSError('document missing')):
+            validate_pdf.side_effect = [failure]
+
+            validate_campaign_document(campaign.id)
+
+            campaign.refresh_from_db()
+            self.assertEqual(campaign.status, 'VALIDATING')
+            job = ValidationJob.objects.get(campaign=campaign)
+            self.assertEqual((job.state, job.result), ('FAILED', ''))
+            self.assertTrue(job.reason.startswith('Validation error: '))
+
+    @mock.patch('campaigns.revalidation.validate_pdf')
+    def test_bulk_revalidation_writes_verdicts_and_checkpoints(self, validate_pdf):
+        for _ in range(3):
+            with mock.patch('campaigns.tasks.validate_campaign_document.delay'):
+                self.client.post(reverse('api_campaign_create'), self.medical_campaign_data(), format='multipart')
+        Campaign.objects.update(status='REJECTED')
+        first, second, third = Campaign.objects.order_by('id')
+        validate_pdf.side_effect = [
+            {'result': 'ACCEPTED', 'reason': 'Valid'},
+            {'result': 'REJECTED', 'reason': 'Invalid'},
+            {'result': 'REJECTED', 'reason': 'Validation error: broken', 'error': 'broken'},
+        ]
+        checkpoints = []
+
+        stats = revalidate_campaigns(revalidation_queryset(), workers=1, chunk_size=2,
+                                     checkpoint=checkpoints.append)
+
+        self.assertEqual((stats.processed, stats.accepted, stats.rejected, stats.failed), (3, 1, 1, 1))
+        self.assertEqual(checkpoints, [second.id, third.id])
+        self.assertEqual(Campaign.objects.get(id=first.id).status, 'APPROVED')
+        self.assertEqual(ValidationJob.objects.get(campaign=third).state, 'FAILED')
+        self.assertEqual(ValidationJob.objects.get(campaign=first).reason, 'Valid')
+        self.assertEqual(revalidation_queryset().filter(id__gt=checkpoints[-1]).count(), 0)
+
+    def test_rechecked_evidence_approves_rejected_campaigns(self):
+        with mock.patch('campaigns.tasks.validate_campaign_document.delay'):
+            self.client.post(reverse('api_campaign_create'), self.medical_campaign_data(), format='multipart')
+        campaign = Campaign.objects.get()
+        Campaign.objects.update(status='REJECTED')
+        ValidationJob.objects.update(document_sha256='abc', state='DONE', reason='This doctor is not an authorized approver')
+
+        evidence_rechecked.send(sender=DocumentEvidence, verdicts={
+            'abc': {'result': 'ACCEPTED', 'reason': 'Valid hospital, disease, and stamp found'},
+            'other': {'result': 'ACCEPTED', 'reason': 'Valid hospital, disease, and stamp found'},
+        })
+
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, 'APPROVED')
+        self.assertEqual(campaign.validation_job.reason, 'Valid hospital, disease, and stamp found')
+
+    def test_adding_an_unrelated_stamp_changes_no_campaign(self):
+        import cv2
+        import numpy as np
+        from system_validator import benchmark, evidence, signals, utils
+        from system_validator.engine import validation_engine
+        from system_validator.models import DoctorStamp, ReferenceVersion
+
+        with mock.patch('campaigns.tasks.validate_campaign_document.delay'):
+            self.client.post(reverse('api_campaign_create'), self.medical_campaign_data(), format='multipart')
+        campaign = Campaign.objects.get()
+        Campaign.objects.update(status='REJECTED')
+        ValidationJob.objects.update(document_sha256='abc', state='DONE', reason='This doctor is not an authorized approver')
+        # Two round stamps with the same printed rings and different strokes inside.
+        rng = np.random.default_rng(3)
+        on_letter, unrelated = (benchmark.make_stamp(rng) for _ in range(2))
+        keypoints, descriptors = utils.stamp_features(cv2.cvtColor(on_letter, cv2.COLOR_RGB2GRAY))
+        evidence.store('abc', 'black lion hospital. diagnosis: leukemia', {
+            'hospital': {'name': 'Black Lion Hospital', 'score': 100.0},
+            'disease': {'name': 'Leukemia', 'score': 100.0},
+            'stamp': None,
+        }, [(1, descriptors, keypoints)])
+
+        buffer = io.BytesIO()
+        Image.fromarray(unrelated).save(buffer, 'PNG')
+        with self.captureOnCommitCallbacks(execute=True), mock.patch.object(signals, 'queue_recheck'):
+            stamp = DoctorStamp.objects.create(
+                image=SimpleUploadedFile('unrelated.png', buffer.getvalue(), content_type='image/png'))
+        self.assertEqual(validation_engine.recheck(ReferenceVersion.STAMP, stamp.pk), 0)
+
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, 'REJECTED')
+        self.assertIsNone(DocumentEvidence.objects.get(sha256='abc').stamp)
+
+    @override_settings(VALIDATION_MAX_BACKLOG=1)
+    @mock.patch('campaigns.tasks.validate_campaign_document.delay')
+    def test_medical_campaign_is_turned_away_while_validation_is_saturated(self, delay):
+        delay.return_value.id = 'task-1'
+        # The first job waits in the broker, which no per-host slot count sees.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('api_campaign_create'), self.medical_campaign_data(), format='multipart')
+        response = self.client.post(reverse('api_campaign_create'), self.medical_campaign_data(), format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(Campaign.objects.count(), 1)
+        delay.assert_called_once()
+
+        ValidationJob.objects.update(state='DONE')
+        response = self.client.post(reverse('api_campaign_create'), self.medical_campaign_data(), format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    @mock.patch('campaigns.revalidation.time.sleep')
+    @mock.patch('campaigns.revalidation.validate_pdf', return_value={'result': 'ACCEPTED', 'reason': 'Valid'})
+    def test_bulk_revalidation_waits_for_a_validation_slot(self, validate_pdf, sleep):
+        with mock.patch('campaigns.tasks.validate_campaign_document.delay'):
+            self.client.post(reverse('api_campaign_create'), self.medical_campaign_data(), format='multipart')
+        campaign = Campaign.objects.get()
+        admit = mock.MagicMock(side_effect=[AdmissionRejected('Validation queue is full', 7), mock.MagicMock()])
+        with mock.patch('campaigns.revalidation.admission.admit', admit):
+            result = validate_document(campaign.id, campaign.document.name)
+        self.assertEqual(result[1:4], ('ACCEPTED', 'Valid', False))
+        self.assertEqual(admit.call_count, 2)
+        sleep.assert_called_once_with(7)
+
+    @mock.patch('campaigns.tasks.validate_campaign_document.delay')
+    def test_retry_with_idempotency_key_replays_the_first_response(self, delay):
+        delay.return_value.id = 'task-1'
+        data = self.medical_campaign_data()
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.client.post(reverse('api_campaign_create'), data, format='multipart', HTTP_IDEMPOTENCY_KEY='k1')
+        for upload in (data['image'], data['document']):
+            upload.seek(0)
+        with mock.patch('campaigns.serializers.CampaignSerializer.save') as save:
+            retry = self.client.post(reverse('api_campaign_create'), data, format='multipart', HTTP_IDEMPOTENCY_KEY='k1')
+        save.assert_not_called()
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Campaign.objects.count(), 1)
+        delay.assert_called_once()
+
+        other = self.medical_campaign_data()
+        other['title'] = 'Another surgery'
+        response = self.client.post(reverse('api_campaign_create'), other, format='multipart', HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    @mock.patch('campaigns.tasks.validate_campaign_document.delay')
+    def test_concurrent_duplicate_waits_for_the_in_flight_request(self, delay):
+        data = self.medical_campaign_data()
+        def in_flight(user, key, fingerprint):
+            return IdempotencyRecord.objects.create(
+                user=user, key=key, fingerprint=fingerprint, expires_at=timezone.now() + datetime.timedelta(hours=1),
+            ), False
+
+        with mock.patch('campaigns.idempotency.claim', side_effect=in_flight):
+            def finish(seconds):
+                IdempotencyRecord.objects.update(status_code=201, response={'id': 99})
+            with mock.patch('campaigns.idempotency.time.sleep', side_effect=finish):
+                response = self.client.post(reverse('api_campaign_create'), data, format='multipart',
+                                            HTTP_IDEMPOTENCY_KEY='k2')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'id': 99})
+        self.assertFalse(Campaign.objects.exists())
+        delay.assert_not_called()
+
+
+class CampaignFeedTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='owner@example.com', password='testpass', first_name='Test', last_name='User'
+        )
+        today = datetime.date.today()
+        self.campaigns = [
+            Campaign.objects.create(
+                title=f'Campaign {i}', category='MEDICAL' if i % 2 else 'ACADEMIC', description='Help',
+                goal_amount=100 * (i + 1), starting_date=today + datetime.timedelta(days=i),
+                ending_date=today + datetime.timedelta(days=i + 10), location='Addis Ababa' if i < 3 else 'Hawassa',
+                image='images/photo.png', document='documents/letter.pdf', status='APPROVED', created_by=self.user,
+            )
+            for i in range(5)
+        ]
+        Campaign.objects.create(
+            title='Pending', category='MEDICAL', description='Help', goal_amount=100, starting_date=today,
+            ending_date=today + datetime.timedelta(days=1), location='Addis Ababa', image='images/photo.png',
+            document='documents/letter.pdf', status='PENDING', created_by=self.user,
+        )
+        # Ties on created_at are broken by id.
+        Campaign.objects.filter(id__in=[c.id for c in self.campaigns[1:4]]).update(
+            created_at=self.campaigns[2].created_at)
+
+    def titles(self, response):
+        return [campaign['title'] for campaign in response.data['results']]
+
+    def test_pages_walk_the_feed_newest_first_without_repeats(self):
+        url = reverse('api_campaigns') + '?page_size=2'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(self.titles(response))
+            url = response.data['next']
+        expected = Campaign.objects.filter(status='APPROVED').order_by('-created_at', '-id')
+        self.assertEqual(seen, [campaign.title for campaign in expected])
+        self.assertEqual(len(seen), 5)
+
+    def test_filters(self):
+        today = datetime.date.today()
+        response = self.client.get(reverse('api_campaigns'), {'category': 'MEDICAL', 'goal_min': '150'})
+        self.assertEqual(sorted(self.titles(response)), ['Campaign 1', 'Campaign 3'])
+        response = self.client.get(reverse('api_campaigns'), {
+            'location': 'hawassa', 'date_to': (today + datetime.timedelta(days=3)).isoformat()})
+        self.assertEqual(self.titles(response), ['Campaign 3'])
+        response = self.client.get(reverse('api_campaigns'), {'goal_min': '300', 'goal_max': '100'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('api_campaigns'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_feed_query_is_covered_by_the_status_indexes(self):
+        indexes = {index.name: index.fields for index in Campaign._meta.indexes}
+        self.assertEqual(indexes['campaign_status_idx'], ['status', 'created_at', 'id'])
+        self.assertEqual(indexes['campaign_status_cat_idx'], ['status', 'category', 'created_at', 'id'])
+
+        next_page = self.client.get(reverse('api_campaigns'), {'category': 'MEDICAL', 'page_size': 1}).data['next']
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(next_page).status_code, status.HTTP_200_OK)
+        statements = [re.sub(r'[`"]', '', query['sql']).lower() for query in queries]
+        [sql] = [statement for statement in statements if ' from campaigns_campaign ' in statement]
+        where, order_by = sql.split(' where ')[1].split(' order by ')
+        # Equality on the leading index columns, then a range and ordering on the trailing ones.
+        self.assertIn('campaigns_campaign.status = ', where)
+        self.assertIn('campaigns_campaign.category = ', where)
+        self.assertIn('campaigns_campaign.created_at < ', where)
+        self.assertTrue(order_by.startswith('campaigns_campaign.created_at desc, campaigns_campaign.id desc'))
@@ -13,19 +13,26 @@ from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from .models import Campaign
 from .serializers import CampaignSerializer, CampaignListSerializer
 
-from .models import Campaign
-from .serializers import CampaignSerializer, CampaignListSerializer
-from system_validator.utils import validate_pdf
+from .models import Campaign, ValidationJob
+from .serializers import CampaignSerializer, CampaignListSerializer, ValidationJobSerializer, CampaignFeedFilterSerializer
+from .pagination import CampaignCursorPagination
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
 import logging
 
-from .tasks import send_campaign_status_email  # This is the task we created to send emails
+from .tasks import send_campaign_status_email, queue_validation, validation_backlog  # Celery tasks for status emails and document validation
 from rest_framework import generics            # Importing generics for class-based views
+from rest_framework.exceptions import Throttled
+from system_validator.admission import admission
+from .idempotency import idempotent
 
 logger = logging.getLogger(__name__)
 
 class CampaignCreateAPI(APIView):
     permission_classes = [IsAuthenticated]
     
+    @idempotent
     def post(self, request):
         serializer = CampaignSerializer(data=request.data)
         if not serializer.is_valid():
@@ -39,33 +46,54 @@ class CampaignCreateAPI(APIView):
             if not pdf_file:
                 logger.warning("Medical campaign submitted without PDF")
                 return Response({'error': 'PDF document required for Medical campaigns'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            logger.debug(f"Validating PDF: {pdf_file.name}")
-            validation_result = validate_pdf(pdf_file)
-            
-            if validation_result['result'] == 'ACCEPTED':
-                logger.info("Medical campaign approved")
-                serializer.save(created_by=request.user, status='APPROVED')
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
-            else:
-                logger.warning(f"Medical campaign rejected: {validation_result['reason']}")
-                serializer.save(created_by=request.user, status='REJECTED')
-                response_data = serializer.data
-                response_data['validation_reason'] = validation_result['reason']
-                return Response(response_data, status=status.HTTP_201_CREATED)
+            backlog = validation_backlog()
+            if backlog >= getattr(settings, 'VALIDATION_MAX_BACKLOG', 200):
+                logger.warning(f"Validation backlog of {backlog} documents, turning away Medical campaign")
+                raise Throttled(wait=admission.retry_after(),
+                                detail='Document validation is at capacity, please try again later.')
+
+            with transaction.atomic():
+                campaign = serializer.save(created_by=request.user, status='VALIDATING')
+                ValidationJob.objects.create(campaign=campaign)
+                # The campaign is saved either way; a job that could not be queued is requeued later.
+                transaction.on_commit(lambda: queue_validation(campaign.id), robust=True)
+            logger.debug(f"Queued validation of PDF: {pdf_file.name}")
+            response_data = serializer.data
+            response_data['validation_status_url'] = reverse('api_campaign_validation', kwargs={'campaign_id': campaign.id})
+            return Response(response_data, status=status.HTTP_201_CREATED)
         
         logger.debug("Saving non-Medical campaign")
         serializer.save(created_by=request.user, status='PENDING')
         return Response(serializer.data, status=status.HTTP_201_CREATED)
         logger.error(f"Serializer errors: {serializer.errors}")
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class CampaignValidationStatusAPI(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, campaign_id):
+        try:
+            job = ValidationJob.objects.select_related('campaign').get(campaign_id=campaign_id)
+        except ValidationJob.DoesNotExist:
+            return Response({'error': 'Validation job not found'}, status=status.HTTP_404_NOT_FOUND)
+        if job.campaign.created_by_id != request.user.id and not request.user.is_staff:
+            return Response({'error': 'Validation job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(ValidationJobSerializer(job).data)
+
 class CampaignListAPI(APIView):
+    """Approved campaigns, newest first, filtered by the query parameters and cursor-paginated."""
     permission_classes = []
-    
+    pagination_class = CampaignCursorPagination
+
     def get(self, request):
-        campaigns = Campaign.objects.filter(status='APPROVED')
-        serializer = CampaignListSerializer(campaigns, many=True)
-        return Response(serializer.data)
+        filters = CampaignFeedFilterSerializer(data=request.query_params)
+        if not filters.is_valid():
+            return Response(filters.errors, status=status.HTTP_400_BAD_REQUEST)
+        campaigns = filters.filter_queryset(Campaign.objects.filter(status='APPROVED'))
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(campaigns, request)
+        serializer = CampaignListSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
 class AdminCampaignReviewAPI(APIView):
     permission_classes = [IsAdminUser]
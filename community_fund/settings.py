@@ -54,6 +54,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'system_validator.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -174,6 +175,13 @@ EMAIL_HOST_PASSWORD = 'rhwv toyf nvsz rcsk'
 # Celery settings
 CELERY_BROKER_URL = 'redis://localhost:6379/1'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/1'
+# Run with "celery -A community_fund beat" to requeue Medical validations whose task was lost.
+CELERY_BEAT_SCHEDULE = {
+    'requeue-stalled-validations': {
+        'task': 'campaigns.tasks.requeue_stalled_validations_task',
+        'schedule': 300,
+    },
+}
 
 
 
@@ -192,3 +200,68 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
 }
+
+# System validator settings
+STAMP_TEMPLATE_CACHE_SIZE = 512  # DoctorStamp template pyramids kept in memory per process
+# STAMP_DESCRIPTOR_DIR = MEDIA_ROOT / 'stamps' / 'orb'  # Shared, memory-mapped ORB descriptor store (default)
+STAMP_INDEX_TOP_K = 5  # Stamps verified per candidate after index retrieval
+STAMP_INDEX_REBUILD_RATIO = 0.2  # Rebuild the LSH base once pending changes exceed this share of it
+VALIDATOR_PAGE_WORKERS = 1  # >1 searches PDF pages for stamps in a forked process pool
+VALIDATOR_OCR_DPI = 200  # Page resolution handed to Tesseract
+VALIDATOR_OCR_PAGE_MODE = 'L'
+VALIDATOR_STAMP_DPI = 200  # Page resolution handed to stamp extraction
+VALIDATOR_STAMP_PAGE_MODE = 'RGB'  # Colour lets ink region proposals order the search; 'L' searches whole pages
+VALIDATOR_MAX_DPI = 300
+VALIDATOR_MAX_PAGES = 50  # Later pages of longer uploads are ignored
+VALIDATOR_PAGE_WINDOW = 2  # Pages rendered per Poppler call
+VALIDATOR_PAGE_MEMORY_BUDGET = 256 * 1024 * 1024  # Bytes of rendered pages kept per document
+TESSERACT_CMD = 'tesseract'  # e.g. r"C:\Program Files\Tesseract-OCR\tesseract.exe" on Windows
+TESSERACT_TESSDATA = None  # tessdata directory for tesserocr workers; None uses the built-in default
+# 'tesserocr' worker pool, 'cli' batched tesseract runs, or 'auto'. tesserocr is not in requirements.txt
+# because it builds against the Tesseract headers; without it 'auto' uses 'cli' and manage.py warns (W001).
+VALIDATOR_OCR_ENGINE = 'auto'
+VALIDATOR_OCR_WORKERS = 2  # Long-lived tesserocr worker processes
+VALIDATOR_OCR_BATCH = 4  # Pages submitted to the OCR engine at once
+VALIDATOR_OCR_LANG = 'eng'
+VALIDATOR_OCR_PSM = 3  # Tesseract page segmentation mode
+VALIDATOR_STAMP_SEARCH = 'coarse_to_fine'  # or 'exhaustive' full-page matching at every template scale
+VALIDATOR_STAMP_COARSE_FACTOR = 0.25  # Page and template downsampling for the coarse pass
+VALIDATOR_STAMP_COARSE_SCALE_STEP = 1.1  # Ratio between neighbouring scales tried in the coarse pass
+VALIDATOR_STAMP_COARSE_CANDIDATES = 5  # Coarse hits refined at full resolution
+VALIDATOR_STAMP_COARSE_THRESHOLD = 0.3
+VALIDATOR_DEBUG_DIR = None  # Directory for page and stamp candidate debug images; None disables dumps
+VALIDATOR_DEBUG_SAMPLE_RATE = 0.05  # Fraction of pages dumped when VALIDATOR_DEBUG_DIR is set
+VALIDATOR_STAMP_REGIONS = True  # Search blue, violet and red ink regions of colour pages before the whole page
+VALIDATOR_STAMP_MAX_REGIONS = 3
+VALIDATOR_STAMP_REGION_MIN_AREA = 0.0005  # Ink region bounding box limits, as fractions of the page area
+VALIDATOR_STAMP_REGION_MAX_AREA = 0.2
+VALIDATOR_OCR_LAYOUT = True  # OCR text blocks letterhead first and stop once hospital and disease are found
+VALIDATOR_OCR_BLOCK_PSM = 6  # Tesseract page segmentation mode for a single text block
+# /metrics/ access. With METRICS_TOKEN set, scrapers must send "Authorization: Bearer <token>"
+# (Prometheus bearer_token) and the IP list is ignored. Without it only METRICS_ALLOWED_IPS may scrape,
+# matched on REMOTE_ADDR, which behind a reverse proxy is the proxy's address: set a token there.
+METRICS_TOKEN = None
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+METRICS_CELERY_QUEUES = ['celery']  # Broker queues reported as celery_queue_depth
+REVALIDATION_WORKERS = 4  # Processes used by revalidate_campaigns and the admin re-validate action
+REVALIDATION_CHUNK_SIZE = 100  # Verdicts written back per bulk update
+VALIDATION_REQUEUE_AFTER = 3600  # Seconds a queued or running validation job may go without starting before it is requeued
+VALIDATOR_EVIDENCE_BATCH_SIZE = 500  # Evidence rows saved per batch when added reference data is re-checked
+VALIDATOR_STAMP_RATIO_TEST = 0.75  # Lowe ratio for stamps re-checked against stored candidates
+VALIDATOR_STAMP_MIN_INLIERS = 40  # RANSAC inliers a re-checked stamp needs before it can approve a campaign
+VALIDATOR_STAMP_MIN_INLIER_RATIO = 0.5  # Share of ratio-test matches those inliers must make up
+VALIDATOR_CONCURRENCY = 2  # Validations run at once per host, across web and Celery processes
+VALIDATOR_QUEUE_SIZE = 8  # Validations waiting for a slot per host before requests get 429
+VALIDATOR_QUEUE_TIMEOUT = 30  # Seconds a validation waits for a slot before it is turned away
+VALIDATION_MAX_BACKLOG = 200  # Medical validations queued or running on all hosts before uploads get 429
+VALIDATOR_ADMISSION_DIR = None  # Directory of per-host slot lock files; None uses the system temp directory
+IDEMPOTENCY_KEY_TTL = 24 * 3600  # Seconds an Idempotency-Key and its stored response are kept
+IDEMPOTENCY_WAIT_TIMEOUT = 30  # Seconds a duplicate request waits for the first one to finish
+IDEMPOTENCY_LOCK_TIMEOUT = 300  # Seconds after which an unfinished request's key can be taken over
+# Build validator state in AppConfig.ready(); enable for gunicorn.conf.py (preload_app) and Celery prefork masters.
+# Send SIGHUP to the master after reference data changes so newly forked workers start with current state.
+VALIDATOR_WARMUP = False
+
+# Campaign feed settings
+CAMPAIGN_FEED_PAGE_SIZE = 20  # Campaigns per page of /api/campaigns/
+CAMPAIGN_FEED_MAX_PAGE_SIZE = 100  # Largest ?page_size= accepted
@@ -0,0 +1,11 @@
+# gunicorn -c gunicorn.conf.py community_fund.wsgi
+#
+# The app is loaded in the master, so with VALIDATOR_WARMUP on the workers
+# inherit the validator's warmed state. Send SIGHUP after changing hospitals,
+# diseases or stamps to rebuild that state and replace the workers.
+preload_app = True
+
+
+def on_reload(server):
+    from system_validator.warmup import warm_up_on_reload
+    warm_up_on_reload()
@@ -1,6 +1,8 @@
 from django.contrib import admin
-from .models import Hospital, DiseaseType, DoctorStamp
+from .models import Hospital, DiseaseType, DoctorStamp, ValidationResult, DocumentEvidence
 
 admin.site.register(Hospital)
 admin.site.register(DiseaseType)
 admin.site.register(DoctorStamp)
+admin.site.register(ValidationResult)
+admin.site.register(DocumentEvidence)
@@ -0,0 +1,140 @@
+# Admission control for document validation on this host.
+#
+# At most VALIDATOR_CONCURRENCY validations run at once across every gunicorn
+# and Celery process on the host, and at most VALIDATOR_QUEUE_SIZE more wait
+# for a turn. Both are counted with exclusive locks on slot files in
+# VALIDATOR_ADMISSION_DIR, which the OS releases if a process dies.
+import math
+import os
+import time
+import random
+import logging
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .metrics import ADMISSION_REJECTED, ADMISSION_RUNNING, ADMISSION_WAIT, ADMISSION_WAITING
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.05
+
+
+class AdmissionRejected(Exception):
+    """The validation queue is full or the wait timed out; retry after ``retry_after`` seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _try_lock(f):
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class SlotPool:
+    """``count`` numbered slots shared by the processes of one host."""
+
+    def __init__(self, directory, name, count):
+        self.paths = [os.path.join(directory, f'{name}.{slot}.lock') for slot in range(count)]
+
+    def acquire(self):
+        """Take a free slot without blocking; returns a handle for ``release`` or None."""
+        if not self.paths:
+            return None
+        start = random.randrange(len(self.paths))
+        for path in self.paths[start:] + self.paths[:start]:
+            f = open(path, 'a+b')
+            if _try_lock(f):
+                return f
+            f.close()
+        return None
+
+    def release(self, handle):
+        _unlock(handle)
+        handle.close()
+
+
+class AdmissionController:
+    """Bound how many validations run and wait on this host."""
+
+    def __init__(self):
+        self.mean_runtime = 5.0  # Seconds, updated as validations finish in this process
+
+    def _pools(self):
+        directory = getattr(settings, 'VALIDATOR_ADMISSION_DIR', None) or os.path.join(
+            tempfile.gettempdir(), 'validator_admission')
+        os.makedirs(directory, exist_ok=True)
+        concurrency = getattr(settings, 'VALIDATOR_CONCURRENCY', os.cpu_count() or 1)
+        queue_size = getattr(settings, 'VALIDATOR_QUEUE_SIZE', 2 * concurrency)
+        return SlotPool(directory, 'running', concurrency), SlotPool(directory, 'waiting', queue_size)
+
+    def retry_after(self):
+        """Seconds after which a rejected client may find room again."""
+        concurrency = max(1, getattr(settings, 'VALIDATOR_CONCURRENCY', os.cpu_count() or 1))
+        queue_size = getattr(settings, 'VALIDATOR_QUEUE_SIZE', 2 * concurrency)
+        return max(1, math.ceil(self.mean_runtime * (1 + queue_size / concurrency)))
+
+    @contextmanager
+    def admit(self, label='validation'):
+        """Run the enclosed validation once a slot is free.
+
+        Waits up to VALIDATOR_QUEUE_TIMEOUT seconds in a bounded queue, and
+        raises AdmissionRejected when the queue is full or the wait times out.
+        """
+        running, waiting = self._pools()
+        started = time.monotonic()
+        slot = running.acquire()
+        if slot is None:
+            place = waiting.acquire()
+            if place is None:
+                ADMISSION_REJECTED.labels('queue_full').inc()
+                logger.warning(f"Validation queue full, rejecting {label}")
+                raise AdmissionRejected('Validation queue is full', self.retry_after())
+            ADMISSION_WAITING.inc()
+            try:
+                deadline = started + getattr(settings, 'VALIDATOR_QUEUE_TIMEOUT', 30)
+                while slot is None and time.monotonic() < deadline:
+                    time.sleep(POLL_INTERVAL)
+                    slot = running.acquire()
+            finally:
+                ADMISSION_WAITING.dec()
+                waiting.release(place)
+            if slot is None:
+                ADMISSION_REJECTED.labels('timeout').inc()
+                logger.warning(f"Timed out waiting for a validation slot, rejecting {label}")
+                raise AdmissionRejected('Timed out waiting for a validation slot', self.retry_after())
+        waited = time.monotonic() - started
+        ADMISSION_WAIT.observe(waited)
+        ADMISSION_RUNNING.inc()
+        try:
+            yield waited
+        finally:
+            ADMISSION_RUNNING.dec()
+            running.release(slot)
+            self.mean_runtime = 0.8 * self.mean_runtime + 0.2 * (time.monotonic() - started - waited)
+
+
+admission = AdmissionController()
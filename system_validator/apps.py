@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class SystemValidatorConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'system_validator'
+
+    def ready(self):
+        from . import checks, signals, metrics  # noqa: F401
+        if getattr(settings, 'VALIDATOR_WARMUP', False):
+            from .warmup import warm_up_on_ready
+            warm_up_on_ready()
@@ -0,0 +1,347 @@
+# Synthetic medical letter corpus and runner for benchmarking validate_pdf.
+import os
+import sys
+import time
+import shutil
+import hashlib
+import logging
+import platform
+import tempfile
+import contextlib
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_save
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from PIL import Image
+
+from .models import Hospital, DiseaseType, DoctorStamp, DocumentEvidence, ValidationResult
+from .profiling import max_rss
+from . import signals
+
+logger = logging.getLogger(__name__)
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792  # US Letter in points
+INKS = [(30, 40, 180), (90, 30, 150), (180, 30, 40)]  # Blue, violet and red, RGB
+PLACES = ['Adama', 'Bahir Dar', 'Dessie', 'Gondar', 'Hawassa', 'Jimma', 'Mekelle', 'Harar', 'Dire Dawa', 'Axum']
+KINDS = ['General', 'Referral', 'Memorial', 'University', 'Specialized', 'Community']
+DISEASES = [
+    'Acute Lymphoblastic Leukemia', 'Chronic Kidney Disease', 'Breast Cancer', 'Congestive Heart Failure',
+    'Multidrug Resistant Tuberculosis', 'Aplastic Anemia', 'Hepatocellular Carcinoma', 'Rheumatic Heart Disease',
+]
+FILLER = [
+    'The patient was admitted for further evaluation and treatment.',
+    'Laboratory results and imaging findings are attached to this letter.',
+    'Continued follow-up at our outpatient clinic is recommended.',
+    'We kindly request support for the cost of the planned treatment.',
+    'The treatment plan was discussed with the patient and family.',
+]
+
+
+def make_stamp(rng, size=240):
+    """Draw a round or rectangular stamp with text-like strokes in a random ink, as an RGB array."""
+    image = np.full((size, size, 3), 255, dtype=np.uint8)
+    ink = INKS[rng.integers(len(INKS))]
+    center = (size // 2, size // 2)
+    if rng.random() < 0.7:
+        cv2.circle(image, center, size // 2 - 6, ink, 4)
+        cv2.circle(image, center, size // 3, ink, 2)
+    else:
+        cv2.rectangle(image, (6, size // 5), (size - 6, size - size // 5), ink, 4)
+    for _ in range(int(rng.integers(10, 20))):
+        x1, y1, x2, y2 = (int(v) for v in rng.integers(size // 4, 3 * size // 4, 4))
+        cv2.line(image, (x1, y1), (x2, y2), ink, 2)
+    return image
+
+
+def rotate(image, angle):
+    height, width = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    border = (255,) * image.shape[2] if image.ndim == 3 else 255
+    return cv2.warpAffine(image, matrix, (width, height), borderValue=border)
+
+
+def letter_lines(hospital, disease, page_num, page_count):
+    """Return (x, y, size, text) lines of one page in PDF points, y from the bottom."""
+    lines = []
+    y = PAGE_HEIGHT - 60
+    if page_num == 1:
+        lines.append((150, y, 18, hospital.upper()))
+        lines.append((200, y - 22, 10, 'Department of Internal Medicine'))
+        y -= 80
+        lines.append((60, y, 11, 'To whom it may concern,'))
+        lines.append((60, y - 20, 11, f'Diagnosis: {disease}'))
+        y -= 50
+    for index in range(12):
+        lines.append((60, y, 11, FILLER[(page_num + index) % len(FILLER)]))
+        y -= 18
+    if page_num == page_count:
+        lines.append((380, 170, 11, 'Attending physician'))
+    lines.append((PAGE_WIDTH / 2 - 20, 30, 9, f'Page {page_num} of {page_count}'))
+    return lines
+
+
+def pdf_string(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_text_pdf(path, pages):
+    """Write a PDF with a Helvetica text layer. ``pages`` is a list of (lines, images).
+
+    ``lines`` are (x, y, size, text) and ``images`` are (x, y, width, height, RGB array)
+    placed in points.
+    """
+    objects = [None, None, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    kids = []
+    for lines, images in pages:
+        content, xobjects = [], []
+        for index, (x, y, width, height, rgb) in enumerate(images):
+            ok, jpeg = cv2.imencode('.jpg', cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR))
+            jpeg = jpeg.tobytes()
+            image_id = add(
+                f'<< /Type /XObject /Subtype /Image /Width {rgb.shape[1]} /Height {rgb.shape[0]} '
+                f'/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode /Length {len(jpeg)} >>\nstream\n'
+                .encode() + jpeg + b'\nendstream'
+            )
+            xobjects.append(f'/Im{index} {image_id} 0 R')
+            content.append(f'q {width:.1f} 0 0 {height:.1f} {x:.1f} {y:.1f} cm /Im{index} Do Q')
+        for x, y, size, text in lines:
+            content.append(f'BT /F1 {size} Tf {x:.1f} {y:.1f} Td ({pdf_string(text)}) Tj ET')
+        stream = '\n'.join(content).encode('latin-1')
+        content_id = add(f'<< /Length {len(stream)} >>\nstream\n'.encode() + stream + b'\nendstream')
+        kids.append(add(
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+            f'/Resources << /Font << /F1 3 0 R >> /XObject << {" ".join(xobjects)} >> >> '
+            f'/Contents {content_id} 0 R >>'.encode()
+        ))
+    objects[0] = b'<< /Type /Catalog /Pages 2 0 R >>'
+    objects[1] = f'<< /Type /Pages /Kids [{" ".join(f"{kid} 0 R" for kid in kids)}] /Count {len(kids)} >>'.encode()
+
+    with open(path, 'wb') as f:
+        f.write(b'%PDF-1.4\n')
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(f.tell())
+            f.write(f'{number} 0 obj\n'.encode() + body + b'\nendobj\n')
+        xref = f.tell()
+        f.write(f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode())
+        for offset in offsets:
+            f.write(f'{offset:010d} 00000 n \n'.encode())
+        f.write(f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode())
+
+
+def render_scanned_page(lines, images, dpi, angle, noise, rng):
+    """Rasterize a page the way a scanner would: skewed, noisy and without a text layer."""
+    scale = dpi / 72
+    width, height = int(PAGE_WIDTH * scale), int(PAGE_HEIGHT * scale)
+    colour = bool(images)
+    page = np.full((height, width, 3) if colour else (height, width), 255, dtype=np.uint8)
+    for x, y, size, text in lines:
+        origin = (int(x * scale), int(height - y * scale))
+        cv2.putText(page, text, origin, cv2.FONT_HERSHEY_SIMPLEX, size * scale / 30,
+                    (20, 20, 20) if colour else 20, max(1, int(size * scale / 14)), cv2.LINE_AA)
+    for x, y, w, h, rgb in images:
+        w, h = int(w * scale), int(h * scale)
+        x, y = int(x * scale), int(height - (y * scale) - h)
+        page[y:y+h, x:x+w] = np.minimum(page[y:y+h, x:x+w], cv2.resize(rgb, (w, h)))
+    if angle:
+        page = rotate(page, angle)
+    if noise:
+        page = np.clip(page + rng.normal(0, noise, page.shape), 0, 255).astype(np.uint8)
+    return Image.fromarray(page)
+
+
+@contextlib.contextmanager
+def isolated(verbosity=0):
+    """Run the benchmark against a throwaway test database and media directory.
+
+    The reference rows the benchmark creates never reach the configured
+    database, so they cannot invalidate its cached verdicts, and stamp images
+    and the descriptor store are written to a temporary directory. Queued
+    evidence re-checks run in Celery workers against the configured database,
+    so that receiver is disconnected while the benchmark runs.
+    """
+    senders = (Hospital, DiseaseType, DoctorStamp)
+    media_root = tempfile.mkdtemp(prefix='validator_benchmark_media_')
+    old_config = setup_databases(verbosity, interactive=False, aliases={DEFAULT_DB_ALIAS})
+    for sender in senders:
+        post_save.disconnect(signals.recheck_stored_evidence, sender=sender)
+    try:
+        with override_settings(MEDIA_ROOT=media_root,
+                               STAMP_DESCRIPTOR_DIR=os.path.join(media_root, 'stamps', 'orb')):
+            yield
+    finally:
+        for sender in senders:
+            post_save.connect(signals.recheck_stored_evidence, sender=sender)
+        teardown_databases(old_config, verbosity)
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def create_reference_data(stamp_count, rng):
+    """Create benchmark hospitals, diseases and stamps. Returns (hospital names, disease names, stamp images).
+
+    Only call this inside ``isolated()``.
+    """
+    hospitals = []
+    for place in PLACES:
+        name = f'{place} {KINDS[len(hospitals) % len(KINDS)]} Hospital'
+        Hospital.objects.get_or_create(name=name)
+        hospitals.append(name)
+    for name in DISEASES:
+        DiseaseType.objects.get_or_create(name=name)
+
+    stamps = {}
+    for index in range(stamp_count):
+        image = make_stamp(rng)
+        ok, png = cv2.imencode('.png', cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+        stamp = DoctorStamp.objects.create(image=ContentFile(png.tobytes(), name=f'benchmark_stamp_{index}.png'))
+        stamps[stamp.pk] = image
+    return hospitals, DISEASES, stamps
+
+
+def generate_corpus(directory, documents, stamps, hospitals, diseases, rng, page_counts=(1, 2, 3, 5, 10, 50),
+                    scanned_share=0.5, max_rotation=3.0, noise=8.0, dpi=150):
+    """Write ``documents`` synthetic letters to ``directory`` and return their specs with the expected verdict.
+
+    About a fifth of the letters carry a stamp that is not registered and a tenth
+    name an unknown hospital; those are expected to be REJECTED.
+    """
+    os.makedirs(directory, exist_ok=True)
+    stamp_ids = list(stamps)
+    corpus = []
+    for index in range(documents):
+        variant = 'scanned' if rng.random() < scanned_share else 'text'
+        page_count = int(rng.choice(page_counts))
+        known_hospital = rng.random() >= 0.1
+        known_stamp = rng.random() >= 0.2
+        hospital = hospitals[rng.integers(len(hospitals))] if known_hospital else 'Unlisted Private Clinic'
+        disease = diseases[rng.integers(len(diseases))]
+        stamp_id = stamp_ids[rng.integers(len(stamp_ids))] if known_stamp else None
+        stamp = stamps[stamp_id] if known_stamp else make_stamp(rng)
+        angle = float(rng.uniform(-max_rotation, max_rotation))
+        stamp_size = 108 * float(rng.uniform(0.85, 1.15))  # About 1.5 inches
+        stamp_image = (380, 40, stamp_size, stamp_size, rotate(stamp, angle) if variant == 'text' else stamp)
+
+        pages = [
+            (letter_lines(hospital, disease, page_num, page_count), [stamp_image] if page_num == page_count else [])
+            for page_num in range(1, page_count + 1)
+        ]
+        path = os.path.join(directory, f'letter_{index:04d}_{variant}_{page_count}p.pdf')
+        if variant == 'text':
+            write_text_pdf(path, pages)
+        else:
+            images = [render_scanned_page(lines, page_images, dpi, angle, noise, rng) for lines, page_images in pages]
+            images[0].save(path, 'PDF', resolution=dpi, save_all=True, append_images=images[1:])
+        corpus.append({
+            'path': path,
+            'variant': variant,
+            'pages': page_count,
+            'hospital': hospital,
+            'disease': disease,
+            'stamp_id': stamp_id,
+            'rotation': round(angle, 2),
+            'expected': 'ACCEPTED' if known_hospital and known_stamp else 'REJECTED',
+        })
+    return corpus
+
+
+def run_corpus(corpus, validate):
+    """Validate every document once with cold result caches and return per-document results.
+
+    Cached verdicts and stored evidence are dropped first, so reruns over the
+    same corpus take the full path instead of deciding from earlier evidence.
+    """
+    results = []
+    for spec in corpus:
+        with open(spec['path'], 'rb') as f:
+            sha256 = hashlib.sha256(f.read()).hexdigest()
+            ValidationResult.objects.filter(sha256=sha256).delete()
+            DocumentEvidence.objects.filter(sha256=sha256).delete()
+            f.seek(0)
+            started = time.perf_counter()
+            verdict = validate(File(f, name=os.path.basename(spec['path'])), debug=True)
+            latency = time.perf_counter() - started
+        results.append({
+            **spec,
+            'result': verdict['result'],
+            'error': verdict.get('error'),
+            'correct': verdict['result'] == spec['expected'] and 'error' not in verdict,
+            'latency': latency,
+            'timings': verdict.get('timings', {}),
+        })
+        if 'error' in verdict:
+            logger.warning(f"{os.path.basename(spec['path'])}: validation failed: {verdict['error']}")
+        else:
+            logger.info(f"{os.path.basename(spec['path'])}: {verdict['result']} in {latency:.2f}s")
+    return results
+
+
+def percentiles(values):
+    if not values:
+        return {'p50': None, 'p95': None, 'mean': None}
+    return {
+        'p50': round(float(np.percentile(values, 50)), 4),
+        'p95': round(float(np.percentile(values, 95)), 4),
+        'mean': round(float(np.mean(values)), 4),
+    }
+
+
+def summarize(results):
+    """Latency percentiles, per-stage time and memory, and accuracy over benchmark results.
+
+    Documents whose validation failed are only counted in ``errors``: their
+    REJECTED verdict says nothing about accuracy and their latency is that of
+    the failure. ``process_peak_rss`` is the high-water mark of the whole
+    benchmark process, page and OCR worker processes excluded.
+    """
+    errors = [result for result in results if result['error']]
+    results = [result for result in results if not result['error']]
+    stage_names = sorted({name for result in results for name in result['timings']})
+    summary = {
+        'documents': len(results) + len(errors),
+        'errors': len(errors),
+        'latency_seconds': percentiles([result['latency'] for result in results]),
+        'accuracy': round(sum(result['correct'] for result in results) / len(results), 4) if results else None,
+        'false_accepts': sum(r['result'] == 'ACCEPTED' and r['expected'] == 'REJECTED' for r in results),
+        'false_rejects': sum(r['result'] == 'REJECTED' and r['expected'] == 'ACCEPTED' for r in results),
+        'stages_ms': {
+            name: {
+                'total': round(sum(r['timings'].get(name, {}).get('wall_ms', 0) for r in results), 1),
+                **percentiles([r['timings'][name]['wall_ms'] for r in results if name in r['timings']]),
+                'max_peak_rss_growth': max(
+                    (r['timings'][name]['peak_rss_growth'] for r in results
+                     if r['timings'].get(name, {}).get('peak_rss_growth') is not None), default=None),
+            }
+            for name in stage_names
+        },
+        'process_peak_rss': max_rss(),
+        'by_variant': {},
+    }
+    for variant in sorted({result['variant'] for result in results + errors}):
+        subset = [result for result in results if result['variant'] == variant]
+        summary['by_variant'][variant] = {
+            'documents': len(subset),
+            'errors': sum(result['variant'] == variant for result in errors),
+            'latency_seconds': percentiles([result['latency'] for result in subset]),
+            'accuracy': round(sum(result['correct'] for result in subset) / len(subset), 4) if subset else None,
+        }
+    return summary
+
+
+def environment():
+    return {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'settings': {name: repr(getattr(settings, name)) for name in dir(settings)
+                     if name.startswith(('VALIDATOR_', 'STAMP_', 'TESSERACT_'))},
+    }
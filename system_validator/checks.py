@@ -0,0 +1,26 @@
+# System checks for the validator's optional dependencies, run by manage.py commands.
+import importlib.util
+
+from django.conf import settings
+from django.core.checks import Error, Warning, register
+
+
+@register()
+def check_ocr_engine(app_configs, **kwargs):
+    """tesserocr is optional: without it OCR starts a tesseract process per batch."""
+    kind = getattr(settings, 'VALIDATOR_OCR_ENGINE', 'auto')
+    if kind == 'cli' or importlib.util.find_spec('tesserocr') is not None:
+        return []
+    if kind == 'tesserocr':
+        return [Error(
+            "VALIDATOR_OCR_ENGINE is 'tesserocr' but tesserocr is not installed.",
+            hint="Install tesserocr or set VALIDATOR_OCR_ENGINE to 'auto' or 'cli'.",
+            id='system_validator.E001',
+        )]
+    return [Warning(
+        'tesserocr is not installed, so OCR starts a tesseract process per batch instead of '
+        'using long-lived workers with the model loaded.',
+        hint=("Install tesserocr, which builds against the Tesseract and Leptonica headers, "
+              "or set VALIDATOR_OCR_ENGINE = 'cli' to use the tesseract binary on purpose."),
+        id='system_validator.W001',
+    )]
@@ -0,0 +1,185 @@
+# ORB features for DoctorStamp images, computed once on save and shared between workers.
+import io
+import os
+import zlib
+import threading
+import logging
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from .stamp_cache import preprocess_gray
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+ORB_FEATURES = 2000
+STORE_FILE = 'descriptors.store'
+LOCK_FILE = 'rebuild.lock'
+
+
+def compute_orb_features(gray):
+    """Return (keypoints, descriptors) for a raw grayscale image.
+
+    Keypoints are an (N, 6) float32 array of x, y, size, angle, response, octave
+    and descriptors the (N, 32) uint8 ORB bit strings, or (None, None).
+    """
+    orb = cv2.ORB_create(nfeatures=ORB_FEATURES)
+    kp, des = orb.detectAndCompute(preprocess_gray(gray), None)
+    if des is None:
+        return None, None
+    keypoints = np.array(
+        [(k.pt[0], k.pt[1], k.size, k.angle, k.response, k.octave) for k in kp],
+        dtype=np.float32,
+    )
+    return keypoints, des
+
+
+def array_to_bytes(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def array_from_bytes(data):
+    return np.load(io.BytesIO(bytes(data)), allow_pickle=False)
+
+
+def store_dir():
+    return getattr(settings, 'STAMP_DESCRIPTOR_DIR', os.path.join(settings.MEDIA_ROOT, 'stamps', 'orb'))
+
+
+@contextmanager
+def rebuild_lock(directory):
+    """Hold an exclusive lock on the store directory, so rebuilds in different processes run one at a time."""
+    with open(os.path.join(directory, LOCK_FILE), 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class DescriptorStore:
+    """All approved stamp descriptors in one contiguous, memory-mapped file.
+
+    ``descriptors.store`` holds two .npy records back to back: the
+    (stamp_id, start, stop, crc32) index, in stamp id order, then every
+    stamp's descriptor rows. The index is read into memory and the rows are
+    opened with ``np.memmap`` so gunicorn workers share the same page cache.
+    A rebuild replaces the file with one rename, so readers always see an
+    index and rows written together, and the file is reopened whenever
+    another process rewrites it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._verified = set()
+        self.descriptors = None
+        self.offsets = {}
+        self.checksums = {}
+
+    def _path(self):
+        return os.path.join(store_dir(), STORE_FILE)
+
+    def rebuild(self):
+        """Rewrite the store from the persisted DoctorStamp descriptors."""
+        from .models import DoctorStamp
+
+        path = self._path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Rows are read under the lock, so the last rebuild to finish saw the latest commit.
+        with rebuild_lock(os.path.dirname(path)):
+            blocks, rows, start = [], [], 0
+            stamps = DoctorStamp.objects.exclude(orb_descriptors=None).order_by('id')
+            for stamp_id, data in stamps.values_list('id', 'orb_descriptors'):
+                des = array_from_bytes(data)
+                blocks.append(des)
+                rows.append((stamp_id, start, start + len(des), zlib.crc32(des.tobytes())))
+                start += len(des)
+
+            descriptors = np.concatenate(blocks) if blocks else np.empty((0, 32), dtype=np.uint8)
+            index = np.array(rows, dtype=np.int64).reshape(-1, 4)
+
+            # Write next to the target and rename so readers never see a partial file.
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.lib.format.write_array(f, index, allow_pickle=False)
+                np.lib.format.write_array(f, descriptors, allow_pickle=False)
+            os.replace(tmp_path, path)
+        logger.info(f"Rebuilt stamp descriptor store: {len(rows)} stamps, {start} descriptors")
+        with self._lock:
+            self._version = None
+
+    def _open(self):
+        path = self._path()
+        try:
+            return open(path, 'rb')
+        except FileNotFoundError:
+            self.rebuild()
+            return open(path, 'rb')
+
+    def _load(self):
+        with self._open() as f:
+            stat = os.fstat(f.fileno())
+            # Every rebuild renames a new file into place, so the inode changes even
+            # when two rebuilds land within the filesystem's mtime resolution.
+            version = (stat.st_ino, stat.st_mtime_ns)
+            with self._lock:
+                if version == self._version:
+                    return
+                index = np.lib.format.read_array(f, allow_pickle=False)
+                if np.lib.format.read_magic(f) == (1, 0):
+                    shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+                if shape[0]:
+                    self.descriptors = np.memmap(f, dtype=dtype, mode='r', offset=f.tell(), shape=shape)
+                else:
+                    self.descriptors = np.empty(shape, dtype=dtype)
+                self.offsets = {int(stamp_id): (int(a), int(b)) for stamp_id, a, b, _ in index}
+                self.checksums = {int(stamp_id): int(crc) for stamp_id, _, _, crc in index}
+                self._verified = set()
+                self._version = version
+
+    @property
+    def version(self):
+        self._load()
+        return self._version
+
+    def get(self, stamp_id):
+        """Return the descriptor rows of one stamp, or None if it has none stored.
+
+        A stamp's rows are checked against their stored crc32 the first time
+        they are read from a file.
+        """
+        self._load()
+        bounds = self.offsets.get(stamp_id)
+        if bounds is None:
+            return None
+        descriptors = self.descriptors[bounds[0]:bounds[1]]
+        if stamp_id not in self._verified:
+            if zlib.crc32(descriptors.tobytes()) != self.checksums[stamp_id]:
+                logger.error(f"Stored descriptors of stamp {stamp_id} fail their checksum; "
+                             f"rebuild the store with build_stamp_descriptors")
+                return None
+            self._verified.add(stamp_id)
+        return descriptors
+
+
+descriptor_store = DescriptorStore()
@@ -0,0 +1,237 @@
+# The document validation flow shared by the API view and the campaign task.
+import logging
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from .models import DoctorStamp, DocumentEvidence, Hospital, DiseaseType, ReferenceVersion
+from .pages import PageImageProvider
+from .vocabulary import VocabularyMatcher, get_matchers
+from .descriptors import array_from_bytes
+from .utils import (
+    StampMatch, confirm_stamp, extract_text_from_pdf, find_stamp_in_pdf, match_descriptors, normalize,
+)
+from .profiling import profiled, stage
+from .evidence import recording
+from .signals import evidence_rechecked
+from . import evidence, result_cache
+
+logger = logging.getLogger(__name__)
+
+STAGES = [
+    'ingest', 'evidence_match', 'text_extraction', 'ocr', 'vocabulary_match', 'rasterize', 'stamp_proposal',
+    'stamp_match',
+]
+
+
+class ValidationEngine:
+    """Validate a medical support letter for hospital, disease and stamp in timed stages.
+
+    ``ingest`` hashes the upload, checks the result cache and stores a private
+    temporary copy. A document validated before is decided in ``evidence_match``
+    from its stored evidence when that is enough. ``text_extraction`` reads the text layer, with ``ocr`` for
+    pages without one. ``vocabulary_match`` finds the hospital and disease, and
+    ``stamp_match`` looks for an approved stamp, with ``rasterize`` and
+    ``stamp_proposal`` charged separately wherever they run.
+    """
+
+    def validate(self, pdf_file, progress=None, debug=False):
+        """Return the verdict dict; ``debug`` adds per-stage ``timings`` to it."""
+        report = progress or (lambda percent: None)
+        with profiled() as profile:
+            verdict = self.run(pdf_file, report)
+        profile.emit(getattr(pdf_file, 'name', 'document'))
+        if debug:
+            verdict = {**verdict, 'timings': profile.report()}
+        return verdict
+
+    def run(self, pdf_file, report):
+        temp_pdf_path = None
+        pages = None
+        try:
+            with stage('ingest'):
+                sha256 = result_cache.file_sha256(pdf_file)
+                version = result_cache.reference_version()
+                cached = result_cache.lookup(sha256, version)
+                if cached is not None:
+                    report(100)
+                    return {**cached, 'sha256': sha256}
+                stored = evidence.lookup(sha256)
+            if stored is not None:
+                with stage('evidence_match'):
+                    verdict = self.reevaluate(stored)
+                if verdict is not None:
+                    result_cache.store(sha256, version, verdict)
+                    report(100)
+                    return {**verdict, 'sha256': sha256}
+
+            with stage('ingest'):
+                temp_pdf_path = default_storage.save(f'temp/{pdf_file.name}', pdf_file)
+                temp_pdf_full_path = default_storage.path(temp_pdf_path)
+                logger.debug(f"Saved temporary PDF: {temp_pdf_full_path}")
+            report(5)
+
+            pages = PageImageProvider(temp_pdf_full_path)
+            with stage('text_extraction'):
+                text = extract_text_from_pdf(temp_pdf_full_path, pages=pages)
+            report(40)
+
+            with stage('vocabulary_match'):
+                hospital_match, disease_match = self.match_names(text)
+            report(50)
+
+            with stage('stamp_match'), recording() as candidates:
+                approved_stamps = DoctorStamp.objects.defer('orb_keypoints', 'orb_descriptors')
+                stamp_match = find_stamp_in_pdf(temp_pdf_full_path, approved_stamps, progress=report, pages=pages)
+            report(100)
+
+            verdict = self.verdict(hospital_match, disease_match, stamp_match)
+            evidence.store(sha256, normalize(text), verdict['evidence'], candidates)
+            result_cache.store(sha256, version, verdict)
+            return {**verdict, 'sha256': sha256}
+
+        except Exception as e:
+            logger.error(f"Validation error: {str(e)}")
+            return {'result': 'REJECTED', 'reason': f'Validation error: {str(e)}', 'error': str(e)}
+        finally:
+            if pages is not None:
+                pages.close()
+            if temp_pdf_path is not None:
+                default_storage.delete(temp_pdf_path)
+
+    def match_names(self, text):
+        """Return (hospital match, disease match), each (name, score) or None."""
+        normalized_text = normalize(text)
+        logger.debug(f"Normalized extracted text: {normalized_text}")
+        hospitals, diseases = get_matchers()
+        hospital_match = hospitals.match(normalized_text)
+        disease_match = diseases.match(normalized_text)
+        logger.debug(f"Matched hospital: {hospital_match}, matched disease: {disease_match}")
+        return hospital_match, disease_match
+
+    def reevaluate(self, stored):
+        """Decide a document from its DocumentEvidence against the current reference data.
+
+        Returns None when a check that passed before fails now: reading stops at
+        the first stamp and once both names are found, so only failed checks
+        are known to have seen the whole document.
+        """
+        hospital_match, disease_match = self.match_names(stored.text)
+        approved_ids = set(DoctorStamp.objects.values_list('id', flat=True))
+        stamp_match = None
+        for page, descriptors, _ in evidence.candidates_from_bytes(stored.stamp_candidates):
+            stamp_match = match_descriptors(descriptors, approved_ids)
+            if stamp_match:
+                stamp_match = stamp_match._replace(page=page)
+                break
+        if ((stored.hospital and not hospital_match) or (stored.disease and not disease_match)
+                or (stored.stamp and not stamp_match)):
+            return None
+        verdict = self.verdict(hospital_match, disease_match, stamp_match)
+        stored.hospital, stored.disease, stored.stamp = (
+            verdict['evidence']['hospital'], verdict['evidence']['disease'], verdict['evidence']['stamp'])
+        stored.save(update_fields=['hospital', 'disease', 'stamp', 'updated_at'])
+        return verdict
+
+    def recheck(self, table, pk):
+        """Check one added Hospital, DiseaseType or DoctorStamp against the stored evidence that failed its check.
+
+        ``table`` is a ReferenceVersion table name. Only the affected check is
+        evaluated, from stored text or stamp features. Since the new verdicts
+        can approve campaigns without review, a stamp only counts when
+        ``confirm_stamp`` accepts it, and candidates stored without keypoints
+        are skipped. Changed evidence is saved in batches of
+        VALIDATOR_EVIDENCE_BATCH_SIZE and each batch's new verdicts are sent
+        with ``evidence_rechecked``. Returns how many changed.
+        """
+        if table == ReferenceVersion.STAMP:
+            field = 'stamp'
+            features = DoctorStamp.objects.filter(pk=pk).values_list('orb_keypoints', 'orb_descriptors').first()
+            if features is None or None in features:
+                logger.warning(f"No stored features for added stamp {pk}, nothing to re-check")
+                return 0
+            stamp_keypoints, stamp_descriptors = (array_from_bytes(data) for data in features)
+
+            def check(row):
+                for page, descriptors, keypoints in evidence.candidates_from_bytes(row.stamp_candidates):
+                    if keypoints is None:
+                        continue
+                    matches = confirm_stamp(keypoints, descriptors, stamp_keypoints, stamp_descriptors)
+                    if matches:
+                        return StampMatch(pk, matches, page)._asdict()
+                return None
+            rows = DocumentEvidence.objects.filter(stamp__isnull=True).exclude(stamp_candidates=None)
+        else:
+            field = table
+            model = Hospital if table == ReferenceVersion.HOSPITAL else DiseaseType
+            matcher = VocabularyMatcher(model.objects.filter(pk=pk).values_list('name', flat=True))
+
+            def check(row):
+                found = matcher.match(row.text)
+                return {'name': found[0], 'score': found[1]} if found else None
+            rows = DocumentEvidence.objects.filter(**{f'{field}__isnull': True}).exclude(text='')
+
+        batch_size = getattr(settings, 'VALIDATOR_EVIDENCE_BATCH_SIZE', 500)
+        changed = 0
+        batch = []
+
+        def flush():
+            DocumentEvidence.objects.bulk_update(batch, [field])
+            evidence_rechecked.send(sender=DocumentEvidence, verdicts={
+                row.sha256: self.verdict(*self.matches_from(row)) for row in batch
+            })
+            batch.clear()
+
+        for row in rows.iterator(chunk_size=batch_size):
+            found = check(row)
+            if found is None:
+                continue
+            setattr(row, field, found)
+            batch.append(row)
+            changed += 1
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        logger.info(f"Re-checked stored evidence for added {table} {pk}: {changed} documents changed")
+        return changed
+
+    def matches_from(self, row):
+        """The (hospital, disease, stamp) matches recorded in a DocumentEvidence, as ``verdict`` takes them."""
+        return (
+            (row.hospital['name'], row.hospital['score']) if row.hospital else None,
+            (row.disease['name'], row.disease['score']) if row.disease else None,
+            StampMatch(**row.stamp) if row.stamp else None,
+        )
+
+    def verdict(self, hospital_match, disease_match, stamp_match):
+        evidence = {
+            'hospital': {'name': hospital_match[0], 'score': hospital_match[1]} if hospital_match else None,
+            'disease': {'name': disease_match[0], 'score': disease_match[1]} if disease_match else None,
+            'stamp': stamp_match._asdict() if stamp_match else None,
+        }
+        if hospital_match and disease_match and stamp_match:
+            logger.info("PDF validation successful")
+            return {'result': 'ACCEPTED', 'reason': 'Valid hospital, disease, and stamp found', 'evidence': evidence}
+
+        reasons = []
+        if not hospital_match:
+            reasons.append("This Hospital is not among the officially authorized hospitals")
+        if not disease_match:
+            reasons.append("The disease type is not recognized as an eligible condition")
+        if not stamp_match:
+            reasons.append("This doctor is not an authorized approver")
+        reason = ', '.join(reasons)
+        logger.warning(f"PDF validation failed: {reason}")
+        return {'result': 'REJECTED', 'reason': reason, 'evidence': evidence}
+
+
+validation_engine = ValidationEngine()
+
+
+def validate_pdf(pdf_file, progress=None, debug=False):
+    """Validate a Medical campaign PDF for hospital, disease, and stamp.
+
+    ``progress`` is an optional callable receiving a completion percentage.
+    """
+    return validation_engine.validate(pdf_file, progress=progress, debug=debug)
@@ -0,0 +1,78 @@
+# Per-check evidence of validated documents: the text names were matched in,
+# the matches found, and the ORB features of every stamp candidate compared.
+import io
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from .models import DocumentEvidence
+
+_local = threading.local()
+
+
+@contextmanager
+def recording():
+    """Collect the stamp candidates compared by this thread as a list of (page, descriptors, keypoints)."""
+    previous = getattr(_local, 'candidates', None)
+    candidates = _local.candidates = []
+    try:
+        yield candidates
+    finally:
+        _local.candidates = previous
+
+
+def current_candidates():
+    """Return the list this thread records stamp candidates into, or None."""
+    return getattr(_local, 'candidates', None)
+
+
+def record_stamp_candidate(page, descriptors, keypoints):
+    candidates = current_candidates()
+    if candidates is not None:
+        candidates.append((page, descriptors, keypoints))
+
+
+def candidates_to_bytes(candidates):
+    buffer = io.BytesIO()
+    np.savez(
+        buffer,
+        pages=np.array([page or 0 for page, _, _ in candidates], dtype=np.int32),
+        counts=np.array([len(descriptors) for _, descriptors, _ in candidates], dtype=np.int32),
+        descriptors=(np.concatenate([descriptors for _, descriptors, _ in candidates])
+                     if candidates else np.empty((0, 32), dtype=np.uint8)),
+        keypoints=(np.concatenate([keypoints for _, _, keypoints in candidates])
+                   if candidates else np.empty((0, 6), dtype=np.float32)),
+    )
+    return buffer.getvalue()
+
+
+def candidates_from_bytes(data):
+    """Return the stored candidates as (page, descriptors, keypoints); keypoints are None in older rows."""
+    if data is None:
+        return []
+    with np.load(io.BytesIO(bytes(data)), allow_pickle=False) as arrays:
+        pages, counts, descriptors = arrays['pages'], arrays['counts'], arrays['descriptors']
+        keypoints = arrays['keypoints'] if 'keypoints' in arrays.files else None
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    return [
+        (int(page) or None, descriptors[offsets[i]:offsets[i + 1]],
+         keypoints[offsets[i]:offsets[i + 1]] if keypoints is not None else None)
+        for i, page in enumerate(pages)
+    ]
+
+
+def lookup(sha256):
+    """Return the stored DocumentEvidence for a document, or None."""
+    return DocumentEvidence.objects.filter(sha256=sha256).first()
+
+
+def store(sha256, text, checks, candidates):
+    """Persist the evidence of a full validation; ``checks`` is the verdict's evidence dict."""
+    DocumentEvidence.objects.update_or_create(sha256=sha256, defaults={
+        'text': text,
+        'hospital': checks['hospital'],
+        'disease': checks['disease'],
+        'stamp': checks['stamp'],
+        'stamp_candidates': candidates_to_bytes(candidates),
+    })
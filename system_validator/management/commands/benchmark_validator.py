@@ -0,0 +1,63 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from system_validator import benchmark
+from system_validator.engine import validate_pdf
+
+
+class Command(BaseCommand):
+    help = ('Generate synthetic medical letters, run validate_pdf over them and report latency, '
+            'per-stage time and peak RSS growth, process peak RSS and accuracy as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=40)
+        parser.add_argument('--stamps', type=int, default=20, help='DoctorStamp templates to generate.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--pages', default='1,2,3,5,10,50', help='Comma-separated page counts to draw from.')
+        parser.add_argument('--scanned-share', type=float, default=0.5,
+                            help='Fraction of letters without a text layer.')
+        parser.add_argument('--max-rotation', type=float, default=3.0, help='Largest skew in degrees.')
+        parser.add_argument('--noise', type=float, default=8.0, help='Gaussian noise sigma on scanned pages.')
+        parser.add_argument('--dpi', type=int, default=150, help='Resolution of scanned pages.')
+        parser.add_argument('--corpus-dir', help='Where to write the PDFs; a temporary directory by default.')
+        parser.add_argument('--output', default='benchmark.json')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        corpus_dir = options['corpus_dir'] or tempfile.mkdtemp(prefix='validator_benchmark_')
+        # Reference data and verdicts live in a test database created for this run.
+        with benchmark.isolated(options['verbosity']):
+            hospitals, diseases, stamps = benchmark.create_reference_data(options['stamps'], rng)
+            corpus = benchmark.generate_corpus(
+                corpus_dir, options['documents'], stamps, hospitals, diseases, rng,
+                page_counts=[int(count) for count in options['pages'].split(',')],
+                scanned_share=options['scanned_share'],
+                max_rotation=options['max_rotation'],
+                noise=options['noise'],
+                dpi=options['dpi'],
+            )
+            self.stdout.write(f'Generated {len(corpus)} letters in {corpus_dir}')
+            results = benchmark.run_corpus(corpus, validate_pdf)
+
+        summary = benchmark.summarize(results)
+        report = {
+            'options': {key: options[key] for key in (
+                'documents', 'stamps', 'seed', 'pages', 'scanned_share', 'max_rotation', 'noise', 'dpi')},
+            'environment': benchmark.environment(),
+            'summary': summary,
+            'documents': [{**result, 'path': os.path.basename(result['path'])} for result in results],
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+        latency = summary['latency_seconds']
+        message = (f"{summary['documents']} documents: p50 {latency['p50']}s, p95 {latency['p95']}s, "
+                   f"accuracy {summary['accuracy']}, report written to {options['output']}")
+        if summary['errors']:
+            # Figures from a partly failed run are not comparable with other runs.
+            raise CommandError(f"{summary['errors']} documents failed to validate; {message}")
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from system_validator.models import DoctorStamp
+from system_validator.descriptors import descriptor_store
+from system_validator.signals import store_stamp_features
+
+
+class Command(BaseCommand):
+    help = 'Compute ORB features for DoctorStamp images and rebuild the shared descriptor store.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Recompute features for stamps that already have them.')
+
+    def handle(self, *args, **options):
+        stamps = DoctorStamp.objects.defer('orb_keypoints', 'orb_descriptors')
+        if not options['all']:
+            stamps = stamps.filter(orb_descriptors=None)
+        count = 0
+        for stamp in stamps.iterator():
+            store_stamp_features(stamp)
+            count += 1
+        descriptor_store.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Computed features for {count} stamps and rebuilt the descriptor store.'))
@@ -0,0 +1,69 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from system_validator.validator import HEAVY_MODULES
+
+
+def parse_importtime(stderr):
+    """Return [(module, self_us, cumulative_us, depth)] from ``python -X importtime`` output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((name.strip(), int(self_us), int(cumulative_us), (len(name) - len(name.lstrip()) - 1) // 2))
+    return rows
+
+
+class Command(BaseCommand):
+    help = ('Import Django, the apps and the given modules in a fresh interpreter with -X importtime '
+            'and report what each module costs and which heavy validator libraries got loaded.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('modules', nargs='*',
+                            help='Modules to import after setup; defaults to ROOT_URLCONF, as a web worker does.')
+        parser.add_argument('--validator', action='store_true',
+                            help='Also import the validation engine, as a validation worker does.')
+        parser.add_argument('--top', type=int, default=25, help='Modules listed, by cumulative time.')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        modules = options['modules'] or [settings.ROOT_URLCONF]
+        if options['validator']:
+            modules.append('system_validator.engine')
+        code = '; '.join(['import django', 'django.setup()'] + [f'import {module}' for module in modules])
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'community_fund.settings')}
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                 capture_output=True, text=True, env=env)
+        rows = parse_importtime(process.stderr)
+        if process.returncode != 0:
+            raise CommandError(process.stderr.splitlines()[-1] if process.stderr else 'Import failed')
+
+        cumulative_us = {name: cumulative for name, _, cumulative, _ in rows}
+        heavy = [name for name in HEAVY_MODULES if name in cumulative_us]
+        report = {
+            'modules': modules,
+            'total_ms': round(sum(cumulative for _, _, cumulative, depth in rows if depth == 0) / 1000, 1),
+            'heavy_modules_ms': {name: round(cumulative_us[name] / 1000, 1) for name in heavy},
+            'slowest': [
+                {'module': name, 'self_ms': round(self_us / 1000, 1), 'cumulative_ms': round(cumulative / 1000, 1)}
+                for name, self_us, cumulative, _ in sorted(rows, key=lambda row: row[2], reverse=True)[:options['top']]
+            ],
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(f"Importing {', '.join(modules)} after django.setup(): {report['total_ms']} ms")
+        for row in report['slowest']:
+            self.stdout.write(f"{row['cumulative_ms']:>10.1f} ms {row['self_ms']:>10.1f} ms  {row['module']}")
+        if heavy:
+            loaded = ', '.join(f'{name} ({ms} ms)' for name, ms in report['heavy_modules_ms'].items())
+            self.stdout.write(self.style.WARNING(f'Heavy validator modules loaded: {loaded}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No heavy validator modules loaded'))
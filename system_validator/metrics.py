@@ -0,0 +1,103 @@
+# Prometheus series for the validator, the DRF API and Celery.
+#
+# With PROMETHEUS_MULTIPROC_DIR set in the environment of every gunicorn and
+# Celery worker, each process writes its samples to files in that directory and
+# the exporter view adds them up, so one scrape covers all workers on the host.
+import os
+import time
+import logging
+
+from celery import current_app
+from celery.signals import task_prerun, task_postrun
+from django.conf import settings
+from django.dispatch import receiver
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from .profiling import stages_recorded
+
+logger = logging.getLogger(__name__)
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TASK_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+REQUEST_LATENCY = Histogram(
+    'api_request_duration_seconds', 'Latency of DRF API views', ['view', 'method', 'status'],
+)
+STAGE_DURATION = Histogram(
+    'validation_stage_duration_seconds', 'Wall time of each validation stage per document', ['stage'],
+    buckets=STAGE_BUCKETS,
+)
+STAGE_CPU = Counter('validation_stage_cpu_seconds', 'CPU time spent in each validation stage', ['stage'])
+OCR_PAGES = Counter('ocr_pages', 'Pages handed to the OCR engine', ['mode'])
+STAMP_CACHE_REQUESTS = Counter('stamp_template_cache_requests', 'Stamp template cache lookups', ['result'])
+TASK_RUNTIME = Histogram(
+    'celery_task_runtime_seconds', 'Runtime of Celery tasks', ['task', 'state'], buckets=TASK_BUCKETS,
+)
+ADMISSION_RUNNING = Gauge(
+    'validation_admission_running', 'Validations holding a slot on this host', multiprocess_mode='livesum',
+)
+ADMISSION_WAITING = Gauge(
+    'validation_admission_waiting', 'Validations queued for a slot on this host', multiprocess_mode='livesum',
+)
+ADMISSION_WAIT = Histogram(
+    'validation_admission_wait_seconds', 'Time validations waited for a slot', buckets=STAGE_BUCKETS,
+)
+ADMISSION_REJECTED = Counter('validation_admission_rejected', 'Validations turned away', ['reason'])
+
+
+@receiver(stages_recorded)
+def observe_stages(sender, stages, **kwargs):
+    for name, totals in stages.items():
+        STAGE_DURATION.labels(name).observe(totals['wall'])
+        STAGE_CPU.labels(name).inc(totals['cpu'])
+
+
+_task_started = {}
+
+
+@task_prerun.connect
+def task_started(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def task_finished(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_RUNTIME.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - started)
+
+
+class CeleryQueueCollector:
+    """Report the number of messages waiting in each Celery queue at scrape time."""
+
+    def collect(self):
+        depth = GaugeMetricFamily('celery_queue_depth', 'Messages waiting in a Celery queue', labels=['queue'])
+        queues = getattr(settings, 'METRICS_CELERY_QUEUES', ['celery'])
+        if queues:
+            try:
+                with current_app.connection_for_read() as connection:
+                    connection.ensure_connection(max_retries=1)
+                    for queue in queues:
+                        depth.add_metric([queue], connection.default_channel.queue_declare(
+                            queue=queue, passive=True).message_count)
+            except Exception as e:
+                logger.warning(f"Could not read Celery queue depth: {str(e)}")
+        yield depth
+
+
+# Queue depth is read from the broker, not from any one process, so it is never aggregated.
+queue_registry = CollectorRegistry()
+queue_registry.register(CeleryQueueCollector())
+
+
+def render():
+    """Return the exposition text for every process's samples plus the queue depth."""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry) + generate_latest(queue_registry)
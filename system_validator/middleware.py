@@ -0,0 +1,23 @@
+import time
+
+from rest_framework.views import APIView
+
+from .metrics import REQUEST_LATENCY
+
+
+class RequestMetricsMiddleware:
+    """Record the latency of every request served by a DRF view, per view, method and status."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        view_class = getattr(match.func, 'cls', None) if match else None
+        if view_class is not None and issubclass(view_class, APIView):
+            REQUEST_LATENCY.labels(
+                match.view_name or view_class.__name__, request.method, str(response.status_code)
+            ).observe(time.perf_counter() - started)
+        return response
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('system_validator', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctorstamp',
+            name='orb_descriptors',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='doctorstamp',
+            name='orb_keypoints',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('system_validator', '0003_reference_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValidationResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64)),
+                ('reference_version', models.CharField(max_length=64)),
+                ('result', models.CharField(max_length=20)),
+                ('reason', models.TextField(blank=True)),
+                ('evidence', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='validationresult',
+            constraint=models.UniqueConstraint(fields=('sha256', 'reference_version'), name='unique_result_per_document_version'),
+        ),
+    ]
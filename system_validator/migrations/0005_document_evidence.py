@@ -0,0 +1,26 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('system_validator', '0004_validation_result'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentEvidence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('text', models.TextField(blank=True)),
+                ('hospital', models.JSONField(blank=True, null=True)),
+                ('disease', models.JSONField(blank=True, null=True)),
+                ('stamp', models.JSONField(blank=True, null=True)),
+                ('stamp_candidates', models.BinaryField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
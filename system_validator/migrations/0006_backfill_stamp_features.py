@@ -0,0 +1,43 @@
+import os
+
+from django.db import migrations
+
+
+def backfill_stamp_features(apps, schema_editor):
+    """Compute ORB features for stamps saved before they were stored on the model."""
+    import cv2
+    from system_validator.descriptors import STORE_FILE, array_to_bytes, compute_orb_features, store_dir
+
+    DoctorStamp = apps.get_model('system_validator', 'DoctorStamp')
+    count = 0
+    for stamp in DoctorStamp.objects.filter(orb_descriptors=None).exclude(image='').iterator():
+        try:
+            gray = cv2.imread(stamp.image.path, cv2.IMREAD_GRAYSCALE)
+        except (ValueError, NotImplementedError):
+            gray = None
+        if gray is None:
+            continue
+        keypoints, descriptors = compute_orb_features(gray)
+        if descriptors is None:
+            continue
+        DoctorStamp.objects.filter(pk=stamp.pk).update(
+            orb_keypoints=array_to_bytes(keypoints), orb_descriptors=array_to_bytes(descriptors),
+        )
+        count += 1
+    if count:
+        # Drop the store so the next reader rebuilds it with the new rows.
+        try:
+            os.remove(os.path.join(store_dir(), STORE_FILE))
+        except FileNotFoundError:
+            pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('system_validator', '0005_document_evidence'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_stamp_features, migrations.RunPython.noop),
+    ]
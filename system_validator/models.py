@@ -15,6 +15,61 @@ class DiseaseType(models.Model):
 
 class DoctorStamp(models.Model):
     image = models.ImageField(upload_to='stamps/')
+    # ORB features of the image as .npy blobs, filled in by signals on save.
+    orb_keypoints = models.BinaryField(null=True, blank=True, editable=False)
+    orb_descriptors = models.BinaryField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return f"Stamp {self.id}"
+
+class ReferenceVersion(models.Model):
+    """Change counter per reference table, bumped by signals so every worker can tell when to rebuild."""
+    HOSPITAL = 'hospital'
+    DISEASE = 'disease'
+    STAMP = 'stamp'
+
+    table = models.CharField(max_length=50, unique=True)
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.table} v{self.version}"
+
+    @classmethod
+    def bump(cls, table):
+        if not cls.objects.filter(table=table).update(version=models.F('version') + 1):
+            cls.objects.get_or_create(table=table, defaults={'version': 1})
+
+    @classmethod
+    def current(cls):
+        return dict(cls.objects.values_list('table', 'version'))
+
+class ValidationResult(models.Model):
+    """Verdict for a document, keyed by its SHA-256 and the reference data version it was checked against."""
+    sha256 = models.CharField(max_length=64)
+    reference_version = models.CharField(max_length=64)
+    result = models.CharField(max_length=20)
+    reason = models.TextField(blank=True)
+    evidence = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['sha256', 'reference_version'], name='unique_result_per_document_version'),
+        ]
+
+    def __str__(self):
+        return f"{self.sha256[:12]} - {self.result}"
+
+class DocumentEvidence(models.Model):
+    """What each check found in a document, so added reference data can be checked without reading it again."""
+    sha256 = models.CharField(max_length=64, unique=True)
+    text = models.TextField(blank=True)  # Normalized text the names were matched in
+    hospital = models.JSONField(null=True, blank=True)
+    disease = models.JSONField(null=True, blank=True)
+    stamp = models.JSONField(null=True, blank=True)
+    # Page numbers and ORB descriptors of the stamp candidates, as an .npz blob.
+    stamp_candidates = models.BinaryField(null=True, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Evidence for {self.sha256[:12]}"
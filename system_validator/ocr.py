@@ -0,0 +1,181 @@
+# OCR engines for the text extraction fallback.
+import os
+import tempfile
+import threading
+import multiprocessing
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytesseract
+from django.conf import settings
+from PIL import Image
+
+from .layout import find_text_blocks
+from .metrics import OCR_PAGES
+
+logger = logging.getLogger(__name__)
+
+PAGE_SEPARATOR = '\f'
+
+
+def ocr_options():
+    """Return (lang, psm) used for whole-page OCR calls."""
+    return getattr(settings, 'VALIDATOR_OCR_LANG', 'eng'), getattr(settings, 'VALIDATOR_OCR_PSM', 3)
+
+
+class TesseractCliEngine:
+    """Batch pages through one ``tesseract`` process per batch.
+
+    Tesseract accepts a text file listing images and recognizes them all with
+    the language model loaded once, writing a form feed after each page.
+    """
+
+    def __init__(self, tesseract_cmd):
+        self.tesseract_cmd = tesseract_cmd
+
+    def recognize(self, images, psm=None):
+        if not images:
+            return []
+        lang, default_psm = ocr_options()
+        psm = psm or default_psm
+        pytesseract.pytesseract.tesseract_cmd = self.tesseract_cmd
+        with tempfile.TemporaryDirectory(prefix='ocr_') as directory:
+            paths = []
+            for index, image in enumerate(images):
+                path = os.path.join(directory, f'page_{index}.png')
+                image.save(path)
+                paths.append(path)
+            list_path = os.path.join(directory, 'pages.txt')
+            with open(list_path, 'w') as f:
+                f.write('\n'.join(paths) + '\n')
+            output = pytesseract.image_to_string(list_path, lang=lang, config=f'--psm {psm}')
+        texts = output.split(PAGE_SEPARATOR)
+        return (texts + [''] * len(images))[:len(images)]
+
+    def shutdown(self):
+        pass
+
+
+_worker_api = None
+
+
+def _init_ocr_worker(tessdata, lang, psm):
+    global _worker_api
+    import tesserocr
+    options = {'lang': lang, 'psm': psm}
+    if tessdata:
+        options['path'] = tessdata
+    _worker_api = tesserocr.PyTessBaseAPI(**options)
+
+
+def _ocr_page(page, psm=None):
+    if psm:
+        _worker_api.SetPageSegMode(psm)
+    _worker_api.SetImage(Image.fromarray(page))
+    return _worker_api.GetUTF8Text()
+
+
+class TesserocrPoolEngine:
+    """Long-lived worker processes, each holding a loaded Tesseract model.
+
+    Page buffers are sent to the workers as NumPy arrays over the pool's pipes.
+    Workers are spawned rather than forked so they never inherit database
+    connections or locks from the web process.
+    """
+
+    def __init__(self, workers, tessdata=None):
+        lang, psm = ocr_options()
+        self.psm = psm
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_ocr_worker,
+            initargs=(tessdata, lang, psm),
+        )
+
+    def recognize(self, images, psm=None):
+        pages = [np.asarray(image) for image in images]
+        return list(self.pool.map(_ocr_page, pages, [psm or self.psm] * len(pages)))
+
+    def shutdown(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+def tesserocr_available():
+    try:
+        import tesserocr  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+_engine = None
+_engine_key = None
+_engine_lock = threading.Lock()
+
+
+def get_ocr_engine():
+    """Return the configured OCR engine, creating it on first use.
+
+    ``VALIDATOR_OCR_ENGINE`` is ``'tesserocr'`` for the worker pool, ``'cli'`` for
+    batched tesseract runs, or ``'auto'`` to use the pool when tesserocr is installed.
+    """
+    global _engine, _engine_key
+    kind = getattr(settings, 'VALIDATOR_OCR_ENGINE', 'auto')
+    auto = kind == 'auto'
+    if auto:
+        kind = 'tesserocr' if tesserocr_available() else 'cli'
+    key = (
+        kind,
+        getattr(settings, 'TESSERACT_CMD', 'tesseract'),
+        getattr(settings, 'TESSERACT_TESSDATA', None),
+        getattr(settings, 'VALIDATOR_OCR_WORKERS', 2),
+        ocr_options(),
+    )
+    with _engine_lock:
+        if _engine_key != key:
+            if _engine is not None:
+                _engine.shutdown()
+            if kind == 'tesserocr':
+                _engine = TesserocrPoolEngine(key[3], tessdata=key[2])
+            else:
+                _engine = TesseractCliEngine(key[1])
+            _engine_key = key
+            logger.info(f"Using {type(_engine).__name__} for OCR")
+            if auto and kind == 'cli':
+                logger.warning("tesserocr is not installed, OCR starts a tesseract process per batch")
+        return _engine
+
+
+def ocr_pages(pages, batch_size=None):
+    """Yield (page_num, text) for an iterable of (page_num, image), OCRed in batches."""
+    batch_size = batch_size or getattr(settings, 'VALIDATOR_OCR_BATCH', 4)
+    engine = get_ocr_engine()
+    batch = []
+    for page in pages:
+        OCR_PAGES.labels('page').inc()
+        batch.append(page)
+        if len(batch) >= batch_size:
+            yield from zip([page_num for page_num, _ in batch], engine.recognize([image for _, image in batch]))
+            batch = []
+    if batch:
+        yield from zip([page_num for page_num, _ in batch], engine.recognize([image for _, image in batch]))
+
+
+def ocr_text_blocks(pages, batch_size=None):
+    """Yield (page_num, text) for the text blocks of each page, in layout priority order.
+
+    Blocks are recognized in batches with ``VALIDATOR_OCR_BLOCK_PSM``, and only
+    as the caller asks for more, so a caller that breaks out once it has what it
+    needs never OCRs the rest of the page or document.
+    """
+    batch_size = batch_size or getattr(settings, 'VALIDATOR_OCR_BATCH', 4)
+    psm = getattr(settings, 'VALIDATOR_OCR_BLOCK_PSM', 6)
+    engine = get_ocr_engine()
+    for page_num, image in pages:
+        OCR_PAGES.labels('blocks').inc()
+        gray = image.convert('L')
+        crops = [gray.crop((x, y, x + w, y + h)) for x, y, w, h in find_text_blocks(gray)]
+        for start in range(0, len(crops), batch_size):
+            yield page_num, '\n'.join(engine.recognize(crops[start:start + batch_size], psm=psm))
@@ -0,0 +1,133 @@
+# Per-document page rasterization shared by the OCR and stamp search stages.
+import math
+import logging
+from collections import OrderedDict
+
+from django.conf import settings
+from pdf2image import convert_from_path
+from PyPDF2 import PdfReader
+
+from .profiling import stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DPI = 200  # pdf2image's own default
+RGB_BANDS = 3
+
+
+def consumer_options(consumer):
+    """Return (dpi, mode) configured for a page consumer ('ocr' or 'stamp')."""
+    if consumer == 'ocr':
+        return getattr(settings, 'VALIDATOR_OCR_DPI', DEFAULT_DPI), getattr(settings, 'VALIDATOR_OCR_PAGE_MODE', 'L')
+    return getattr(settings, 'VALIDATOR_STAMP_DPI', DEFAULT_DPI), getattr(settings, 'VALIDATOR_STAMP_PAGE_MODE', 'RGB')
+
+
+def image_bytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+class PageImageProvider:
+    """Stream the pages of one PDF to every consumer under a memory budget.
+
+    Pages are rendered with Poppler a window at a time (``first_page`` /
+    ``last_page``) at the highest DPI any consumer asks for, capped by
+    ``VALIDATOR_MAX_DPI`` and lowered further if a single page would not fit in
+    ``VALIDATOR_PAGE_MEMORY_BUDGET``. Rendered pages stay in an LRU bounded by that
+    budget, so consumers that walk the document one after the other share the
+    same buffers whenever the document fits, and peak memory stays flat when it
+    does not. Pages past ``VALIDATOR_MAX_PAGES`` are never rendered.
+    """
+
+    def __init__(self, pdf_path, dpi=None, memory_budget=None, window=None, max_pages=None):
+        self.pdf_path = pdf_path
+        dpi = dpi or max(consumer_options('ocr')[0], consumer_options('stamp')[0])
+        self.dpi = min(dpi, getattr(settings, 'VALIDATOR_MAX_DPI', 300))
+        self.memory_budget = memory_budget or getattr(settings, 'VALIDATOR_PAGE_MEMORY_BUDGET', 256 * 1024 * 1024)
+        self.window = window or getattr(settings, 'VALIDATOR_PAGE_WINDOW', 2)
+        self.max_pages = max_pages or getattr(settings, 'VALIDATOR_MAX_PAGES', 50)
+        self._reader = None
+        self._page_count = None
+        self._planned = False
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+
+    @property
+    def reader(self):
+        if self._reader is None:
+            self._reader = PdfReader(self.pdf_path)
+        return self._reader
+
+    @property
+    def page_count(self):
+        if self._page_count is None:
+            total = len(self.reader.pages)
+            if total > self.max_pages:
+                logger.warning(f"{self.pdf_path} has {total} pages, only the first {self.max_pages} are processed")
+            self._page_count = min(total, self.max_pages)
+        return self._page_count
+
+    def plan(self):
+        """Fit the DPI and window to the memory budget using the first page size."""
+        if self._planned:
+            return
+        self._planned = True
+        try:
+            box = self.reader.pages[0].mediabox
+            width, height = float(box.width) / 72, float(box.height) / 72
+        except Exception as e:
+            logger.debug(f"Could not read page size, keeping {self.dpi} DPI: {str(e)}")
+            return
+        page_bytes = width * height * self.dpi ** 2 * RGB_BANDS
+        if page_bytes > self.memory_budget:
+            self.dpi = max(36, int(self.dpi * math.sqrt(self.memory_budget / page_bytes)))
+            page_bytes = width * height * self.dpi ** 2 * RGB_BANDS
+            logger.warning(f"Lowered rendering of {self.pdf_path} to {self.dpi} DPI to fit the page memory budget")
+        self.window = max(1, min(self.window, int(self.memory_budget // max(page_bytes, 1))))
+
+    def is_rendered(self, page_num):
+        return page_num in self._cache
+
+    def _render_window(self, page_num):
+        self.plan()
+        last_page = min(page_num + self.window - 1, self.page_count)
+        with stage('rasterize'):
+            images = convert_from_path(self.pdf_path, dpi=self.dpi, first_page=page_num, last_page=last_page)
+        logger.debug(f"Rendered pages {page_num}-{last_page} of {self.pdf_path} at {self.dpi} DPI")
+        for offset, image in enumerate(images):
+            if page_num + offset in self._cache:
+                continue
+            self._cache[page_num + offset] = image
+            self._cache_bytes += image_bytes(image)
+        # Evict least recently used pages, but never the one being asked for.
+        while self._cache_bytes > self.memory_budget and len(self._cache) > 1:
+            oldest = next(iter(self._cache))
+            if oldest == page_num:
+                self._cache.move_to_end(oldest)
+                oldest = next(iter(self._cache))
+            self._cache_bytes -= image_bytes(self._cache.pop(oldest))
+
+    def page(self, page_num, dpi=None, mode=None):
+        """Return page ``page_num`` (1-based) at the requested DPI and mode."""
+        if page_num not in self._cache:
+            self._render_window(page_num)
+        image = self._cache[page_num]
+        self._cache.move_to_end(page_num)
+        if dpi and dpi < self.dpi:
+            factor = dpi / self.dpi
+            image = image.resize((max(1, round(image.width * factor)), max(1, round(image.height * factor))))
+        if mode and image.mode != mode:
+            image = image.convert(mode)
+        return image
+
+    def pages(self, consumer=None, page_nums=None):
+        """Yield (page_num, image) one page at a time, prepared for ``consumer``.
+
+        ``page_nums`` restricts the walk to the given 1-based pages.
+        """
+        dpi, mode = consumer_options(consumer) if consumer else (None, None)
+        for page_num in page_nums or range(1, self.page_count + 1):
+            yield page_num, self.page(page_num, dpi=dpi, mode=mode)
+
+    def close(self):
+        self._cache.clear()
+        self._cache_bytes = 0
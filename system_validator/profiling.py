@@ -0,0 +1,213 @@
+# Per-stage wall time, CPU time and memory accounting for document validation.
+import os
+import sys
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.dispatch import Signal
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Sent with the stage totals of every validated document: sender=StageProfile, stages=dict.
+stages_recorded = Signal()
+
+_local = threading.local()
+
+
+def max_rss():
+    """High-water mark of this process's resident set size in bytes, or None where unavailable.
+
+    This is the largest RSS since the process started, not since any stage.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def current_rss():
+    """Resident set size of this process right now in bytes, or None where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+RSS_SAMPLE_INTERVAL = 0.005  # Seconds between resident memory samples while a stage runs
+
+
+class _Window:
+    __slots__ = ('start', 'peak')
+
+
+class RssSampler:
+    """Peak resident memory of this process over open windows.
+
+    While any window is open, a daemon thread reads the RSS every
+    RSS_SAMPLE_INTERVAL seconds, so memory allocated and freed again inside a
+    window still counts. Spikes shorter than the interval can be missed, and
+    the RSS is process-wide, so it includes other threads' allocations.
+    """
+
+    def __init__(self):
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            # The sampler thread does not survive a fork and may hold the lock.
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._windows = set()
+        self._thread = None
+
+    def open(self):
+        """Start a window at the current RSS; returns None where the RSS is unavailable."""
+        rss = current_rss()
+        if rss is None:
+            return None
+        window = _Window()
+        window.start = window.peak = rss
+        with self._lock:
+            self._windows.add(window)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name='rss-sampler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return window
+
+    def close(self, window):
+        """End a window; returns its peak RSS above the RSS it started at, in bytes."""
+        rss = current_rss()
+        with self._lock:
+            self._windows.discard(window)
+            if rss is not None:
+                window.peak = max(window.peak, rss)
+        return window.peak - window.start
+
+    def _sample(self):
+        while True:
+            self._wake.wait()
+            rss = current_rss()
+            with self._lock:
+                if not self._windows:
+                    self._wake.clear()
+                    continue
+                if rss is not None:
+                    for window in self._windows:
+                        window.peak = max(window.peak, rss)
+            time.sleep(RSS_SAMPLE_INTERVAL)
+
+
+rss_sampler = RssSampler()
+
+
+class StageProfile:
+    """Totals per named stage: calls, wall and CPU seconds, and peak memory.
+
+    Stages nest; time spent in an inner stage is charged to it and not to the
+    stage around it, so the totals add up to the time of the whole run.
+    ``peak_rss_growth`` is the largest rise of resident memory above its level
+    at the start of one call of the stage, including inner stages, sampled
+    by ``rss_sampler``. Buffers the stage frees before it returns still count,
+    and the figure does not depend on what the process handled before.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._stack = []
+
+    def _charge(self, name, wall, cpu):
+        totals = self.stages.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_rss_growth': None})
+        totals['wall'] += wall
+        totals['cpu'] += cpu
+
+    @contextmanager
+    def stage(self, name):
+        now = (time.perf_counter(), time.process_time())
+        if self._stack:
+            parent = self._stack[-1]
+            self._charge(parent[0], now[0] - parent[1], now[1] - parent[2])
+        self._stack.append([name, *now])
+        window = rss_sampler.open()
+        try:
+            yield
+        finally:
+            end = (time.perf_counter(), time.process_time())
+            _, wall_start, cpu_start = self._stack.pop()
+            self._charge(name, end[0] - wall_start, end[1] - cpu_start)
+            totals = self.stages[name]
+            totals['calls'] += 1
+            if window is not None:
+                growth = rss_sampler.close(window)
+                totals['peak_rss_growth'] = (growth if totals['peak_rss_growth'] is None
+                                             else max(totals['peak_rss_growth'], growth))
+            if self._stack:
+                self._stack[-1][1:] = end
+
+    def merge(self, stages):
+        """Add the totals of another profile, such as one recorded in a worker process.
+
+        Work done in parallel is added up, so totals can exceed the elapsed time.
+        """
+        for name, other in stages.items():
+            totals = self.stages.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_rss_growth': None})
+            totals['calls'] += other['calls']
+            totals['wall'] += other['wall']
+            totals['cpu'] += other['cpu']
+            if other['peak_rss_growth'] is not None:
+                totals['peak_rss_growth'] = (other['peak_rss_growth'] if totals['peak_rss_growth'] is None
+                                             else max(totals['peak_rss_growth'], other['peak_rss_growth']))
+
+    def report(self):
+        """Return {stage: {calls, wall_ms, cpu_ms, peak_rss_growth}} for API payloads."""
+        return {
+            name: {
+                'calls': totals['calls'],
+                'wall_ms': round(totals['wall'] * 1000, 1),
+                'cpu_ms': round(totals['cpu'] * 1000, 1),
+                'peak_rss_growth': totals['peak_rss_growth'],
+            }
+            for name, totals in self.stages.items()
+        }
+
+    def emit(self, label):
+        """Log the totals and send ``stages_recorded`` for metrics receivers."""
+        summary = ', '.join(f"{name}={totals['wall'] * 1000:.0f}ms" for name, totals in self.stages.items())
+        logger.info(f"Validation stages for {label}: {summary}")
+        stages_recorded.send(sender=StageProfile, stages=self.stages)
+
+
+@contextmanager
+def profiled():
+    """Record the stages run by this thread into a new StageProfile."""
+    previous = getattr(_local, 'profile', None)
+    profile = _local.profile = StageProfile()
+    try:
+        yield profile
+    finally:
+        _local.profile = previous
+
+
+def current_profile():
+    """Return the StageProfile this thread records into, or None."""
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def stage(name):
+    """Charge the enclosed code to ``name`` in the active profile, if any."""
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        yield
+        return
+    with profile.stage(name):
+        yield
@@ -0,0 +1,90 @@
+# Cheap ink-colour region proposals that narrow where stamps are searched for.
+import math
+import logging
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# OpenCV hue runs 0-179. Stamp inks are blue to violet, or red wrapping around 0.
+INK_HUES = [(90, 160), (0, 10), (170, 179)]
+MIN_SATURATION = 70  # Black print and paper are unsaturated
+MIN_VALUE = 40
+MIN_CIRCULARITY = 0.5  # Of the convex hull: 1 for a disc, ~0.79 for a square, low for lines of handwriting
+MAX_ASPECT = 3
+
+
+def ink_mask(rgb):
+    """Return a binary mask of saturated blue, violet and red pixels in an RGB page."""
+    hsv = cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV)
+    mask = np.zeros(hsv.shape[:2], dtype=np.uint8)
+    for low, high in INK_HUES:
+        mask |= cv2.inRange(hsv, (low, MIN_SATURATION, MIN_VALUE), (high, 255, 255))
+    return mask
+
+
+def circularity(points):
+    hull = cv2.convexHull(points)
+    perimeter = cv2.arcLength(hull, True)
+    if not perimeter:
+        return 0.0
+    return 4 * math.pi * cv2.contourArea(hull) / perimeter ** 2
+
+
+def merge_overlapping(boxes):
+    """Union (x, y, w, h) boxes that overlap, such as the inner and outer ring of one stamp."""
+    merged = []
+    for x, y, w, h in sorted(boxes):
+        for index, (mx, my, mw, mh) in enumerate(merged):
+            if x < mx + mw and mx < x + w and y < my + mh and my < y + h:
+                x0, y0 = min(x, mx), min(y, my)
+                x1, y1 = max(x + w, mx + mw), max(y + h, my + mh)
+                merged[index] = (x0, y0, x1 - x0, y1 - y0)
+                break
+        else:
+            merged.append((x, y, w, h))
+    return merged if len(merged) == len(boxes) else merge_overlapping(merged)
+
+
+def propose_stamp_regions(rgb):
+    """Return up to VALIDATOR_STAMP_MAX_REGIONS padded (x, y, w, h) boxes likely to hold a stamp.
+
+    Ink pixels are closed into blobs and split into connected components.
+    Components are kept when their bounding box is within
+    ``VALIDATOR_STAMP_REGION_MIN_AREA`` and ``VALIDATOR_STAMP_REGION_MAX_AREA`` of the page
+    area, and their shape is compact enough for a round or rectangular stamp.
+    Overlapping components are merged and the largest regions are returned.
+    An empty list means the page has no stamp-like ink at all.
+    """
+    height, width = rgb.shape[:2]
+    page_area = height * width
+    min_area = getattr(settings, 'VALIDATOR_STAMP_REGION_MIN_AREA', 0.0005) * page_area
+    max_area = getattr(settings, 'VALIDATOR_STAMP_REGION_MAX_AREA', 0.2) * page_area
+    max_regions = getattr(settings, 'VALIDATOR_STAMP_MAX_REGIONS', 3)
+
+    mask = ink_mask(rgb)
+    size = max(3, width // 100) | 1
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size)))
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+
+    regions = []
+    for label in range(1, count):
+        x, y, w, h, pixels = stats[label]
+        if not min_area <= w * h <= max_area or max(w, h) > MAX_ASPECT * min(w, h):
+            continue
+        points = cv2.findNonZero((labels[y:y+h, x:x+w] == label).astype(np.uint8))
+        if circularity(points) < MIN_CIRCULARITY:
+            continue
+        regions.append((int(x), int(y), int(w), int(h)))
+    regions = sorted(merge_overlapping(regions), key=lambda box: box[2] * box[3], reverse=True)
+
+    boxes = []
+    for x, y, w, h in regions[:max_regions]:
+        pad = max(w, h) // 5 + size
+        x0, y0 = max(0, x - pad), max(0, y - pad)
+        x1, y1 = min(width, x + w + pad), min(height, y + h + pad)
+        boxes.append((x0, y0, x1 - x0, y1 - y0))
+    logger.debug(f"Ink region proposals: {boxes} out of {count - 1} ink components")
+    return boxes
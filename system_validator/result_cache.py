@@ -0,0 +1,70 @@
+# Persisted validation verdicts keyed by document content and reference data version.
+import hashlib
+import logging
+
+from django.db import IntegrityError, transaction
+
+from .models import ReferenceVersion, ValidationResult
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(file):
+    """Hash a Django File in chunks without reading it into memory."""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def reference_version():
+    """Version stamp of the Hospital, DiseaseType and DoctorStamp tables."""
+    versions = ReferenceVersion.current()
+    return '.'.join(
+        str(versions.get(table, 0))
+        for table in (ReferenceVersion.HOSPITAL, ReferenceVersion.DISEASE, ReferenceVersion.STAMP)
+    )
+
+
+def lookup(sha256, version):
+    """Return the stored verdict dict for a document, or None."""
+    cached = ValidationResult.objects.filter(sha256=sha256, reference_version=version).first()
+    if cached is None:
+        return None
+    logger.debug(f"Validation cache hit for {sha256}")
+    return {'result': cached.result, 'reason': cached.reason, 'evidence': cached.evidence}
+
+
+def version_tuple(version):
+    return tuple(int(part) for part in version.split('.'))
+
+
+def store(sha256, version, verdict):
+    """Persist a verdict and drop entries for the same document checked against older reference data.
+
+    Nothing is stored when the reference data changed since ``version`` was
+    read, since the verdict may already be out of date.
+    """
+    if reference_version() != version:
+        logger.debug(f"Reference data changed while validating {sha256}, not caching the verdict")
+        return
+    try:
+        with transaction.atomic():
+            ValidationResult.objects.create(
+                sha256=sha256,
+                reference_version=version,
+                result=verdict['result'],
+                reason=verdict['reason'],
+                evidence=verdict.get('evidence', {}),
+            )
+    except IntegrityError:
+        return  # A concurrent validation of the same file stored it first
+    # Versions only grow, so a row is stale when none of its counters is ahead of ours.
+    current = version_tuple(version)
+    stale = [
+        pk for pk, other in ValidationResult.objects.filter(sha256=sha256).exclude(
+            reference_version=version).values_list('pk', 'reference_version')
+        if all(a <= b for a, b in zip(version_tuple(other), current))
+    ]
+    ValidationResult.objects.filter(pk__in=stale).delete()
@@ -0,0 +1,102 @@
+# Keep in-process validator caches in sync with the reference tables.
+#
+# OpenCV and the descriptor store are imported inside the handlers, so loading
+# the app does not pull in the validator's vision stack.
+import sys
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal, receiver
+from .models import Hospital, DiseaseType, DoctorStamp, ReferenceVersion
+
+logger = logging.getLogger(__name__)
+
+# Sent after added reference data changed stored evidence: sender=DocumentEvidence, verdicts={sha256: verdict}.
+evidence_rechecked = Signal()
+
+
+@receiver(post_save, sender=DoctorStamp)
+@receiver(post_delete, sender=DoctorStamp)
+def invalidate_stamp_templates(sender, instance, **kwargs):
+    # A process that never loaded the template cache has nothing to invalidate.
+    if 'system_validator.stamp_cache' in sys.modules:
+        from .stamp_cache import template_cache
+        template_cache.invalidate(instance.pk)
+
+
+def store_stamp_features(stamp):
+    """Compute and persist the ORB features of a stamp image."""
+    import cv2
+    from .descriptors import compute_orb_features, array_to_bytes
+
+    keypoints = descriptors = None
+    gray = cv2.imread(stamp.image.path, cv2.IMREAD_GRAYSCALE) if stamp.image else None
+    if gray is None:
+        logger.error(f"Failed to load stamp image for feature extraction: {stamp}")
+    else:
+        keypoints, descriptors = compute_orb_features(gray)
+    DoctorStamp.objects.filter(pk=stamp.pk).update(
+        orb_keypoints=array_to_bytes(keypoints) if keypoints is not None else None,
+        orb_descriptors=array_to_bytes(descriptors) if descriptors is not None else None,
+    )
+
+
+@receiver(post_save, sender=DoctorStamp)
+def update_stamp_features(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and 'image' not in update_fields):
+        return
+    store_stamp_features(instance)
+    transaction.on_commit(rebuild_descriptor_store)
+
+
+@receiver(post_delete, sender=DoctorStamp)
+def drop_stamp_features(sender, instance, **kwargs):
+    transaction.on_commit(rebuild_descriptor_store)
+
+
+def rebuild_descriptor_store():
+    from .descriptors import descriptor_store
+    descriptor_store.rebuild()
+
+
+@receiver(post_save, sender=Hospital)
+@receiver(post_delete, sender=Hospital)
+def bump_hospital_version(sender, raw=False, **kwargs):
+    if not raw:
+        ReferenceVersion.bump(ReferenceVersion.HOSPITAL)
+
+
+@receiver(post_save, sender=DiseaseType)
+@receiver(post_delete, sender=DiseaseType)
+def bump_disease_version(sender, raw=False, **kwargs):
+    if not raw:
+        ReferenceVersion.bump(ReferenceVersion.DISEASE)
+
+
+@receiver(post_save, sender=DoctorStamp)
+@receiver(post_delete, sender=DoctorStamp)
+def bump_stamp_version(sender, raw=False, **kwargs):
+    if not raw:
+        ReferenceVersion.bump(ReferenceVersion.STAMP)
+
+
+def queue_recheck(table, pk):
+    from .tasks import recheck_evidence_task
+    recheck_evidence_task.delay(table, pk)
+
+
+# Registered after update_stamp_features, so the descriptor store is rebuilt before the re-check is queued.
+@receiver(post_save, sender=Hospital)
+@receiver(post_save, sender=DiseaseType)
+@receiver(post_save, sender=DoctorStamp)
+def recheck_stored_evidence(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        table = {
+            Hospital: ReferenceVersion.HOSPITAL,
+            DiseaseType: ReferenceVersion.DISEASE,
+            DoctorStamp: ReferenceVersion.STAMP,
+        }[sender]
+        # The row is saved either way; a broker outage is logged instead of failing the save.
+        transaction.on_commit(lambda: queue_recheck(table, instance.pk), robust=True)
+
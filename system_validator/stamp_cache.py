@@ -0,0 +1,109 @@
+# In-process cache of preprocessed DoctorStamp templates used by template matching.
+import threading
+import logging
+from collections import OrderedDict
+
+import cv2
+from django.conf import settings
+
+from .metrics import STAMP_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_SCALES = [0.5, 0.75, 1.0, 1.25, 1.5]
+
+
+def preprocess_gray(gray):
+    """Blur and equalize a grayscale image the same way for pages and templates."""
+    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+    return cv2.equalizeHist(gray)
+
+
+def resize(image, scale):
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+class StampTemplates:
+    """Preprocessed grayscale template of one stamp and its scaled copies."""
+
+    def __init__(self, base, scales=TEMPLATE_SCALES):
+        self.base = base
+        self.pyramid = [(scale, resize(base, scale)) for scale in scales]
+        self._coarse = {}
+
+    def coarse(self, factor, scales=TEMPLATE_SCALES):
+        """Return [(scale, template)] shrunk by ``factor`` for the coarse pyramid level."""
+        key = (factor, tuple(scales))
+        if key not in self._coarse:
+            self._coarse[key] = [(scale, resize(self.base, scale * factor)) for scale in scales]
+        return self._coarse[key]
+
+
+def build_stamp_templates(template_path):
+    """Load a stamp image and preprocess it, or return None if it cannot be read."""
+    template = cv2.imread(template_path, cv2.IMREAD_GRAYSCALE)
+    if template is None:
+        return None
+    return StampTemplates(preprocess_gray(template))
+
+
+class StampTemplateCache:
+    """Bounded LRU of StampTemplates keyed by (stamp id, image name).
+
+    The image name is part of the key so that a worker process which missed an
+    invalidation signal still rebuilds the templates once the stamp image changes.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _limit(self):
+        if self.max_entries is not None:
+            return self.max_entries
+        return getattr(settings, 'STAMP_TEMPLATE_CACHE_SIZE', 512)
+
+    def get(self, stamp):
+        """Return the StampTemplates for a stamp, building them on first use."""
+        key = (stamp.pk, stamp.image.name)
+        with self._lock:
+            templates = self._entries.get(key)
+            if templates is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                STAMP_CACHE_REQUESTS.labels('hit').inc()
+                return templates
+            self.misses += 1
+        STAMP_CACHE_REQUESTS.labels('miss').inc()
+
+        templates = build_stamp_templates(stamp.image.path)
+        if templates is None:
+            logger.error(f"Failed to load template image: {stamp.image.path}")
+            return None
+
+        with self._lock:
+            self._entries[key] = templates
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._limit():
+                self._entries.popitem(last=False)
+        logger.debug(f"Built templates for stamp {stamp.pk}")
+        return templates
+
+    def invalidate(self, stamp_id):
+        """Drop the cached templates of a stamp id."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == stamp_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+template_cache = StampTemplateCache()
@@ -0,0 +1,121 @@
+# Approximate nearest-neighbour index over all stamp descriptors for top-k retrieval.
+import threading
+import logging
+from collections import Counter
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from .descriptors import descriptor_store
+
+logger = logging.getLogger(__name__)
+
+FLANN_INDEX_LSH = 6
+LSH_PARAMS = dict(algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12, multi_probe_level=1)
+MAX_HAMMING_DISTANCE = 64  # Out of 256 bits; farther neighbours are not counted as votes
+
+
+class _Segment:
+    """Descriptors of a fixed set of stamps with a matcher and a row -> stamp map."""
+
+    def __init__(self, blocks, matcher):
+        self.stamp_ids = {stamp_id for stamp_id, _ in blocks}
+        self.owners = np.concatenate(
+            [np.full(len(des), stamp_id, dtype=np.int64) for stamp_id, des in blocks]
+        ) if blocks else np.empty(0, dtype=np.int64)
+        self.size = len(self.owners)
+        self.matcher = matcher
+        if self.size:
+            self.matcher.add([np.ascontiguousarray(np.concatenate([des for _, des in blocks]))])
+            self.matcher.train()
+
+    def vote(self, query, votes, excluded):
+        if not self.size:
+            return
+        for neighbours in self.matcher.knnMatch(query, k=2):
+            if not neighbours or neighbours[0].distance > MAX_HAMMING_DISTANCE:
+                continue
+            if len(neighbours) > 1 and neighbours[0].distance > 0.8 * neighbours[1].distance:
+                continue
+            stamp_id = int(self.owners[neighbours[0].trainIdx])
+            if stamp_id not in excluded:
+                votes[stamp_id] += 1
+
+
+class StampIndex:
+    """Top-k candidate retrieval over the descriptor store.
+
+    Most stamps live in a FLANN LSH ``base`` segment. Stamps added since the base
+    was built go to a small brute-force ``delta`` segment and removed or changed
+    stamps are masked out, so a stamp change never requires retraining the whole
+    index. The base is rebuilt once the delta or the masked rows grow past
+    ``STAMP_INDEX_REBUILD_RATIO`` of its size.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._store_version = None
+        self._checksums = {}
+        self._base = None
+        self._delta = None
+        self._removed = frozenset()
+        self._removed_rows = 0
+
+    def _blocks(self, stamp_ids):
+        blocks = [(stamp_id, descriptor_store.get(stamp_id)) for stamp_id in sorted(stamp_ids)]
+        return [(stamp_id, des) for stamp_id, des in blocks if des is not None]
+
+    def _build_base(self, stamp_ids):
+        self._base = _Segment(self._blocks(stamp_ids), cv2.FlannBasedMatcher(LSH_PARAMS, dict(checks=50)))
+        self._delta = _Segment([], cv2.BFMatcher(cv2.NORM_HAMMING))
+        self._removed = frozenset()
+        self._removed_rows = 0
+        logger.info(f"Built stamp index base: {len(stamp_ids)} stamps, {self._base.size} descriptors")
+
+    def sync(self):
+        """Bring the index up to date with the descriptor store."""
+        version = descriptor_store.version
+        if version == self._store_version:
+            return
+        with self._lock:
+            if version == self._store_version:
+                return
+            current = dict(descriptor_store.checksums)
+            if self._base is None:
+                self._build_base(current)
+            else:
+                changed = {stamp_id for stamp_id, crc in self._checksums.items() if current.get(stamp_id) != crc}
+                added = {stamp_id for stamp_id, crc in current.items() if self._checksums.get(stamp_id) != crc}
+                removed = frozenset(self._removed | changed)
+                removed_rows = self._removed_rows + sum(
+                    int(np.count_nonzero(self._base.owners == stamp_id)) for stamp_id in (changed & self._base.stamp_ids) - self._removed
+                )
+                delta_ids = (self._delta.stamp_ids - changed) | added
+                delta = _Segment(self._blocks(delta_ids), cv2.BFMatcher(cv2.NORM_HAMMING))
+
+                ratio = getattr(settings, 'STAMP_INDEX_REBUILD_RATIO', 0.2)
+                if delta.size + removed_rows > ratio * max(self._base.size, 1):
+                    self._build_base(current)
+                else:
+                    # Stamps in the delta shadow their stale base rows.
+                    self._removed = removed | (delta_ids & self._base.stamp_ids)
+                    self._removed_rows = removed_rows
+                    self._delta = delta
+            self._checksums = current
+            self._store_version = version
+
+    def candidates(self, descriptors, k=None):
+        """Return up to k stamp ids ranked by descriptor votes."""
+        if k is None:
+            k = getattr(settings, 'STAMP_INDEX_TOP_K', 5)
+        self.sync()
+        base, delta, removed = self._base, self._delta, self._removed
+        votes = Counter()
+        query = np.ascontiguousarray(descriptors)
+        base.vote(query, votes, removed)
+        delta.vote(query, votes, frozenset())
+        return [stamp_id for stamp_id, _ in votes.most_common(k)]
+
+
+stamp_index = StampIndex()
@@ -0,0 +1,13 @@
+import logging
+
+from celery import shared_task
+
+from .validator import recheck_evidence
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def recheck_evidence_task(table, pk):
+    """Re-check stored document evidence against an added Hospital, DiseaseType or DoctorStamp."""
+    recheck_evidence(table, pk)
@@ -0,0 +1,158 @@
+# Locate a DoctorStamp template on a preprocessed page with cv2.matchTemplate.
+import os
+import heapq
+import logging
+from collections import namedtuple
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from .stamp_cache import template_cache, resize, TEMPLATE_SCALES
+
+logger = logging.getLogger(__name__)
+
+MATCH_THRESHOLD = 0.4
+GOLDEN_RATIO = (np.sqrt(5) - 1) / 2
+
+# Best template hit: confidence, top-left corner, template (h, w), template path and scale.
+TemplateHit = namedtuple('TemplateHit', ['score', 'loc', 'shape', 'template_path', 'scale'])
+
+
+def stamp_templates(approved_stamps):
+    """Yield (template path, StampTemplates) for every usable approved stamp."""
+    for stamp in approved_stamps:
+        if not hasattr(stamp, 'image') or not stamp.image:
+            logger.warning(f"Invalid stamp object in database: {stamp}")
+            continue
+
+        template_path = stamp.image.path
+        if not os.path.exists(template_path):
+            logger.error(f"Template image not found: {template_path}")
+            continue
+
+        templates = template_cache.get(stamp)
+        if templates is not None:
+            yield template_path, templates
+
+
+def fits(template, gray):
+    return template.shape[0] <= gray.shape[0] and template.shape[1] <= gray.shape[1]
+
+
+def search_exhaustive(gray, approved_stamps):
+    """Match every template at every fixed scale over the whole page."""
+    best = None
+    for template_path, templates in stamp_templates(approved_stamps):
+        for scale, scaled_template in templates.pyramid:
+            if not fits(scaled_template, gray):
+                continue
+
+            result = cv2.matchTemplate(gray, scaled_template, cv2.TM_CCOEFF_NORMED)
+            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+
+            if max_val > MATCH_THRESHOLD and (best is None or max_val > best.score):
+                best = TemplateHit(max_val, max_loc, scaled_template.shape, template_path, scale)
+    return best
+
+
+def _match_window(gray, template, center, margin):
+    """Best TM_CCOEFF_NORMED score and page location of a template placed near ``center``."""
+    h, w = template.shape
+    cx, cy = center
+    x0 = max(0, int(cx - w / 2 - margin))
+    y0 = max(0, int(cy - h / 2 - margin))
+    x1 = min(gray.shape[1], int(cx + w / 2 + margin))
+    y1 = min(gray.shape[0], int(cy + h / 2 + margin))
+    window = gray[y0:y1, x0:x1]
+    if not fits(template, window):
+        return -1.0, None
+    result = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+    return max_val, (x0 + max_loc[0], y0 + max_loc[1])
+
+
+def _refine(gray, base, scale, center, margin, span, iterations):
+    """Golden-section search of the template scale around a coarse hit, in full-resolution windows."""
+    evaluated = {}
+
+    def score(s):
+        if s not in evaluated:
+            template = resize(base, s)
+            evaluated[s] = (*_match_window(gray, template, center, margin), template.shape)
+        return evaluated[s][0]
+
+    low, high = scale / span, scale * span
+    a = high - GOLDEN_RATIO * (high - low)
+    b = low + GOLDEN_RATIO * (high - low)
+    for _ in range(iterations):
+        if score(a) >= score(b):
+            high, b = b, a
+            a = high - GOLDEN_RATIO * (high - low)
+        else:
+            low, a = a, b
+            b = low + GOLDEN_RATIO * (high - low)
+    score(scale)  # The coarse scale itself is always a candidate
+    best_scale = max(evaluated, key=lambda s: evaluated[s][0])
+    best_score, loc, shape = evaluated[best_scale]
+    return best_score, loc, shape, float(best_scale)
+
+
+def coarse_scales(step):
+    """Geometric scale steps covering the same range as TEMPLATE_SCALES."""
+    low, high = TEMPLATE_SCALES[0], TEMPLATE_SCALES[-1]
+    count = int(np.ceil(np.log(high / low) / np.log(step))) + 1
+    return tuple(float(scale) for scale in np.geomspace(low, high, count))
+
+
+def search_coarse_to_fine(gray, approved_stamps):
+    """Match on a downsampled page, then refine the best hits at full resolution.
+
+    Every template is matched at ``VALIDATOR_STAMP_COARSE_FACTOR`` of the page
+    resolution, on scales ``VALIDATOR_STAMP_COARSE_SCALE_STEP`` apart. That is
+    cheap enough to sample scale more densely than the fixed list. The
+    ``VALIDATOR_STAMP_COARSE_CANDIDATES`` best (location, scale) hits are then
+    refined at full resolution inside a window around the hit, with a
+    golden-section search for the scale between the neighbouring steps.
+    """
+    factor = getattr(settings, 'VALIDATOR_STAMP_COARSE_FACTOR', 0.25)
+    step = getattr(settings, 'VALIDATOR_STAMP_COARSE_SCALE_STEP', 1.1)
+    keep = getattr(settings, 'VALIDATOR_STAMP_COARSE_CANDIDATES', 5)
+    coarse_threshold = getattr(settings, 'VALIDATOR_STAMP_COARSE_THRESHOLD', 0.3)
+    small = resize(gray, factor)
+    scales = coarse_scales(step)
+
+    candidates = []
+    for template_path, templates in stamp_templates(approved_stamps):
+        for scale, coarse_template in templates.coarse(factor, scales):
+            if min(coarse_template.shape) < 8 or not fits(coarse_template, small):
+                continue
+            result = cv2.matchTemplate(small, coarse_template, cv2.TM_CCOEFF_NORMED)
+            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+            if max_val > coarse_threshold:
+                h, w = coarse_template.shape
+                center = ((max_loc[0] + w / 2) / factor, (max_loc[1] + h / 2) / factor)
+                candidates.append((max_val, template_path, templates, scale, center))
+    candidates = heapq.nlargest(keep, candidates, key=lambda candidate: candidate[0])
+    logger.debug(f"Coarse template candidates: {[(round(c[0], 3), c[3]) for c in candidates]}")
+
+    best = None
+    margin = 2 / factor
+    for coarse_score, template_path, templates, scale, center in candidates:
+        score, loc, shape, refined_scale = _refine(
+            gray, templates.base, scale, center, margin, span=step, iterations=6
+        )
+        if loc is not None and score > MATCH_THRESHOLD and (best is None or score > best.score):
+            best = TemplateHit(score, loc, shape, template_path, refined_scale)
+    return best
+
+
+def find_stamp_template(gray, approved_stamps):
+    """Return the best TemplateHit above the match threshold, or None.
+
+    ``VALIDATOR_STAMP_SEARCH`` selects ``'coarse_to_fine'`` (default) or the
+    ``'exhaustive'`` full-page search over the fixed scales.
+    """
+    if getattr(settings, 'VALIDATOR_STAMP_SEARCH', 'coarse_to_fine') == 'exhaustive':
+        return search_exhaustive(gray, approved_stamps)
+    return search_coarse_to_fine(gray, approved_stamps)
@@ -1,3 +1,815 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image
+from PyPDF2 import PdfReader
+
+from .models import DoctorStamp, DocumentEvidence, Hospital, DiseaseType, ReferenceVersion, ValidationResult
+from .stamp_cache import template_cache, preprocess_gray, TEMPLATE_SCALES
+from .template_search import search_coarse_to_fine
+from .regions import propose_stamp_regions
+from .descriptors import STORE_FILE, array_from_bytes, descriptor_store, store_dir
+from .stamp_index import StampIndex, stamp_index
+from . import benchmark, engine, evidence, result_cache, signals, utils, warmup
+from .profiling import current_rss, profiled, stage, stages_recorded
+from .pages import PageImageProvider
+from .admission import AdmissionRejected, admission
+from . import vocabulary
+from .vocabulary import VocabularyMatcher, get_matchers
+from .ocr import TesseractCliEngine, ocr_pages
+from .layout import find_text_blocks
+from .utils import match_stamp
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def make_stamp_png(seed=0, size=120):
+    """Render a synthetic ring stamp with some text-like strokes."""
+    rng = np.random.default_rng(seed)
+    image = np.full((size, size, 3), 255, dtype=np.uint8)
+    center = (size // 2, size // 2)
+    cv2.circle(image, center, size // 2 - 4, (200, 40, 40), 3)
+    cv2.circle(image, center, size // 3, (200, 40, 40), 2)
+    for _ in range(12):
+        x1, y1, x2, y2 = (int(v) for v in rng.integers(size // 4, 3 * size // 4, 4))
+        cv2.line(image, (x1, y1), (x2, y2), (200, 40, 40), 2)
+    ok, buf = cv2.imencode('.png', image)
+    return buf.tobytes()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class StampTemplateCacheTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        template_cache.clear()
+        self.stamp = DoctorStamp.objects.create(
+            image=SimpleUploadedFile('stamp.png', make_stamp_png(), content_type='image/png')
+        )
+
+    def test_pyramid_is_built_once(self):
+        templates = template_cache.get(self.stamp)
+        self.assertEqual([scale for scale, _ in templates.pyramid], TEMPLATE_SCALES)
+        self.assertIs(template_cache.get(self.stamp), templates)
+
+    def test_coarse_to_fine_search_finds_stamp_between_scales(self):
+        stamp = cv2.imdecode(np.frombuffer(make_stamp_png(), np.uint8), cv2.IMREAD_GRAYSCALE)
+        stamp = cv2.resize(stamp, None, fx=1.1, fy=1.1)
+        page = np.full((1100, 850), 255, dtype=np.uint8)
+        page[700:700 + stamp.shape[0], 500:500 + stamp.shape[1]] = stamp
+        gray = preprocess_gray(page)
+
+        hit = search_coarse_to_fine(gray, [self.stamp])
+        self.assertIsNotNone(hit)
+        self.assertLess(abs(hit.loc[0] - 500) + abs(hit.loc[1] - 700), 8)
+        self.assertAlmostEqual(hit.scale, 1.1, delta=0.06)
+        self.assertGreater(hit.score, 0.8)
+
+    def test_save_and_delete_invalidate(self):
+        template_cache.get(self.stamp)
+        self.stamp.save()
+        self.assertEqual(len(template_cache), 0)
+        template_cache.get(self.stamp)
+        self.stamp.delete()
+        self.assertEqual(len(template_cache), 0)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class DescriptorStoreTests(TestCase):
+    def create_stamp(self, seed):
+        with self.captureOnCommitCallbacks(execute=True), mock.patch.object(signals, 'queue_recheck'):
+            return DoctorStamp.objects.create(
+                image=SimpleUploadedFile(f'stamp{seed}.png', make_stamp_png(seed), content_type='image/png')
+            )
+
+    def test_features_are_persisted_on_save(self):
+        stamp = self.create_stamp(1)
+        stamp.refresh_from_db()
+        descriptors = array_from_bytes(stamp.orb_descriptors)
+        self.assertEqual(descriptors.dtype, np.uint8)
+        self.assertEqual(descriptors.shape[1], 32)
+        self.assertEqual(len(array_from_bytes(stamp.orb_keypoints)), len(descriptors))
+
+    def test_store_is_contiguous_and_tracks_deletes(self):
+        first, second = self.create_stamp(1), self.create_stamp(2)
+        self.assertEqual(len(descriptor_store.get(first.pk)) + len(descriptor_store.get(second.pk)),
+                         len(descriptor_store.descriptors))
+        self.assertIsInstance(descriptor_store.descriptors, np.memmap)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertIsNone(descriptor_store.get(first.pk))
+
+    def test_store_is_one_file_in_id_order_and_checks_its_rows(self):
+        first, second = self.create_stamp(1), self.create_stamp(2)
+        descriptor_store.version  # Load the rebuilt file
+        self.assertEqual(list(descriptor_store.offsets), [first.pk, second.pk])
+        path = os.path.join(store_dir(), STORE_FILE)
+        self.assertEqual(sorted(name for name in os.listdir(os.path.dirname(path)) if not name.endswith('.lock')),
+                         [STORE_FILE])
+
+        with open(path, 'rb') as f:
+            data = bytearray(f.read())
+        data[-1] ^= 0xFF  # The last row belongs to the stamp with the highest id
+        with open(path + '.corrupt', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.corrupt', path)
+        with self.assertLogs('system_validator.descriptors', 'ERROR'):
+            self.assertIsNone(descriptor_store.get(second.pk))
+        self.assertIsNotNone(descriptor_store.get(first.pk))
+
+    def test_migration_backfills_stamps_saved_without_features(self):
+        from django.apps import apps
+        from importlib import import_module
+        backfill = import_module('system_validator.migrations.0006_backfill_stamp_features').backfill_stamp_features
+
+        stamp = self.create_stamp(5)
+        DoctorStamp.objects.filter(pk=stamp.pk).update(orb_keypoints=None, orb_descriptors=None)
+        descriptor_store.rebuild()
+        self.assertIsNone(descriptor_store.get(stamp.pk))
+
+        backfill(apps, None)
+        stamp.refresh_from_db()
+        self.assertIsNotNone(stamp.orb_descriptors)
+        self.assertEqual(len(descriptor_store.get(stamp.pk)), len(array_from_bytes(stamp.orb_descriptors)))
+
+    def test_match_stamp_uses_stored_descriptors(self):
+        stamp = self.create_stamp(3)
+        self.assertTrue(match_stamp(stamp.image.path, DoctorStamp.objects.all()))
+
+    def test_black_ink_stamp_on_a_colour_page_is_matched(self):
+        gray = cv2.imdecode(np.frombuffer(make_stamp_png(6), np.uint8), cv2.IMREAD_GRAYSCALE)
+        black = np.where(gray < 200, 0, 255).astype(np.uint8)
+        with self.captureOnCommitCallbacks(execute=True), mock.patch.object(signals, 'queue_recheck'):
+            stamp = DoctorStamp.objects.create(image=SimpleUploadedFile(
+                'black.png', cv2.imencode('.png', black)[1].tobytes(), content_type='image/png'))
+        page = Image.new('RGB', (850, 1100), 'white')
+        page.paste(Image.fromarray(black).convert('RGB'), (500, 700))
+        self.assertEqual(propose_stamp_regions(np.array(page)), [])
+        self.assertEqual(utils.match_stamp_on_page(page, [stamp]).stamp_id, stamp.pk)
+
+    def test_page_is_matched_in_memory_with_sampled_debug_dumps(self):
+        stamp = self.create_stamp(4)
+        page = Image.new('RGB', (850, 1100), 'white')
+        page.paste(Image.open(stamp.image.path).convert('RGB'), (500, 700))
+        debug_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, debug_dir, ignore_errors=True)
+
+        with override_settings(VALIDATOR_DEBUG_DIR=debug_dir, VALIDATOR_DEBUG_SAMPLE_RATE=0):
+            self.assertEqual(utils.match_stamp_on_page(page, [stamp]).stamp_id, stamp.pk)
+        self.assertEqual(os.listdir(debug_dir), [])
+
+        with override_settings(VALIDATOR_DEBUG_DIR=debug_dir, VALIDATOR_DEBUG_SAMPLE_RATE=1):
+            utils.match_stamp_on_page(page, [stamp])
+            utils.match_stamp_on_page(page, [stamp])
+        dumps = sorted(name.split('_')[0] for name in os.listdir(debug_dir))
+        self.assertEqual(dumps, ['page', 'page', 'stamp', 'stamp'])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class StampIndexTests(TestCase):
+    def create_stamp(self, seed):
+        with self.captureOnCommitCallbacks(execute=True), mock.patch.object(signals, 'queue_recheck'):
+            return DoctorStamp.objects.create(
+                image=SimpleUploadedFile(f'stamp{seed}.png', make_stamp_png(seed, size=240), content_type='image/png')
+            )
+
+    def test_top_candidate_is_the_query_stamp(self):
+        stamps = [self.create_stamp(seed) for seed in range(4)]
+        for stamp in stamps:
+            self.assertEqual(stamp_index.candidates(descriptor_store.get(stamp.pk), k=1), [stamp.pk])
+
+    @override_settings(STAMP_INDEX_REBUILD_RATIO=100)
+    def test_changes_go_to_delta_without_rebuilding_base(self):
+        index = StampIndex()
+        first = self.create_stamp(10)
+        first_descriptors = np.array(descriptor_store.get(first.pk))
+        index.sync()
+        base = index._base
+        second = self.create_stamp(11)
+        self.assertEqual(index.candidates(descriptor_store.get(second.pk), k=1), [second.pk])
+        self.assertIs(index._base, base)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertNotIn(first.pk, index.candidates(first_descriptors))
+        self.assertIs(index._base, base)
+
+
+class InkRegionProposalTests(TestCase):
+    def page(self, stamp=True):
+        page = np.full((1100, 850, 3), 255, dtype=np.uint8)
+        for row in range(100, 1000, 40):
+            cv2.putText(page, 'Diagnosis and treatment notes', (60, row), cv2.FONT_HERSHEY_SIMPLEX, 1, (20, 20, 20), 2)
+        # A signature line in blue pen: coloured, but too elongated for a stamp.
+        cv2.line(page, (80, 1050), (400, 1040), (30, 30, 200), 3)
+        if stamp:
+            stamp_rgb = cv2.cvtColor(cv2.imdecode(np.frombuffer(make_stamp_png(), np.uint8), cv2.IMREAD_COLOR),
+                                     cv2.COLOR_BGR2RGB)
+            page[700:820, 500:620] = np.minimum(page[700:820, 500:620], stamp_rgb)
+        return page
+
+    def test_stamp_is_the_only_proposal(self):
+        [(x, y, w, h)] = propose_stamp_regions(self.page())
+        self.assertTrue(x <= 500 and y <= 700 and x + w >= 620 and y + h >= 820)
+        self.assertLess(w * h, 4 * 120 * 120)
+
+    def test_page_without_ink_proposals_is_searched_whole(self):
+        self.assertEqual(propose_stamp_regions(self.page(stamp=False)), [])
+        with mock.patch.object(utils, 'find_stamp_template', return_value=None) as search:
+            utils.extract_stamp_from_image(self.page(stamp=False), [])
+        search.assert_called_once()
+        self.assertEqual(search.call_args.args[0].shape, (1100, 850))
+
+
+class ParallelPageSearchTests(TransactionTestCase):
+    def fake_pages(self, pdf_path, dpi, first_page, last_page):
+        return [Image.new('RGB', (8, 8), 'white' if first_page != self.stamp_page else 'black')]
+
+    def fake_match(self, image, approved_stamps, page=None):
+        if page == self.failing_page:
+            raise RuntimeError('worker failed')
+        return utils.StampMatch(7, 12, page) if image.convert('L').getpixel((0, 0)) == 0 else None
+
+    failing_page = None
+
+    def search(self, page_count):
+        with mock.patch.object(utils, 'convert_from_path', self.fake_pages), \
+                mock.patch.object(utils, 'match_stamp_on_page', self.fake_match), \
+                mock.patch('system_validator.pages.PdfReader') as reader, \
+                override_settings(VALIDATOR_PAGE_WORKERS=2, MEDIA_ROOT=MEDIA_ROOT):
+            reader.return_value.pages = [None] * page_count
+            try:
+                return utils.find_stamp_in_pdf('letter.pdf', [])
+            finally:
+                utils.shutdown_page_pool()
+
+    def test_stamp_on_a_later_page_is_found(self):
+        self.stamp_page = 3
+        self.assertEqual(self.search(4), utils.StampMatch(7, 12, page=3))
+
+    def test_no_stamp_on_any_page(self):
+        self.stamp_page = None
+        self.assertIsNone(self.search(4))
+
+    def test_failed_page_without_a_match_is_reported(self):
+        self.stamp_page, self.failing_page = None, 2
+        with self.assertRaises(utils.ValidationIncomplete):
+            self.search(4)
+        self.stamp_page = 3
+        self.assertEqual(self.search(4), utils.StampMatch(7, 12, page=3))
+
+
+class PageImageProviderTests(TestCase):
+    def setUp(self):
+        reader = mock.patch('system_validator.pages.PdfReader').start()
+        self.addCleanup(mock.patch.stopall)
+        # Four A4 pages: 8.27 x 11.69 inches.
+        reader.return_value.pages = [mock.Mock(mediabox=mock.Mock(width=595, height=842))] * 4
+        self.convert = mock.patch('system_validator.pages.convert_from_path', side_effect=self.fake_convert).start()
+
+    def fake_convert(self, pdf_path, dpi, first_page, last_page):
+        size = (round(8.27 * dpi), round(11.69 * dpi))
+        return [Image.new('RGB', size, 'white') for _ in range(first_page, last_page + 1)]
+
+    def test_pages_are_rendered_once_for_all_consumers(self):
+        pages = PageImageProvider('letter.pdf', dpi=200, window=2)
+        with override_settings(VALIDATOR_OCR_DPI=200, VALIDATOR_STAMP_DPI=100, VALIDATOR_STAMP_PAGE_MODE='L'):
+            ocr_pages = list(pages.pages('ocr'))
+            stamp_pages = list(pages.pages('stamp'))
+        self.assertEqual(self.convert.call_count, 2)
+        self.assertEqual([page_num for page_num, _ in ocr_pages], [1, 2, 3, 4])
+        self.assertEqual(ocr_pages[0][1].size, (1654, 2338))
+        self.assertEqual(stamp_pages[1][1].size, (827, 1169))
+        self.assertEqual(stamp_pages[1][1].mode, 'L')
+
+    def test_memory_budget_bounds_rendered_pages(self):
+        page_bytes = 1654 * 2338 * 3
+        pages = PageImageProvider('letter.pdf', dpi=200, window=4, memory_budget=2 * page_bytes)
+        for page_num, _ in pages.pages():
+            self.assertLessEqual(pages._cache_bytes, 2 * page_bytes)
+        self.assertEqual(pages.window, 2)
+        self.assertEqual(self.convert.call_count, 2)
+
+    def test_dpi_and_page_limits(self):
+        with override_settings(VALIDATOR_MAX_DPI=300):
+            pages = PageImageProvider('letter.pdf', dpi=600, max_pages=3, memory_budget=10 ** 9)
+        self.assertEqual(pages.dpi, 300)
+        self.assertEqual(len(list(pages.pages())), 3)
+        small = PageImageProvider('letter.pdf', dpi=200, memory_budget=1654 * 2338 * 3 // 4)
+        small.plan()
+        self.assertEqual(small.dpi, 100)
+
+
+class VocabularyMatcherTests(TestCase):
+    def test_exact_and_fuzzy_matches_report_name_and_score(self):
+        matcher = VocabularyMatcher(['Black Lion Hospital', 'St. Paul Hospital', 'Tikur Anbessa'])
+        self.assertEqual(matcher.match('Referred by ST PAUL HOSPITAL, Addis Ababa'), ('St. Paul Hospital', 100.0))
+        name, score = matcher.match('Letterhead: Black Lion Hospitel - Department of Oncology')
+        self.assertEqual(name, 'Black Lion Hospital')
+        self.assertGreater(score, 90)
+        self.assertIsNone(matcher.match('Zewditu Memorial'))
+
+    def test_longest_exact_name_wins(self):
+        matcher = VocabularyMatcher(['cancer', 'breast cancer'])
+        self.assertEqual(matcher.match('diagnosis: breast cancer, stage II'), ('breast cancer', 100.0))
+
+    def test_words_merged_or_split_by_ocr_still_match(self):
+        hospitals = VocabularyMatcher(['Black Lion Hospital', 'St. Paul Hospital'])
+        self.assertEqual(hospitals.match('Referral from BlackLion Hospital')[0], 'Black Lion Hospital')
+        self.assertEqual(hospitals.match('Referral from Black Lion Hos pital, Addis')[0], 'Black Lion Hospital')
+        diseases = VocabularyMatcher(['Breast Cancer', 'Malaria'])
+        self.assertEqual(diseases.match('Diagnosis: breastcancer')[0], 'Breast Cancer')
+        self.assertEqual(diseases.match('Diagnosis: Mal aria, treated')[0], 'Malaria')
+        self.assertIsNone(diseases.match('Diagnosis: cancer of the liver'))
+
+    def test_matchers_are_rebuilt_when_tables_change(self):
+        Hospital.objects.create(name='Black Lion Hospital')
+        DiseaseType.objects.create(name='Leukemia')
+        hospitals, diseases = get_matchers()
+        self.assertIs(get_matchers()[0], hospitals)
+        self.assertIsNone(hospitals.match('Yekatit 12 Hospital'))
+        Hospital.objects.create(name='Yekatit 12 Hospital')
+        hospitals, _ = get_matchers()
+        self.assertEqual(hospitals.match('Yekatit 12 Hospital')[0], 'Yekatit 12 Hospital')
+        self.assertIs(get_matchers()[1], diseases)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ValidationResultCacheTests(TestCase):
+    def setUp(self):
+        Hospital.objects.create(name='Black Lion Hospital')
+        DiseaseType.objects.create(name='Leukemia')
+        self.extract = mock.patch.object(
+            engine, 'extract_text_from_pdf', return_value='Black Lion Hospital. Diagnosis: Leukemia'
+        ).start()
+        mock.patch.object(engine, 'find_stamp_in_pdf', return_value=utils.StampMatch(4, 30, page=1)).start()
+        mock.patch.object(engine, 'PageImageProvider').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def validate(self):
+        return engine.validate_pdf(SimpleUploadedFile('letter.pdf', b'%PDF-1.4 same bytes'))
+
+    def test_resubmitted_document_hits_the_cache(self):
+        first = self.validate()
+        self.assertEqual(first['result'], 'ACCEPTED')
+        self.assertEqual(first['evidence']['hospital'], {'name': 'Black Lion Hospital', 'score': 100.0})
+        self.assertEqual(first['evidence']['stamp'], {'stamp_id': 4, 'matches': 30, 'page': 1})
+        self.assertEqual(self.validate(), first)
+        self.assertEqual(self.extract.call_count, 1)
+
+    def test_reference_data_change_invalidates_entries(self):
+        self.validate()
+        DiseaseType.objects.create(name='Tuberculosis')
+        self.validate()
+        self.assertEqual(self.extract.call_count, 2)
+        self.assertEqual(ValidationResult.objects.count(), 1)
+
+    def test_rejected_document_is_decided_from_stored_evidence(self):
+        self.extract.return_value = 'Black Lion Hospital. Diagnosis: Malaria'
+        engine.find_stamp_in_pdf.return_value = None
+        self.assertIn('disease type', self.validate()['reason'])
+        stored = DocumentEvidence.objects.get()
+        self.assertIsNone(stored.disease)
+
+        DiseaseType.objects.create(name='Malaria')
+        verdict = self.validate()
+        self.assertEqual(self.extract.call_count, 1)
+        self.assertEqual(verdict['reason'], 'This doctor is not an authorized approver')
+        stored.refresh_from_db()
+        self.assertEqual(stored.disease, {'name': 'Malaria', 'score': 100.0})
+
+    def test_failed_stage_is_not_cached(self):
+        self.extract.side_effect = utils.ValidationIncomplete('Text extraction failed: tesseract not found')
+        verdict = self.validate()
+        self.assertEqual(verdict['result'], 'REJECTED')
+        self.assertIn('tesseract not found', verdict['error'])
+        self.assertFalse(ValidationResult.objects.exists())
+        self.assertFalse(DocumentEvidence.objects.exists())
+
+        self.extract.side_effect = None
+        self.assertEqual(self.validate()['result'], 'ACCEPTED')
+        self.assertEqual(self.extract.call_count, 2)
+
+    def test_verdict_from_older_reference_data_does_not_replace_newer_entries(self):
+        old_version = result_cache.reference_version()
+        DiseaseType.objects.create(name='Tuberculosis')
+        first = self.validate()
+        result_cache.store(first['sha256'], old_version, first)
+        self.assertEqual(list(ValidationResult.objects.values_list('reference_version', flat=True)),
+                         [result_cache.reference_version()])
+
+        ValidationResult.objects.create(sha256=first['sha256'], reference_version='0.0.0', result='REJECTED')
+        Hospital.objects.create(name='St. Paul Hospital')
+        self.validate()
+        self.assertEqual(list(ValidationResult.objects.values_list('reference_version', flat=True)),
+                         [result_cache.reference_version()])
+
+
+class AdmissionControlTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.settings = override_settings(
+            VALIDATOR_ADMISSION_DIR=directory, VALIDATOR_CONCURRENCY=1, VALIDATOR_QUEUE_SIZE=1,
+            VALIDATOR_QUEUE_TIMEOUT=5,
+        )
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def test_queued_validation_runs_when_a_slot_frees(self):
+        waited = []
+
+        def validate():
+            with admission.admit() as seconds:
+                waited.append(seconds)
+
+        with admission.admit():
+            waiter = threading.Thread(target=validate)
+            waiter.start()
+            time.sleep(0.2)
+            with self.assertRaises(AdmissionRejected):
+                with admission.admit():
+                    pass
+        waiter.join()
+        self.assertGreaterEqual(waited[0], 0.2)
+
+    def test_wait_times_out(self):
+        with override_settings(VALIDATOR_QUEUE_TIMEOUT=0.1), admission.admit():
+            with self.assertRaises(AdmissionRejected) as rejected:
+                with admission.admit():
+                    pass
+        self.assertGreaterEqual(rejected.exception.retry_after, 1)
+        with admission.admit() as seconds:
+            self.assertLess(seconds, 0.1)
+
+    def test_view_answers_429_with_retry_after_when_the_queue_is_full(self):
+        upload = SimpleUploadedFile('letter.pdf', b'%PDF-1.4 busy', content_type='application/pdf')
+        with override_settings(VALIDATOR_QUEUE_SIZE=0), admission.admit():
+            response = self.client.post('/system_validator/', {'pdf_file': upload})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class EvidenceRecheckTests(TestCase):
+    def setUp(self):
+        self.delay = mock.patch('system_validator.tasks.recheck_evidence_task.delay').start()
+        self.addCleanup(mock.patch.stopall)
+        self.verdicts = {}
+        signals.evidence_rechecked.connect(
+            lambda sender, verdicts, **kwargs: self.verdicts.update(verdicts), weak=False, dispatch_uid='recheck-test')
+        self.addCleanup(signals.evidence_rechecked.disconnect, dispatch_uid='recheck-test')
+
+    def store(self, sha256, text, candidates=(), **checks):
+        evidence.store(sha256, text, {'hospital': None, 'disease': None, 'stamp': None, **checks}, list(candidates))
+
+    def test_added_hospital_only_rechecks_stored_text(self):
+        disease, stamp = {'name': 'Leukemia', 'score': 100.0}, {'stamp_id': 4, 'matches': 30, 'page': 1}
+        self.store('a', 'zewditu hospital. diagnosis: leukemia', disease=disease, stamp=stamp)
+        self.store('b', 'st. paul hospital. diagnosis: leukemia', disease=disease)
+        with self.captureOnCommitCallbacks(execute=True):
+            hospital = Hospital.objects.create(name='Zewditu Hospital')
+        self.delay.assert_called_once_with(ReferenceVersion.HOSPITAL, hospital.pk)
+
+        self.assertEqual(engine.validation_engine.recheck(ReferenceVersion.HOSPITAL, hospital.pk), 1)
+        self.assertEqual(list(self.verdicts), ['a'])
+        self.assertEqual(self.verdicts['a']['result'], 'ACCEPTED')
+        self.assertIsNone(DocumentEvidence.objects.get(sha256='b').hospital)
+
+    def test_added_stamp_is_verified_against_stored_candidates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            stamp = DoctorStamp.objects.create(
+                image=SimpleUploadedFile('stamp21.png', make_stamp_png(21), content_type='image/png')
+            )
+        self.delay.assert_called_once_with(ReferenceVersion.STAMP, stamp.pk)
+        scanned = benchmark.rotate(cv2.imread(stamp.image.path, cv2.IMREAD_GRAYSCALE), 2)
+        keypoints, descriptors = utils.stamp_features(cv2.resize(scanned, None, fx=1.2, fy=1.2))
+        self.store('a', '', candidates=[(3, descriptors, keypoints)])
+        self.store('b', '')
+        self.assertEqual(len(evidence.candidates_from_bytes(DocumentEvidence.objects.get(sha256='a').stamp_candidates)), 1)
+
+        self.assertEqual(engine.validation_engine.recheck(ReferenceVersion.STAMP, stamp.pk), 1)
+        stored = DocumentEvidence.objects.get(sha256='a')
+        self.assertEqual((stored.stamp['stamp_id'], stored.stamp['page']), (stamp.pk, 3))
+        self.assertIn('not among the officially authorized hospitals', self.verdicts['a']['reason'])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ValidationEngineTests(TestCase):
+    def setUp(self):
+        def extract(pdf_path, pages):
+            self.pdf_path = pdf_path
+            with stage('ocr'):
+                time.sleep(0.02)
+            return 'Black Lion Hospital'
+
+        mock.patch.object(engine, 'extract_text_from_pdf', side_effect=extract).start()
+        mock.patch.object(engine, 'find_stamp_in_pdf', return_value=None).start()
+        mock.patch.object(engine, 'PageImageProvider').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_debug_payload_times_each_stage(self):
+        received = []
+        stages_recorded.connect(lambda sender, stages, **kwargs: received.append(stages), weak=False,
+                                dispatch_uid='engine-test')
+        self.addCleanup(stages_recorded.disconnect, dispatch_uid='engine-test')
+
+        verdict = engine.validate_pdf(SimpleUploadedFile('letter.pdf', b'%PDF-1.4 timed'), debug=True)
+        timings = verdict['timings']
+        self.assertEqual(set(timings), {'ingest', 'text_extraction', 'ocr', 'vocabulary_match', 'stamp_match'})
+        self.assertGreaterEqual(timings['ocr']['wall_ms'], 20)
+        self.assertLess(timings['text_extraction']['wall_ms'], timings['ocr']['wall_ms'])
+        self.assertEqual(len(received), 1)
+        self.assertFalse(os.path.exists(self.pdf_path))
+
+    def test_stage_memory_is_the_peak_during_the_stage_not_the_process_peak(self):
+        if current_rss() is None:
+            self.skipTest('Current RSS is not available on this platform')
+        with profiled() as profile:
+            with stage('allocate'):
+                block = np.ones(64 * 1024 * 1024, dtype=np.uint8)
+            del block
+            with stage('allocate_and_free'):
+                block = np.ones(64 * 1024 * 1024, dtype=np.uint8)
+                time.sleep(0.05)
+                del block
+            with stage('idle'):
+                pass
+        self.assertGreater(profile.stages['allocate']['peak_rss_growth'], 32 * 1024 * 1024)
+        self.assertGreater(profile.stages['allocate_and_free']['peak_rss_growth'], 32 * 1024 * 1024)
+        self.assertLess(profile.stages['idle']['peak_rss_growth'], 8 * 1024 * 1024)
+
+    def test_view_uses_the_engine_and_hides_timings_from_anonymous_users(self):
+        upload = SimpleUploadedFile('letter.pdf', b'%PDF-1.4 view', content_type='application/pdf')
+        response = self.client.post('/system_validator/?debug=1', {'pdf_file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('REJECTED', response.data['result'])
+        self.assertIn('authorized approver', response.data['reason'])
+        self.assertNotIn('timings', response.data)
+        self.assertFalse(os.path.exists('temp.pdf'))
+
+    @override_settings(METRICS_CELERY_QUEUES=[])
+    def test_metrics_endpoint_exposes_api_and_stage_series_to_local_scrapers(self):
+        upload = SimpleUploadedFile('letter.pdf', b'%PDF-1.4 metrics', content_type='application/pdf')
+        self.client.post('/system_validator/', {'pdf_file': upload})
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('api_request_duration_seconds_count{method="POST",status="200",view="validate_pdf"}', body)
+        self.assertIn('validation_stage_duration_seconds_count{stage="ingest"}', body)
+        self.assertIn('celery_queue_depth', body)
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='203.0.113.9').status_code, 403)
+
+    @override_settings(METRICS_CELERY_QUEUES=[], METRICS_TOKEN='scrape-secret', METRICS_ALLOWED_IPS=['10.0.0.2'])
+    def test_metrics_token_is_required_behind_a_proxy(self):
+        proxy = {'REMOTE_ADDR': '10.0.0.2', 'HTTP_X_FORWARDED_FOR': '198.51.100.7'}
+        self.assertEqual(self.client.get('/metrics/', **proxy).status_code, 403)
+        self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong', **proxy).status_code, 403)
+        self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer scrape-secret', **proxy).status_code, 200)
+
+
+class OcrEngineTests(TestCase):
+    def test_cli_engine_recognizes_a_batch_in_one_tesseract_run(self):
+        def fake_tesseract(list_path, lang, config):
+            with open(list_path) as f:
+                self.listed = f.read().split()
+            return 'first page\fsecond page\f'
+
+        with mock.patch('pytesseract.image_to_string', side_effect=fake_tesseract) as tesseract, \
+                override_settings(VALIDATOR_OCR_LANG='amh+eng', VALIDATOR_OCR_PSM=6):
+            texts = TesseractCliEngine('/usr/bin/tesseract').recognize([Image.new('L', (10, 10))] * 2)
+        self.assertEqual(texts, ['first page', 'second page'])
+        self.assertEqual(len(self.listed), 2)
+        tesseract.assert_called_once()
+        self.assertEqual(tesseract.call_args.kwargs, {'lang': 'amh+eng', 'config': '--psm 6'})
+
+    @override_settings(VALIDATOR_OCR_ENGINE='cli')
+    def test_pages_are_submitted_in_batches(self):
+        with mock.patch.object(TesseractCliEngine, 'recognize', side_effect=lambda images: ['text'] * len(images)) as recognize:
+            pages = [(page_num, Image.new('L', (10, 10))) for page_num in range(1, 6)]
+            self.assertEqual([page_num for page_num, _ in ocr_pages(iter(pages), batch_size=2)], [1, 2, 3, 4, 5])
+        self.assertEqual([len(call.args[0]) for call in recognize.call_args_list], [2, 2, 1])
+
+    def test_missing_tesserocr_is_reported_by_system_checks(self):
+        from .checks import check_ocr_engine
+        with mock.patch('importlib.util.find_spec', return_value=None):
+            with override_settings(VALIDATOR_OCR_ENGINE='auto'):
+                self.assertEqual([message.id for message in check_ocr_engine(None)], ['system_validator.W001'])
+            with override_settings(VALIDATOR_OCR_ENGINE='tesserocr'):
+                self.assertEqual([message.id for message in check_ocr_engine(None)], ['system_validator.E001'])
+            with override_settings(VALIDATOR_OCR_ENGINE='cli'):
+                self.assertEqual(check_ocr_engine(None), [])
+
+    def letter(self):
+        page = np.full((1100, 850), 255, dtype=np.uint8)
+        cv2.putText(page, 'ADDIS GENERAL HOSPITAL', (200, 80), cv2.FONT_HERSHEY_SIMPLEX, 1.2, 0, 3)
+        for row in range(400, 700, 120):
+            cv2.putText(page, 'Diagnosis and treatment notes', (60, row), cv2.FONT_HERSHEY_SIMPLEX, 1, 0, 2)
+        cv2.putText(page, 'Dr. Signature', (500, 1000), cv2.FONT_HERSHEY_SIMPLEX, 1, 0, 2)
+        return page
+
+    def test_text_blocks_start_with_letterhead_then_signature(self):
+        blocks = find_text_blocks(self.letter())
+        self.assertEqual(len(blocks), 5)
+        self.assertLess(blocks[0][1], 100)
+        self.assertGreater(blocks[1][1], 900)
+        self.assertEqual([y for _, y, _, _ in blocks[2:]], sorted(y for _, y, _, _ in blocks[2:]))
+
+    def provider(self, text_layers):
+        """A PageImageProvider stand-in whose pages have the given text layers."""
+        page = Image.fromarray(self.letter())
+        return mock.Mock(
+            page_count=len(text_layers),
+            reader=mock.Mock(pages=[mock.Mock(extract_text=mock.Mock(return_value=text)) for text in text_layers]),
+            pages=lambda consumer, page_nums: ((page_num, page) for page_num in page_nums),
+        )
+
+    def reference_names(self):
+        Hospital.objects.create(name='Addis General Hospital')
+        DiseaseType.objects.create(name='Malaria')
+        # The version bumps roll back with the test, so drop matchers compiled from these rows.
+        self.addCleanup(vocabulary._matchers.clear)
+
+    @override_settings(VALIDATOR_OCR_ENGINE='cli', VALIDATOR_OCR_BATCH=1)
+    def test_block_ocr_stops_once_hospital_and_disease_are_found(self):
+        self.reference_names()
+        texts = iter(['ADDIS GENERAL HOSPITAL', 'Dr. Abebe', 'Diagnosis: Malaria', 'notes', 'notes'])
+        with mock.patch.object(TesseractCliEngine, 'recognize',
+                               side_effect=lambda images, psm=None: [next(texts) for _ in images]) as recognize:
+            text = utils.extract_text_from_pdf('letter.pdf', pages=self.provider(['', '']))
+        self.assertIn('Malaria', text)
+        self.assertEqual(recognize.call_count, 3)
+        self.assertEqual(recognize.call_args.kwargs, {'psm': 6})
+
+    @override_settings(VALIDATOR_OCR_ENGINE='cli')
+    def test_ocr_failure_is_raised_instead_of_returning_partial_text(self):
+        self.reference_names()
+        with mock.patch.object(TesseractCliEngine, 'recognize', side_effect=OSError('tesseract is not installed')):
+            with self.assertRaises(utils.ValidationIncomplete):
+                utils.extract_text_from_pdf('letter.pdf', pages=self.provider(['Addis General Hospital', '']))
+
+    @override_settings(VALIDATOR_OCR_ENGINE='cli', VALIDATOR_OCR_BATCH=8)
+    def test_text_layer_is_read_page_by_page_and_only_pages_without_one_are_ocred(self):
+        self.reference_names()
+        pages = self.provider(['Addis General Hospital', 'Diagnosis: Malaria', 'Follow-up'])
+        with mock.patch.object(TesseractCliEngine, 'recognize') as recognize:
+            text = utils.extract_text_from_pdf('letter.pdf', pages=pages)
+        self.assertEqual(text, 'Addis General Hospital\nDiagnosis: Malaria')
+        pages.reader.pages[2].extract_text.assert_not_called()
+        recognize.assert_not_called()
+
+        pages = self.provider(['Addis General Hospital', '', 'Follow-up'])
+        with mock.patch.object(TesseractCliEngine, 'recognize', return_value=['Diagnosis: Malaria']) as recognize:
+            text = utils.extract_text_from_pdf('letter.pdf', pages=pages)
+        self.assertEqual(text, 'Addis General Hospital\nDiagnosis: Malaria\nFollow-up')
+        recognize.assert_called_once()
+
+    def test_each_page_is_matched_once_with_the_end_of_the_one_before(self):
+        self.reference_names()
+        filler = 'Continued follow-up at our outpatient clinic is recommended. ' * 20
+        pages = self.provider([filler] * 30 + [f'{filler} Letter from Addis General', 'Hospital. Diagnosis: Malaria'])
+        match = VocabularyMatcher.match
+        windows = []
+        with mock.patch.object(VocabularyMatcher, 'match', autospec=True,
+                               side_effect=lambda matcher, text: windows.append(text) or match(matcher, text)):
+            text = utils.extract_text_from_pdf('letter.pdf', pages=pages)
+        self.assertTrue(text.endswith('Diagnosis: Malaria'))
+        self.assertLessEqual(max(len(window) for window in windows), len(filler) + 30 + utils.NAME_OVERLAP)
+        # Neither name is found before the last page, where the hospital spans the page break.
+        self.assertEqual(len(windows), 2 * 32)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class BenchmarkCorpusTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def test_text_and_scanned_letters(self):
+        rng = np.random.default_rng(1)
+        stamps = {7: benchmark.make_stamp(rng)}
+        corpus = []
+        for share in (0, 1):
+            corpus += benchmark.generate_corpus(self.directory, 1, stamps, ['Gondar General Hospital'],
+                                                ['Breast Cancer'], rng, page_counts=[2], scanned_share=share, dpi=50)
+        self.assertEqual([spec['variant'] for spec in corpus], ['text', 'scanned'])
+
+        text_layer = [PdfReader(spec['path']) for spec in corpus]
+        self.assertEqual([len(reader.pages) for reader in text_layer], [2, 2])
+        first_page = text_layer[0].pages[0].extract_text()
+        self.assertIn(corpus[0]['hospital'].upper(), first_page)
+        self.assertIn('Diagnosis: Breast Cancer', first_page)
+        self.assertEqual(text_layer[1].pages[0].extract_text().strip(), '')
+
+        with open(corpus[0]['path'], 'rb') as f:
+            evidence.store(hashlib.sha256(f.read()).hexdigest(), 'from an earlier run',
+                           {'hospital': None, 'disease': None, 'stamp': None}, [])
+        results = benchmark.run_corpus(corpus, lambda f, debug: {
+            'result': 'ACCEPTED', 'timings': {'ingest': {'wall_ms': 2.0}}})
+        self.assertFalse(DocumentEvidence.objects.exists())
+        summary = benchmark.summarize(results)
+        self.assertEqual(summary['documents'], 2)
+        self.assertEqual(summary['errors'], 0)
+        self.assertEqual(summary['accuracy'], sum(spec['expected'] == 'ACCEPTED' for spec in corpus) / 2)
+        self.assertEqual(summary['stages_ms']['ingest']['total'], 4.0)
+        self.assertEqual(set(summary['by_variant']), {'text', 'scanned'})
+
+        def fail_scanned(f, debug):
+            if 'scanned' in f.name:
+                return {'result': 'REJECTED', 'reason': 'Validation error: no poppler', 'error': 'no poppler',
+                        'timings': {'ingest': {'wall_ms': 0.1}}}
+            return {'result': corpus[0]['expected'], 'timings': {'ingest': {'wall_ms': 2.0}}}
+
+        results = benchmark.run_corpus(corpus, fail_scanned)
+        self.assertEqual([result['error'] for result in results], [None, 'no poppler'])
+        summary = benchmark.summarize(results)
+        self.assertEqual((summary['documents'], summary['errors'], summary['accuracy']), (2, 1, 1.0))
+        self.assertEqual(summary['latency_seconds']['p50'], round(results[0]['latency'], 4))
+        self.assertEqual(summary['stages_ms']['ingest']['total'], 2.0)
+        self.assertEqual(summary['by_variant']['scanned'], {
+            'documents': 0, 'errors': 1, 'latency_seconds': benchmark.percentiles([]), 'accuracy': None})
+
+
+    def test_isolated_runs_keep_reference_changes_away_from_the_configured_database(self):
+        from django.conf import settings
+        media_root = settings.MEDIA_ROOT
+        with mock.patch.object(benchmark, 'setup_databases', return_value='old config') as setup, \
+                mock.patch.object(benchmark, 'teardown_databases') as teardown, \
+                mock.patch.object(signals, 'queue_recheck') as queue_recheck:
+            with self.captureOnCommitCallbacks(execute=True), benchmark.isolated():
+                self.assertNotEqual(settings.MEDIA_ROOT, media_root)
+                self.assertTrue(settings.STAMP_DESCRIPTOR_DIR.startswith(settings.MEDIA_ROOT))
+                Hospital.objects.create(name='Adama General Hospital')
+            setup.assert_called_once()
+            teardown.assert_called_once_with('old config', 0)
+            queue_recheck.assert_not_called()
+            self.assertEqual(settings.MEDIA_ROOT, media_root)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                Hospital.objects.create(name='Jimma University Hospital')
+            queue_recheck.assert_called_once()
+
+
+class ImportCostTests(TestCase):
+    def test_web_workers_do_not_load_the_vision_stack(self):
+        out = io.StringIO()
+        call_command('import_report', '--json', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['heavy_modules_ms'], {})
+        self.assertTrue(report['slowest'])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class WarmUpTests(TestCase):
+    def setUp(self):
+        template_cache.clear()
+        vocabulary._matchers.clear()
+        self.addCleanup(vocabulary._matchers.clear)
+        mock.patch.object(signals, 'queue_recheck').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_reference_state_is_built_before_the_first_validation(self):
+        Hospital.objects.create(name='Black Lion Hospital')
+        with self.captureOnCommitCallbacks(execute=True):
+            stamp = DoctorStamp.objects.create(
+                image=SimpleUploadedFile('stamp31.png', make_stamp_png(31), content_type='image/png')
+            )
+        template_cache.clear()
+
+        self.assertEqual(warmup.warm_up(), {'hospitals': 1, 'diseases': 0, 'stamps': 1})
+        hits = template_cache.hits
+        self.assertEqual(len(template_cache.get(stamp)._coarse), 1)
+        self.assertEqual(template_cache.hits, hits + 1)
+
+    def test_reference_change_leaves_the_rebuild_to_the_next_validation(self):
+        get_matchers()
+        with mock.patch.object(warmup, 'warm_up') as warm_up:
+            with self.captureOnCommitCallbacks(execute=True):
+                DiseaseType.objects.create(name='Leukemia')
+        warm_up.assert_not_called()
+        self.assertEqual(get_matchers()[1].names, ['Leukemia'])
+
+    def test_server_reload_rebuilds_and_refreezes_the_master_state(self):
+        with mock.patch.object(warmup, 'warm_up') as warm_up, mock.patch.object(warmup.gc, 'unfreeze') as unfreeze:
+            warmup.warm_up_on_reload()
+        unfreeze.assert_called_once_with()
+        warm_up.assert_called_once_with(before_fork=True)
+
+    def test_failed_warm_up_on_ready_leaves_state_to_first_use(self):
+        with mock.patch.object(warmup, 'warm_up', side_effect=RuntimeError('no such table')) as warm_up:
+            warmup.warm_up_on_ready()
+        warm_up.assert_called_once_with(before_fork=True)
@@ -1,6 +1,7 @@
-from .views import PDFValidationView
+from .views import PDFValidationView, metrics_view
 from django.urls import path
 
 urlpatterns = [
     path('system_validator/', PDFValidationView.as_view(), name='validate_pdf'),
+    path('metrics/', metrics_view, name='metrics'),
 ]
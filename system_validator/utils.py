@@ -1,271 +1,484 @@
 import cv2
 import numpy as np
 from pdf2image import convert_from_path
-from PyPDF2 import PdfReader
 import os
 import logging
+import multiprocessing
+import queue
+import random
+import threading
 import unicodedata
-import pytesseract
+import uuid
+from collections import namedtuple
 import platform
-from django.core.files.storage import default_storage
-from fuzzywuzzy import fuzz
-from .models import Hospital, DiseaseType, DoctorStamp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from django.db import connections
+from .models import DoctorStamp
+from .stamp_cache import preprocess_gray
+from .template_search import find_stamp_template
+from .regions import propose_stamp_regions
+from .descriptors import compute_orb_features, descriptor_store
+from .stamp_index import stamp_index
+from .pages import PageImageProvider, consumer_options
+from .vocabulary import get_matchers
+from .ocr import ocr_pages, ocr_text_blocks
+from .profiling import profiled, stage, current_profile
+from .evidence import recording, current_candidates, record_stamp_candidate
 
 logger = logging.getLogger(__name__)
 
+# Evidence of a verified stamp: the DoctorStamp id, cross-checked ORB matches and 1-based page.
+StampMatch = namedtuple('StampMatch', ['stamp_id', 'matches', 'page'], defaults=[None])
 
+# Share of confirmed stamp inliers that must lie in the inner half of the stamp.
+MIN_INTERIOR_SHARE = 0.25
+
+# Characters of the previous part matched again with the next, longer than any hospital or disease name.
+NAME_OVERLAP = 200
+
+
+class ValidationIncomplete(Exception):
+    """A stage failed before it examined the whole document, so a rejection would not be reliable."""
 
-# Explicitly set the path to Tesseract executable
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
- 
 
 def normalize(text):
     """Normalize text for comparison."""
     return unicodedata.normalize("NFKD", text.lower().strip())
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from all pages of the PDF using PyPDF2, with OCR fallback."""
-    text = ''
+class NameSearch:
+    """Whether the text read so far names both a hospital and a disease, one part at a time.
+
+    Each part is matched together with the last NAME_OVERLAP characters of the
+    part before it, so a name broken across a page or block boundary is still
+    found, and a matcher that has found its name is not run again. Matching
+    stays linear in the length of the document.
+    """
+
+    def __init__(self, hospitals, diseases):
+        self.pending = [hospitals, diseases]
+        self.tail = ''
+
+    def add(self, text):
+        """Match one more part of the text; returns True once both names were found."""
+        with stage('vocabulary_match'):
+            window = normalize(f'{self.tail}\n{text}')
+            self.pending = [matcher for matcher in self.pending if matcher.match(window) is None]
+            self.tail = text[-NAME_OVERLAP:]
+            return not self.pending
+
+def extract_text_from_pdf(pdf_path, pages=None):
+    """Extract document text page by page, stopping once a hospital and a disease are found.
+
+    Pages are read from their PyPDF2 text layer first. Only pages without one
+    are OCRed afterwards. ``pages`` is an optional PageImageProvider to reuse
+    the parsed PDF and page renders with later stages. Raises
+    ValidationIncomplete when the PDF cannot be read or OCR fails.
+    """
+    parts = []
     try:
+        names = NameSearch(*get_matchers())
+        pages = pages or PageImageProvider(pdf_path)
         logger.debug(f"Attempting text extraction from {pdf_path} using PyPDF2")
-        with open(pdf_path, 'rb') as file:
-            reader = PdfReader(file)
-            for page_num, page in enumerate(reader.pages, 1):
-                extracted = page.extract_text() or ''
-                logger.debug(f"Extracted text from page {page_num} (PyPDF2): {extracted}")
-                text += extracted
-        # Trigger OCR if no text or no hospital found
-        approved_hospitals = [normalize(name) for name in Hospital.objects.values_list('name', flat=True)]
-        if not text.strip() or not any(hospital in normalize(text) for hospital in approved_hospitals):
-            logger.debug("Falling back to OCR for text extraction")
-            images = convert_from_path(pdf_path)
-            for page_num, image in enumerate(images, 1):
-                ocr_text = pytesseract.image_to_string(image)
-                logger.debug(f"Extracted text from page {page_num} (OCR): {ocr_text}")
-                text += ocr_text
+        without_text = []
+        for page_num in range(1, pages.page_count + 1):
+            extracted = pages.reader.pages[page_num - 1].extract_text() or ''
+            logger.debug(f"Extracted text from page {page_num} (PyPDF2): {extracted}")
+            if not extracted.strip():
+                without_text.append(page_num)
+                continue
+            parts.append((page_num, extracted))
+            if names.add(extracted):
+                logger.debug(f"Hospital and disease found on page {page_num}, stopping text extraction")
+                return '\n'.join(text for _, text in parts)
+
+        if without_text:
+            logger.debug(f"Falling back to OCR for pages without a text layer: {without_text}")
+            if getattr(settings, 'VALIDATOR_OCR_LAYOUT', True):
+                ocr_results = ocr_text_blocks(pages.pages('ocr', page_nums=without_text))
+            else:
+                ocr_results = ocr_pages(pages.pages('ocr', page_nums=without_text))
+            with stage('ocr'):
+                for page_num, ocr_text in ocr_results:
+                    logger.debug(f"Extracted text from page {page_num} (OCR): {ocr_text}")
+                    parts.append((page_num, ocr_text))
+                    if names.add(ocr_text):
+                        logger.debug("Hospital and disease found, stopping OCR")
+                        break
     except Exception as e:
         logger.error(f"Text extraction error: {str(e)}")
+        raise ValidationIncomplete(f'Text extraction failed: {str(e)}') from e
+    text = '\n'.join(text for _, text in sorted(parts, key=lambda part: part[0]))
     logger.debug(f"Final extracted text: {text}")
     return text
 
 def pdf_to_images(pdf_path):
     """Convert PDF pages to images using pdf2image."""
     try:
-        images = convert_from_path(pdf_path)
+        images = [image for _, image in PageImageProvider(pdf_path).pages()]
         logger.debug(f"Converted {pdf_path} to {len(images)} images")
         return images
     except Exception as e:
         logger.error(f"PDF to images conversion error: {str(e)}")
         return []
 
-def extract_stamp_from_image(image, approved_stamps):
-    """Search for a stamp in the entire image and extract it."""
+def dump_debug_image(kind, image):
+    """Write ``image`` to VALIDATOR_DEBUG_DIR under a unique name, if debug dumps are on."""
+    directory = getattr(settings, 'VALIDATOR_DEBUG_DIR', None)
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{kind}_{uuid.uuid4().hex}.png')
+    cv2.imwrite(path, image)
+    logger.debug(f"Saved debug {kind} image: {path}")
+    return path
+
+def debug_sampled():
+    """Whether this page's images are dumped; VALIDATOR_DEBUG_SAMPLE_RATE is the fraction of pages kept."""
+    if not getattr(settings, 'VALIDATOR_DEBUG_DIR', None):
+        return False
+    return random.random() < getattr(settings, 'VALIDATOR_DEBUG_SAMPLE_RATE', 0.05)
+
+def search_regions(image_np, gray):
+    """Return the groups of (x, y, w, h) areas of the page to search for a stamp, in order.
+
+    Colour pages try their ink region proposals first. The whole page is always
+    the last group, so black, faded or colour-cast stamps that propose no region,
+    or the wrong one, are still found. Grayscale pages, or
+    VALIDATOR_STAMP_REGIONS = False, search only the whole page.
+    """
+    whole_page = [(0, 0, gray.shape[1], gray.shape[0])]
+    if image_np.ndim == 2 or not getattr(settings, 'VALIDATOR_STAMP_REGIONS', True):
+        return [whole_page]
+    proposals = propose_stamp_regions(image_np)
+    return [proposals, whole_page] if proposals else [whole_page]
+
+def extract_stamp_from_image(image, approved_stamps, debug=False):
+    """Search for a stamp in the image and return it as a grayscale array, or None."""
     try:
         image_np = np.array(image)
-        image_cv = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
-        gray = cv2.cvtColor(image_cv, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (5, 5), 0)
-        gray = cv2.equalizeHist(gray)
-
-        debug_page_path = f'debug_page_{os.getpid()}.png'
-        cv2.imwrite(debug_page_path, gray)
-        logger.debug(f"Saved debug page image: {debug_page_path}")
-
-        stamp_path = None
-        max_val = 0
-        best_match = None
-
-        for stamp in approved_stamps:
-            if not hasattr(stamp, 'image') or not stamp.image:
-                logger.warning(f"Invalid stamp object in database: {stamp}")
-                continue
-
-            template_path = stamp.image.path
-            if not os.path.exists(template_path):
-                logger.error(f"Template image not found: {template_path}")
-                continue
-
-            template = cv2.imread(template_path, cv2.IMREAD_GRAYSCALE)
-            if template is None:
-                logger.error(f"Failed to load template image: {template_path}")
-                continue
-
-            template = cv2.GaussianBlur(template, (5, 5), 0)
-            template = cv2.equalizeHist(template)
-
-            scales = [0.5, 0.75, 1.0, 1.25, 1.5]
-            for scale in scales:
-                scaled_template = cv2.resize(template, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
-                if scaled_template.shape[0] > gray.shape[0] or scaled_template.shape[1] > gray.shape[1]:
-                    continue
-
-                result = cv2.matchTemplate(gray, scaled_template, cv2.TM_CCOEFF_NORMED)
-                min_val, curr_max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-
-                if curr_max_val > max_val and curr_max_val > 0.4:
-                    max_val = curr_max_val
-                    best_match = (max_loc, scaled_template.shape, template_path, scale)
-
-        if best_match:
-            (x, y), (h, w), template_path, scale = best_match
-            stamp_region = image_cv[y:y+h, x:x+w]
-            stamp_path = f'temp_stamp_{os.getpid()}.jpg'
-            cv2.imwrite(stamp_path, stamp_region)
-            logger.debug(f"Extracted stamp via template matching: {stamp_path}, confidence: {max_val}, scale: {scale}")
-            return stamp_path
+        if image_np.ndim == 2:
+            page_gray = image_np
+        else:
+            page_gray = cv2.cvtColor(image_np, cv2.COLOR_RGB2GRAY)
+        gray = preprocess_gray(page_gray)
+
+        if debug:
+            dump_debug_image('page', gray)
+
+        with stage('stamp_proposal'):
+            region_groups = search_regions(image_np, gray)
+
+        for regions in region_groups:
+            best_match = None
+            for rx, ry, rw, rh in regions:
+                hit = find_stamp_template(gray[ry:ry+rh, rx:rx+rw], approved_stamps)
+                if hit and (best_match is None or hit.score > best_match.score):
+                    best_match = hit._replace(loc=(rx + hit.loc[0], ry + hit.loc[1]))
+            if best_match:
+                x, y = best_match.loc
+                h, w = best_match.shape
+                stamp_region = np.ascontiguousarray(page_gray[y:y+h, x:x+w])
+                logger.debug(f"Extracted stamp via template matching at {(x, y)}, confidence: {best_match.score}, scale: {best_match.scale}")
+                return stamp_region
 
         logger.debug("No stamp found via template matching, trying contour detection")
-        edges = cv2.Canny(gray, 30, 100)  # Fixed: Use gray, adjusted thresholds
-        logger.debug(f"Detected edges with shape: {edges.shape}")
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        for contour in sorted(contours, key=cv2.contourArea, reverse=True):
-            area = cv2.contourArea(contour)
-            if 1000 < area < 100000:
-                x, y, w, h = cv2.boundingRect(contour)
-                stamp_region = image_cv[y:y+h, x:x+w]
-                stamp_path = f'temp_stamp_{os.getpid()}.jpg'
-                cv2.imwrite(stamp_path, stamp_region)
-                logger.debug(f"Extracted stamp via contour detection: {stamp_path}, area: {area}")
-                return stamp_path
+        for rx, ry, rw, rh in (region for regions in region_groups for region in regions):
+            edges = cv2.Canny(gray[ry:ry+rh, rx:rx+rw], 30, 100)  # Fixed: Use gray, adjusted thresholds
+            logger.debug(f"Detected edges with shape: {edges.shape}")
+            contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+            for contour in sorted(contours, key=cv2.contourArea, reverse=True):
+                area = cv2.contourArea(contour)
+                if 1000 < area < 100000:
+                    x, y, w, h = cv2.boundingRect(contour)
+                    x, y = rx + x, ry + y
+                    stamp_region = np.ascontiguousarray(page_gray[y:y+h, x:x+w])
+                    logger.debug(f"Extracted stamp via contour detection at {(x, y)}, area: {area}")
+                    return stamp_region
 
         logger.debug("No stamp found in image")
         return None
 
     except Exception as e:
         logger.error(f"Stamp extraction error: {str(e)}")
-        return None
+        raise
 
-def validate_pdf(pdf_file):
-    """Validate a Medical campaign PDF for hospital, disease, and stamp."""
+def match_stamp_on_page(image, approved_stamps, page=None):
+    """Extract a stamp candidate from one page image and return its StampMatch, or None.
+
+    The candidate's ORB features are recorded as evidence for later re-checks.
+    """
+    debug = debug_sampled()
+    stamp_region = extract_stamp_from_image(image, approved_stamps, debug=debug)
+    if stamp_region is None:
+        logger.debug("No stamp found in image")
+        return None
+    if debug:
+        dump_debug_image('stamp', stamp_region)
+    logger.debug(f"Attempting to match stamp candidate of shape {stamp_region.shape}")
+    keypoints, descriptors = stamp_features(stamp_region)
+    if descriptors is None:
+        return None
+    record_stamp_candidate(page, descriptors, keypoints)
+    matched = match_descriptors(descriptors, {stamp.pk for stamp in approved_stamps})
+    if matched:
+        logger.debug(f"Stamp matched: {matched}")
+        return matched._replace(page=page)
+    return None
+
+# Per-page stamp search pool. Workers are forked once and reused; each document
+# borrows a slot in ``_cancel_flags`` that running pages poll between stages.
+_page_pool = None
+_cancel_flags = None
+_free_slots = None
+_pool_lock = threading.Lock()
+CANCEL_SLOTS = 64
+
+def _init_page_worker(flags):
+    global _cancel_flags
+    _cancel_flags = flags
+
+def _get_page_pool():
+    global _page_pool, _cancel_flags, _free_slots
+    with _pool_lock:
+        if _page_pool is None:
+            _cancel_flags = multiprocessing.Array('b', CANCEL_SLOTS)
+            _free_slots = queue.Queue()
+            for slot in range(CANCEL_SLOTS):
+                _free_slots.put(slot)
+            # Children must not inherit open database sockets; the parent
+            # reconnects lazily on its next query.
+            connections.close_all()
+            _page_pool = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'VALIDATOR_PAGE_WORKERS', 1),
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=_init_page_worker,
+                initargs=(_cancel_flags,),
+            )
+        return _page_pool
+
+def shutdown_page_pool():
+    """Stop the page workers; the next parallel search forks fresh ones."""
+    global _page_pool
+    with _pool_lock:
+        if _page_pool is not None:
+            _page_pool.shutdown(cancel_futures=True)
+            _page_pool = None
+
+def _search_page(pdf_path, page_num, stamps, slot, dpi, image=None):
+    """Pool task: rasterize one page, unless already given, and look for an approved stamp on it.
+
+    Returns (StampMatch or None, stage totals and stamp candidates recorded in the worker).
+    """
+    with profiled() as profile, recording() as candidates:
+        if _cancel_flags[slot]:
+            return None, profile.stages, candidates
+        if image is None:
+            mode = consumer_options('stamp')[1]
+            with stage('rasterize'):
+                images = convert_from_path(pdf_path, dpi=dpi, first_page=page_num, last_page=page_num)
+            if not images or _cancel_flags[slot]:
+                return None, profile.stages, candidates
+            image = images[0].convert(mode)
+        approved_stamps = [DoctorStamp(id=stamp_id, image=name) for stamp_id, name in stamps]
+        matched = match_stamp_on_page(image, approved_stamps, page=page_num)
+    return matched, profile.stages, candidates
+
+def _release_slot_when_done(futures, slot):
+    """Return a cancel slot once pages that were already running have stopped."""
+    pending = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(future):
+        with lock:
+            pending[0] -= 1
+            if pending[0] == 0:
+                _free_slots.put(slot)
+
+    for future in futures:
+        future.add_done_callback(on_done)
+
+def search_pages_in_parallel(pages, approved_stamps, report):
+    """Search every page in the pool and stop the others at the first match."""
+    page_count = pages.page_count
+    stamps = [(stamp.pk, stamp.image.name) for stamp in approved_stamps if stamp.image]
+    descriptor_store.version  # Make sure the store exists before workers read it
+
+    pool = _get_page_pool()
+    slot = _free_slots.get()
+    _cancel_flags[slot] = 0
+    pages.plan()
+    dpi, mode = consumer_options('stamp')
+    dpi = min(dpi, pages.dpi)
+    futures = []
+    for page_num in range(1, page_count + 1):
+        # Pages the OCR stage already rendered are shipped to the worker instead of re-rendered.
+        image = np.array(pages.page(page_num, dpi=dpi, mode=mode)) if pages.is_rendered(page_num) else None
+        futures.append(pool.submit(_search_page, pages.pdf_path, page_num, stamps, slot, dpi, image))
+    stamp_match = None
+    failed = []
+    profile = current_profile()
+    recorded = current_candidates()
     try:
-        temp_pdf_path = default_storage.save(f'temp/{pdf_file.name}', pdf_file)
-        temp_pdf_full_path = os.path.join(default_storage.location, temp_pdf_path)
-        logger.debug(f"Saved temporary PDF: {temp_pdf_full_path}")
-
-        text = extract_text_from_pdf(temp_pdf_full_path)
-        normalized_text = normalize(text)
-        logger.debug(f"Normalized extracted text: {normalized_text}")
-
-        approved_hospitals = [normalize(name) for name in Hospital.objects.values_list('name', flat=True)]
-        approved_diseases = [normalize(name) for name in DiseaseType.objects.values_list('name', flat=True)]
-        logger.debug(f"Approved hospitals: {approved_hospitals}")
-        logger.debug(f"Approved diseases: {approved_diseases}")
-
-        hospital_found = False
-        for hospital in approved_hospitals:
-            if fuzz.partial_ratio(hospital, normalized_text) > 90:  # Aligned with PDFValidationView
-                hospital_found = True
-                logger.debug(f"Matched hospital: {hospital}")
-                break
-        if not hospital_found:
-            logger.debug("No hospital matched. Checking substrings:")
-            for hospital in approved_hospitals:
-                logger.debug(f"Checking hospital: {hospital}, In text: {hospital in normalized_text}")
-
-        disease_found = False
-        for disease in approved_diseases:
-            if fuzz.partial_ratio(disease, normalized_text) > 90:  # Fuzzy matching for diseases
-                disease_found = True
-                logger.debug(f"Matched disease: {disease}")
+        for done, future in enumerate(as_completed(futures), 1):
+            report(60 + 35 * done // page_count)
+            try:
+                matched, stages, candidates = future.result()
+            except Exception as e:
+                logger.error(f"Page stamp search error: {str(e)}")
+                failed.append(e)
+                continue
+            if profile is not None:
+                profile.merge(stages)
+            if recorded is not None:
+                recorded.extend(candidates)
+            if matched:
+                stamp_match = matched
+                logger.debug(f"Stamp matched on a page, cancelling {page_count - done} remaining pages")
                 break
-        logger.debug(f"Hospital found: {hospital_found}, Disease found: {disease_found}")
-
-        images = pdf_to_images(temp_pdf_full_path)
-        stamp_matched = False
-        approved_stamps = DoctorStamp.objects.all()
-        for image in images:
-            stamp_path = extract_stamp_from_image(image, approved_stamps)
-            if stamp_path:
-                logger.debug(f"Attempting to match stamp: {stamp_path}")
-                if match_stamp(stamp_path, approved_stamps):
-                    stamp_matched = True
-                    logger.debug(f"Stamp matched: {stamp_path}")
-                    os.remove(stamp_path)
-                    break
-                os.remove(stamp_path)
-            else:
-                logger.debug("No stamp found in image")
-
-        default_storage.delete(temp_pdf_path)
-
-        if hospital_found and disease_found and stamp_matched:
-            logger.info("PDF validation successful")
-            return {'result': 'ACCEPTED', 'reason': 'Valid hospital, disease, and stamp found'}
-        else:
-            result = 'REJECTED'
-            reasons = []
-            if not hospital_found:
-                reasons.append("This Hospital is not among the officially authorized hospitals")
-            if not disease_found:
-                reasons.append("The disease type is not recognized as an eligible condition")
-            if not stamp_matched:
-                reasons.append("This doctor is not an authorized approver")
-            reason = ', '.join(reasons)
-            logger.warning(f"PDF validation failed: {reason}")
-            return {'result': result, 'reason': reason}
-
+    finally:
+        _cancel_flags[slot] = 1
+        for future in futures:
+            future.cancel()
+        _release_slot_when_done(futures, slot)
+    if any(isinstance(e, BrokenProcessPool) for e in failed):
+        # A worker died; fork fresh ones for the next document.
+        shutdown_page_pool()
+    if stamp_match is None and failed:
+        raise ValidationIncomplete(f'Stamp search failed on {len(failed)} of {page_count} pages: {failed[0]}')
+    return stamp_match
+
+def find_stamp_in_pdf(pdf_path, approved_stamps, progress=None, pages=None):
+    """Return the StampMatch of the first page carrying an approved stamp, or None.
+
+    Raises ValidationIncomplete when a page could not be searched and no other page matched.
+    """
+    report = progress or (lambda percent: None)
+    pages = pages or PageImageProvider(pdf_path)
+    if getattr(settings, 'VALIDATOR_PAGE_WORKERS', 1) > 1:
+        if _page_pool is not None or not any(conn.in_atomic_block for conn in connections.all(initialized_only=True)):
+            return search_pages_in_parallel(pages, approved_stamps, report)
+        # Starting the pool closes database connections, which would break the open transaction.
+        logger.warning("Page pool not started inside a transaction, searching pages serially")
+
+    report(60)
+    try:
+        for page_num, image in pages.pages('stamp'):
+            report(60 + 35 * page_num // pages.page_count)
+            matched = match_stamp_on_page(image, approved_stamps, page=page_num)
+            if matched:
+                return matched
     except Exception as e:
-        logger.error(f"Validation error: {str(e)}")
-        if 'temp_pdf_path' in locals():
-            default_storage.delete(temp_pdf_path)
-        return {'result': 'REJECTED', 'reason': f'Validation error: {str(e)}'}
+        logger.error(f"Stamp search error: {str(e)}")
+        raise ValidationIncomplete(f'Stamp search failed: {str(e)}') from e
+    return None
 
-def match_stamp(extracted_stamp_path, approved_stamps):
-    """Match the extracted stamp against approved stamps using ORB."""
-    try:
-        if not os.path.exists(extracted_stamp_path):
-            logger.error(f"Extracted stamp file not found: {extracted_stamp_path}")
-            return False
+def match_stamp(extracted_stamp, approved_stamps):
+    """Match the extracted stamp against approved stamps using ORB.
 
-        extracted_img = cv2.imread(extracted_stamp_path, cv2.IMREAD_GRAYSCALE)
-        if extracted_img is None:
-            logger.error(f"Failed to load extracted stamp image: {extracted_stamp_path}")
-            return False
+    ``extracted_stamp`` is a grayscale image array, or the path of an image file.
+    Returns a StampMatch for the first approved stamp that verifies, or None.
+    """
+    try:
+        if isinstance(extracted_stamp, np.ndarray):
+            extracted_img = extracted_stamp
+        else:
+            if not os.path.exists(extracted_stamp):
+                logger.error(f"Extracted stamp file not found: {extracted_stamp}")
+                return None
 
-        extracted_img = cv2.GaussianBlur(extracted_img, (5, 5), 0)
-        extracted_img = cv2.equalizeHist(extracted_img)
+            extracted_img = cv2.imread(extracted_stamp, cv2.IMREAD_GRAYSCALE)
+            if extracted_img is None:
+                logger.error(f"Failed to load extracted stamp image: {extracted_stamp}")
+                return None
 
-        orb = cv2.ORB_create(nfeatures=2000)
-        kp1, des1 = orb.detectAndCompute(extracted_img, None)
+        des1 = stamp_descriptors(extracted_img)
         if des1 is None:
-            logger.debug("No keypoints detected in extracted stamp")
-            return False
-
-        for stamp in approved_stamps:
-            if not hasattr(stamp, 'image') or not stamp.image:
-                logger.warning(f"Invalid stamp object in database: {stamp}")
-                continue
-
-            approved_img_path = stamp.image.path
-            if not os.path.exists(approved_img_path):
-                logger.error(f"Approved stamp image not found: {approved_img_path}")
-                continue
+            return None
+        return match_descriptors(des1, {stamp.pk for stamp in approved_stamps})
 
-            approved_img = cv2.imread(approved_img_path, cv2.IMREAD_GRAYSCALE)
-            if approved_img is None:
-                logger.error(f"Failed to load approved stamp image: {approved_img_path}")
-                continue
-
-            approved_img = cv2.GaussianBlur(approved_img, (5, 5), 0)
-            approved_img = cv2.equalizeHist(approved_img)
+    except Exception as e:
+        logger.error(f"Stamp matching error: {str(e)}")
+        return None
 
-            kp2, des2 = orb.detectAndCompute(approved_img, None)
-            if des2 is None:
-                logger.debug(f"No keypoints detected in approved stamp: {approved_img_path}")
+def stamp_features(extracted_img):
+    """(keypoints, descriptors) of an extracted stamp image, or (None, None) when it has no keypoints."""
+    try:
+        kp1, des1 = compute_orb_features(extracted_img)
+    except Exception as e:
+        logger.error(f"Stamp feature extraction error: {str(e)}")
+        return None, None
+    if des1 is None:
+        logger.debug("No keypoints detected in extracted stamp")
+    return kp1, des1
+
+def stamp_descriptors(extracted_img):
+    """ORB descriptors of an extracted stamp image, or None when it has no keypoints."""
+    return stamp_features(extracted_img)[1]
+
+def verify_stamp(des1, des2):
+    """Number of cross-checked ORB matches between a candidate and a stamp, or 0 if they do not verify."""
+    matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(des1, np.ascontiguousarray(des2))
+    return len(matches) if len(matches) > 1 else 0  # Further lowered threshold
+
+def confirm_stamp(kp1, des1, kp2, des2):
+    """Number of geometrically consistent ORB matches between a candidate and a stamp, or 0.
+
+    Unlike ``verify_stamp``, unrelated stamps and text crops do not pass:
+    matches must survive Lowe's ratio test and fit one rotation, scale and
+    shift under RANSAC. The stamp is confirmed when there are at least
+    VALIDATOR_STAMP_MIN_INLIERS inliers making up at least
+    VALIDATOR_STAMP_MIN_INLIER_RATIO of the ratio-test matches, and some of
+    them fall inside the stamp rather than all on its border, which stamps
+    of one printed design share.
+    """
+    if len(des1) < 2 or len(des2) < 2:
+        return 0
+    ratio = getattr(settings, 'VALIDATOR_STAMP_RATIO_TEST', 0.75)
+    pairs = cv2.BFMatcher(cv2.NORM_HAMMING).knnMatch(des1, np.ascontiguousarray(des2), k=2)
+    good = [pair[0] for pair in pairs if len(pair) == 2 and pair[0].distance < ratio * pair[1].distance]
+    min_inliers = getattr(settings, 'VALIDATOR_STAMP_MIN_INLIERS', 40)
+    if len(good) < min_inliers:
+        return 0
+    src = np.float32([kp1[m.queryIdx][:2] for m in good])
+    dst = np.float32([kp2[m.trainIdx][:2] for m in good])
+    transform, mask = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC, ransacReprojThreshold=5.0)
+    if transform is None:
+        return 0
+    mask = mask.ravel().astype(bool)
+    inliers = int(mask.sum())
+    if inliers < min_inliers or inliers < getattr(settings, 'VALIDATOR_STAMP_MIN_INLIER_RATIO', 0.5) * len(good):
+        return 0
+    # The inner half of the stamp's keypoints, around their median position.
+    centre = np.median(kp2[:, :2], axis=0)
+    radius = np.median(np.linalg.norm(kp2[:, :2] - centre, axis=1))
+    if np.mean(np.linalg.norm(dst[mask] - centre, axis=1) < radius) < MIN_INTERIOR_SHARE:
+        return 0
+    return inliers
+
+def match_descriptors(des1, approved_ids):
+    """Return a StampMatch for the first approved stamp the descriptors verify against, or None."""
+    try:
+        # Only verify the few stamps the retrieval index ranks highest.
+        candidate_ids = [stamp_id for stamp_id in stamp_index.candidates(des1) if stamp_id in approved_ids]
+        logger.debug(f"Stamp index candidates: {candidate_ids}")
+
+        for stamp_id in candidate_ids:
+            des2 = descriptor_store.get(stamp_id)
+            if des2 is None or not len(des2):
+                logger.debug(f"No stored descriptors for approved stamp: {stamp_id}")
                 continue
 
-            bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-            matches = bf.match(des1, des2)
-            logger.debug(f"Found {len(matches)} matches for stamp: {approved_img_path}")
-
-            if len(matches) > 1:  # Further lowered threshold
-                logger.debug(f"Stamp matched with {len(matches)} matches: {approved_img_path}")
-                return True
+            matches = verify_stamp(des1, des2)
+            if matches:
+                logger.debug(f"Stamp matched with {matches} matches: {stamp_id}")
+                return StampMatch(stamp_id, matches)
 
         logger.debug("No matching stamp found")
-        return False
+        return None
 
     except Exception as e:
         logger.error(f"Stamp matching error: {str(e)}")
-        return False
\ No newline at end of file
+        return None
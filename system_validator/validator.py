@@ -0,0 +1,32 @@
+# Lazy entry points to the validator.
+#
+# Importing this module is cheap. OpenCV, NumPy, pdf2image, PyPDF2, pytesseract
+# and RapidFuzz load on the first validation, so web workers, management
+# commands and tests that never validate a PDF do not pay for them.
+import sys
+
+HEAVY_MODULES = ['cv2', 'numpy', 'pdf2image', 'PyPDF2', 'pytesseract', 'rapidfuzz']
+
+
+def load():
+    """Import the validation engine and everything it needs; returns the engine module."""
+    from . import engine
+    return engine
+
+
+def loaded():
+    """Whether the validation engine has been imported in this process."""
+    return 'system_validator.engine' in sys.modules
+
+
+def validate_pdf(pdf_file, progress=None, debug=False):
+    """Validate a Medical campaign PDF for hospital, disease, and stamp.
+
+    See system_validator.engine.validate_pdf.
+    """
+    return load().validate_pdf(pdf_file, progress=progress, debug=debug)
+
+
+def recheck_evidence(table, pk):
+    """Re-check stored evidence against an added reference row; see ValidationEngine.recheck."""
+    return load().validation_engine.recheck(table, pk)
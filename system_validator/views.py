@@ -1,95 +1,71 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import CONTENT_TYPE_LATEST
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Hospital, DiseaseType, DoctorStamp
-from .utils import extract_text_from_pdf, pdf_to_images, extract_stamp_from_image, match_stamp
-import os
-import unicodedata
+from rest_framework.exceptions import Throttled
+from .admission import AdmissionRejected, admission
+from .validator import validate_pdf
+from . import metrics
+import hmac
 import logging
-from fuzzywuzzy import fuzz
 
 logger = logging.getLogger(__name__)
 
-def normalize(text):
-    """Normalize text for comparison."""
-    return unicodedata.normalize("NFKD", text.lower().strip())
-
 class PDFValidationView(APIView):
     def post(self, request):
         if 'pdf_file' not in request.FILES:
             return Response({'error': 'No PDF file provided'}, status=status.HTTP_400_BAD_REQUEST)
 
-        pdf_file = request.FILES['pdf_file']
-        pdf_path = 'temp.pdf'
-        with open(pdf_path, 'wb') as f:
-            for chunk in pdf_file.chunks():
-                f.write(chunk)
-
+        # ?debug=1 adds per-stage timings for staff, or for anyone when DEBUG is on.
+        debug = bool(request.query_params.get('debug')) and (settings.DEBUG or request.user.is_staff)
         try:
-            text = extract_text_from_pdf(pdf_path)
-            normalized_text = normalize(text)
-            logger.debug(f"Normalized extracted text: {normalized_text}")
+            with admission.admit('validation request'):
+                verdict = validate_pdf(request.FILES['pdf_file'], debug=debug)
+        except AdmissionRejected as e:
+            raise Throttled(wait=e.retry_after, detail=f'{e}, please try again later.')
 
-            approved_hospitals = [normalize(name) for name in Hospital.objects.values_list('name', flat=True)]
-            approved_diseases = [normalize(name) for name in DiseaseType.objects.values_list('name', flat=True)]
-            logger.debug(f"Approved hospitals: {approved_hospitals}")
-            logger.debug(f"Approved diseases: {approved_diseases}")
+        if 'error' in verdict:
+            result = 'Error'
+            reason = f'Processing failed: {verdict["error"]}'
+        elif verdict['result'] == 'ACCEPTED':
+            result = 'Your document has been "ACCEPTED"'
+            reason = 'All requirements have been successfully met and verified.'
+        else:
+            evidence = verdict['evidence']
+            result = 'Your document has been "REJECTED"'
+            reason = []
+            if not evidence['hospital']:
+                reason.append('This Hospital is not among the officially authorized hospitals to issue medical support letters')
+            if not evidence['disease']:
+                reason.append('The submitted disease type is not recognized as one of the eligible critical conditions for medical support.')
+            if not evidence['stamp']:
+                reason.append("This doctor is not recognized as an authorized approver for medical support.")
+            reason = ', '.join(reason)
 
-            hospital_found = False
-            for hospital in approved_hospitals:
-                if fuzz.partial_ratio(hospital, normalized_text) > 90:
-                    hospital_found = True
-                    logger.debug(f"Matched hospital: {hospital}")
-                    break
-            if not hospital_found:
-                logger.debug("No hospital matched. Checking substrings:")
-                for hospital in approved_hospitals:
-                    logger.debug(f"Checking hospital: {hospital}, In text: {hospital in normalized_text}")
+        response = {'result': result, 'reason': reason}
+        if 'timings' in verdict:
+            response['timings'] = verdict['timings']
+        return Response(response)
 
-            disease_found = False
-            for disease in approved_diseases:
-                if fuzz.partial_ratio(disease, normalized_text) > 90:
-                    disease_found = True
-                    logger.debug(f"Matched disease: {disease}")
-                    break
-            logger.debug(f"Hospital found: {hospital_found}, Disease found: {disease_found}")
 
-            images = pdf_to_images(pdf_path)
-            stamp_matched = False
-            approved_stamps = DoctorStamp.objects.all()
-            for image in images:
-                stamp_path = extract_stamp_from_image(image, approved_stamps)
-                if stamp_path:
-                    logger.debug(f"Attempting to match stamp: {stamp_path}")
-                    if match_stamp(stamp_path, approved_stamps):
-                        stamp_matched = True
-                        logger.debug(f"Stamp matched: {stamp_path}")
-                        os.remove(stamp_path)
-                        break
-                    os.remove(stamp_path)
-                else:
-                    logger.debug("No stamp found in image")
+def metrics_allowed(request):
+    """Whether a scrape carries METRICS_TOKEN as a bearer token or, without a token set, comes from an allowed IP.
 
-            if hospital_found and disease_found and stamp_matched:
-                result = 'Your document has been "ACCEPTED"'
-                reason = 'All requirements have been successfully met and verified.'
-            else:
-                result = 'Your document has been "REJECTED"'
-                reason = []
-                if not hospital_found:
-                    reason.append('This Hospital is not among the officially authorized hospitals to issue medical support letters')
-                if not disease_found:
-                    reason.append('The submitted disease type is not recognized as one of the eligible critical conditions for medical support.')
-                if not stamp_matched:
-                    reason.append("This doctor is not recognized as an authorized approver for medical support.")
-                reason = ', '.join(reason)
+    Behind a reverse proxy REMOTE_ADDR is the proxy for every client, so
+    deployments with one must set METRICS_TOKEN; the IP allowlist is only
+    meant for scrapers that connect to the application server directly.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+        return scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode(), token.encode())
+    return request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1', '::1'])
 
-        except Exception as e:
-            result = 'Error'
-            reason = f'Processing failed: {str(e)}'
-            logger.error(f"Validation error: {str(e)}")
-        finally:
-            if os.path.exists(pdf_path):
-                os.remove(pdf_path)
 
-        return Response({'result': result, 'reason': reason})
\ No newline at end of file
+def metrics_view(request):
+    """Prometheus exposition of the validator, API and Celery series, for authorized scrapers."""
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type=CONTENT_TYPE_LATEST)
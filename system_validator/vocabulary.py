@@ -0,0 +1,150 @@
+# Compiled multi-pattern matching of hospital and disease names against document text.
+import re
+import threading
+import unicodedata
+import logging
+from collections import defaultdict, deque
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from .models import Hospital, DiseaseType, ReferenceVersion
+
+logger = logging.getLogger(__name__)
+
+FUZZY_THRESHOLD = 90
+TOKEN_RE = re.compile(r'\w+')
+
+
+def canonical(text):
+    """Lower-case, NFKD-normalize and collapse everything but word characters to single spaces."""
+    return ' '.join(TOKEN_RE.findall(unicodedata.normalize("NFKD", text.lower())))
+
+
+class AhoCorasick:
+    """Exact multi-pattern substring search in one pass over the text."""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for index, pattern in enumerate(patterns):
+            node = 0
+            for char in pattern:
+                if char not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[node][char] = len(self.goto) - 1
+                node = self.goto[node][char]
+            self.output[node].append(index)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def search(self, text):
+        """Return the set of pattern indexes occurring in text."""
+        found = set()
+        node = 0
+        goto, fail, output = self.goto, self.fail, self.output
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.update(output[node])
+        return found
+
+
+class VocabularyMatcher:
+    """Find which of a set of names occurs in a text, exactly or approximately.
+
+    Exact occurrences come from an Aho-Corasick automaton. When there is none,
+    names are scored in one RapidFuzz ``cdist`` batch against every window of
+    the text with the same number of words, one fewer or one more, which
+    approximates ``partial_ratio(name, text)`` without a Python loop over the
+    vocabulary. The shorter and longer windows catch words that OCR merged
+    ("BlackLion") or split ("Hos pital").
+    """
+
+    def __init__(self, names, threshold=FUZZY_THRESHOLD):
+        self.threshold = threshold
+        self.names = []
+        self.patterns = []
+        for name in names:
+            pattern = canonical(name)
+            if pattern:
+                self.names.append(name)
+                self.patterns.append(pattern)
+        self.automaton = AhoCorasick(self.patterns)
+        self.by_length = defaultdict(list)
+        for index, pattern in enumerate(self.patterns):
+            self.by_length[pattern.count(' ') + 1].append(index)
+
+    def exact(self, text):
+        """Return (name, 100) for the longest name found verbatim, or None."""
+        found = self.automaton.search(canonical(text))
+        if not found:
+            return None
+        index = max(found, key=lambda i: len(self.patterns[i]))
+        return self.names[index], 100.0
+
+    def match(self, text):
+        """Return (name, score) of the best matching name above the threshold, or None."""
+        best = self.exact(text)
+        if best is not None:
+            return best
+        tokens = canonical(text).split(' ')
+        best_score = 0.0
+        for length, indexes in self.by_length.items():
+            windows = [
+                ' '.join(tokens[i:i + size])
+                for size in (length - 1, length, length + 1) if 0 < size <= len(tokens)
+                for i in range(len(tokens) - size + 1)
+            ]
+            if not windows:
+                continue
+            scores = process.cdist(
+                [self.patterns[i] for i in indexes], windows,
+                scorer=fuzz.ratio, score_cutoff=self.threshold, workers=-1,
+            )
+            row = int(np.argmax(scores.max(axis=1)))
+            score = float(scores[row].max())
+            if score > self.threshold and score > best_score:
+                best, best_score = (self.names[indexes[row]], score), score
+        return best
+
+
+_matchers = {}
+_lock = threading.Lock()
+
+
+def _matcher(model, version):
+    key = model._meta.label
+    cached = _matchers.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _lock:
+        cached = _matchers.get(key)
+        if cached is None or cached[0] != version:
+            matcher = VocabularyMatcher(model.objects.values_list('name', flat=True))
+            logger.debug(f"Compiled {key} vocabulary: {len(matcher.names)} names")
+            cached = _matchers[key] = (version, matcher)
+    return cached[1]
+
+
+def get_matchers():
+    """Return (hospital matcher, disease matcher), rebuilt when the tables change."""
+    versions = ReferenceVersion.current()
+    return (
+        _matcher(Hospital, versions.get(ReferenceVersion.HOSPITAL, 0)),
+        _matcher(DiseaseType, versions.get(ReferenceVersion.DISEASE, 0)),
+    )
@@ -0,0 +1,90 @@
+# Build the validator's read-only state ahead of the first validation.
+#
+# With VALIDATOR_WARMUP on, AppConfig.ready() runs warm_up() in the process that
+# loads Django. Under gunicorn --preload, or a Celery prefork pool, that is the
+# master, so the forked workers inherit the compiled vocabularies, stamp
+# templates and descriptor index and share their memory pages copy-on-write.
+# gc.freeze() keeps the collector from writing to those objects after the fork.
+#
+# Saving reference data does not rebuild anything in the saving process: every
+# worker's caches check the reference version and refresh on their next
+# validation. To bring the master up to date, so that workers forked from then
+# on start warm, reload the server after reference changes. With gunicorn,
+# send SIGHUP to the master: the on_reload hook in gunicorn.conf.py calls
+# warm_up_on_reload() before the new workers are forked. A Celery worker
+# re-executes itself on SIGHUP and warms up again in AppConfig.ready().
+import gc
+import time
+import logging
+import warnings
+
+from django.conf import settings
+from django.db import connections
+
+from .models import DoctorStamp
+from . import validator
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up(before_fork=False):
+    """Load the engine and build the reference data caches in this process.
+
+    Caches that are already current are left alone, so this doubles as the
+    refresh after reference data changes. The OCR worker pool is not started:
+    its processes cannot be inherited by a fork, so each worker starts its own
+    on first use. ``before_fork`` also closes database connections and freezes
+    the garbage collector. Returns counts of what was built.
+    """
+    started = time.perf_counter()
+    validator.load()
+    from .vocabulary import get_matchers
+    from .stamp_index import stamp_index
+    from .stamp_cache import template_cache
+    from .template_search import coarse_scales
+    from .ocr import tesserocr_available
+
+    hospitals, diseases = get_matchers()
+    stamp_index.sync()
+    factor = getattr(settings, 'VALIDATOR_STAMP_COARSE_FACTOR', 0.25)
+    scales = coarse_scales(getattr(settings, 'VALIDATOR_STAMP_COARSE_SCALE_STEP', 1.1))
+    stamps = 0
+    for stamp in DoctorStamp.objects.defer('orb_keypoints', 'orb_descriptors')[:template_cache._limit()]:
+        templates = template_cache.get(stamp)
+        if templates is not None:
+            templates.coarse(factor, scales)
+            stamps += 1
+    tesserocr_available()
+
+    if before_fork:
+        # Forked workers must open their own database connections.
+        connections.close_all()
+        gc.collect()
+        gc.freeze()
+    built = {'hospitals': len(hospitals.names), 'diseases': len(diseases.names), 'stamps': stamps}
+    logger.info(f"Warmed up validator state in {time.perf_counter() - started:.2f}s: {built}")
+    return built
+
+
+def warm_up_on_ready():
+    """AppConfig.ready() hook: warm up and freeze, or log why it could not."""
+    try:
+        with warnings.catch_warnings():
+            # Querying while apps load is deliberate here and only happens with VALIDATOR_WARMUP.
+            warnings.filterwarnings('ignore', message='Accessing the database during app initialization')
+            warm_up(before_fork=True)
+    except Exception as e:
+        logger.warning(f"Validator warm-up failed, state will be built on first use: {str(e)}")
+
+
+def warm_up_on_reload():
+    """Server reload hook: rebuild the master's stale state before new workers are forked.
+
+    The state frozen by the previous warm-up is unfrozen first, so the
+    collector can free what this rebuild replaces.
+    """
+    gc.unfreeze()
+    try:
+        warm_up(before_fork=True)
+    except Exception as e:
+        logger.warning(f"Validator reload failed, workers will refresh state on first use: {str(e)}")